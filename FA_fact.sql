@@ -0,0 +1,36 @@
+-- Faktury pro dimenzní režim (sync.dimensions / sync.views): jen klíče Ref*,
+-- texty středisek, činností a firem doplní view z tabulek dim_*.
+SELECT
+  CONCAT('FA-', r.ID) AS ID
+  , '<DATABASE>' AS _database
+  , 'faktury' AS Agenda
+  , CASE
+      RelTpFak
+      WHEN 1 THEN 'faktura vydaná'
+      WHEN 4 THEN 'zálohová faktura vydaná'
+      WHEN 5 THEN 'pohledávky'
+      WHEN 8 THEN 'opravný daňový doklad k faktuře vydané'
+      WHEN 11 THEN 'faktura přijatá'
+      WHEN 14 THEN 'zálohová faktura přijatá'
+      WHEN 15 THEN 'závazky'
+      WHEN 18 THEN 'opravný daňový doklad k faktuře přijate'
+      ELSE '(jiné)'
+    END AS TypDokladu
+  , h.Cislo AS CisloDokladu
+  , CAST(h.Datum AS DATE) AS Datum
+  , COALESCE(NULLIF(r.RefCin, 0), NULLIF(h.RefCin, 0)) RefCin
+  , COALESCE(NULLIF(r.RefStr, 0), NULLIF(h.RefStr, 0)) RefStr
+  , h.RelStorn
+  , h.RefAD
+  , r.Kod
+  , r.SText
+  , r.VCislo
+  , r.Mnozstvi
+  , r.Prenes
+  , r.KcJedn
+  , r.Sleva
+  , r.Kc
+FROM FA h
+LEFT JOIN FApol r ON r.RefAg = h.ID
+WHERE COALESCE(h.DatSave, h.DatCreate ) >= GETDATE() - <DAYS_BACK>
+;
@@ -29,7 +29,7 @@ SELECT
   , uh.IDS TypUhrady
   , k.IDS KodKasa
   , k.SText Kasa
-  , h.Firma 
+  , h.Firma AS Firma_1
   , h.Jmeno 
   , h.SText AS HlavickaSText
 FROM PH h
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark synchronizace - syntetická data Pohody, fake MS SQL kurzor
+a fake BigQuery klient (benchmarks/synthetic.py, benchmarks/fakes.py).
+
+Měří propustnost (řádky/s) a špičku paměti jednotlivých kroků i celého
+sync_query bez sítě a bez serverů:
+
+    prepare_sql         úprava SQL souboru (prefix tabulek, <DAYS_BACK>)
+    prepare_dataframe   původní převod přes pandas (po buňkách), schéma podle názvů
+    rows_to_arrow:names převod dávky pyodbc řádků na Arrow, stejné schéma jako
+                        prepare_dataframe (build_bq_schema) - srovnání 1:1
+    rows_to_arrow:typed totéž se schématem z cursor.description (infer_bq_schema)
+    arrow_to_schema:*   přetypování kolumnární dávky (backend arrow-odbc), obě schémata
+    stream:*            _stream_to_temp - sekvenčně, upload_workers, spool, batch_bytes_mb
+    sync_query          celý dotaz včetně finalizace a zápisu stavu
+
+Každý případ běží ve vlastním procesu, takže špička RSS (ru_maxrss po
+vygenerování dat) patří jen jemu.
+
+    python benchmarks/bench_sync.py --rows 50000 --shape FA PH SKz
+    python benchmarks/bench_sync.py --only stream --load-latency 0.2
+"""
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import pandas as pd  # noqa: E402
+
+import sync_pohoda_to_bigquery as s  # noqa: E402
+from fakes import FakeBigQuery, FakeConnection, FakeCursor  # noqa: E402
+from synthetic import SHAPES, arrow_batch, description, synthetic_rows  # noqa: E402
+
+SQL_FILES = {"FA": "FA.sql", "PH": "PH.sql", "SKz": "SKzExtended.sql"}
+
+# varianty _stream_to_temp (sync konfigurace navíc k batch_size)
+STREAM_VARIANTS = {
+    "stream": {},
+    "stream:workers3": {"upload_workers": 3},
+    "stream:spool": {"spool": True, "spool_file_max_mb": 64},
+    "stream:bytes": {"batch_bytes_mb": 8},
+}
+
+
+def _syncer(bq: FakeBigQuery, cursor: FakeCursor, workdir: str, **sync_cfg) -> s.PohodaBigQuerySync:
+    syncer = s.PohodaBigQuerySync({
+        "name": "bench",
+        "bigquery": {"project_id": "bench", "dataset": "pohoda"},
+        "sync": {"state_file": f"{workdir}/state.db", "spool_dir": workdir, **sync_cfg},
+    })
+    syncer.bq_client = bq
+    syncer.mssql_pool = s.ConnectionPool(lambda: FakeConnection(cursor), 1)
+    return syncer
+
+
+def _run_case(case: str, shape: str, n: int, repeat: int, batch_size: int,
+              load_latency: float) -> dict:
+    """Jeden případ v čistém procesu: nejlepší čas z repeat a nárůst špičky RSS."""
+    rows = synthetic_rows(shape, n)
+    columns = SHAPES[shape].columns
+    desc = description(shape, rows)
+    schema = s.infer_bq_schema(desc, columns)
+    # prepare_dataframe zná jen názvy sloupců - :names případy mají stejné výstupní schéma
+    if case.endswith(":names"):
+        schema = s.build_bq_schema(columns)
+    sql = (ROOT / SQL_FILES[shape]).read_text(encoding="utf-8")
+    bq = FakeBigQuery(load_latency)
+    count = n
+
+    if case == "prepare_sql":
+        count = 200
+
+        def once():
+            for _ in range(count):
+                s.prepare_sql(sql, "POHODA", "StwPhHPA_02891042_2025", 7)
+    elif case == "prepare_dataframe":
+        def once():
+            df = pd.DataFrame.from_records(rows, columns=columns)
+            s.prepare_dataframe(df)
+    elif case.startswith("rows_to_arrow:"):
+        def once():
+            s.rows_to_arrow(rows, schema)
+    elif case.startswith("arrow_to_schema:"):
+        batch = arrow_batch(shape, rows)
+
+        def once():
+            s.arrow_to_schema(batch, schema)
+    elif case in STREAM_VARIANTS:
+        def once():
+            with tempfile.TemporaryDirectory() as workdir:
+                cursor = FakeCursor(rows, desc)
+                syncer = _syncer(bq, cursor, workdir, **STREAM_VARIANTS[case])
+                syncer._stream_to_temp(cursor, columns, schema, "bench.pohoda.t_temp", batch_size)
+    elif case == "sync_query":
+        def once():
+            # vlastní stavový soubor pro každé opakování (watermark, otisky)
+            with tempfile.TemporaryDirectory() as workdir:
+                cursor = FakeCursor(rows, desc)
+                syncer = _syncer(bq, cursor, workdir, batch_size=batch_size)
+                query = {
+                    "file": str(ROOT / SQL_FILES[shape]),
+                    "mode": "full" if shape == "SKz" else "incremental",
+                    "key": columns[0],
+                }
+                db = {"linked_server": "POHODA", "database": "StwPhHPA_02891042_2025"}
+                syncer.sync_query(db, query, backfill=False)
+    else:
+        raise ValueError(f"Neznámý případ '{case}'")
+
+    gc.collect()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = float("inf")
+    for _ in range(repeat):
+        bq.reset()
+        t0 = time.perf_counter()
+        once()
+        best = min(best, time.perf_counter() - t0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    # ru_maxrss je na Linuxu v KB, na macOS v bajtech
+    peak_bytes = peak if sys.platform == "darwin" else peak * 1024
+    return {
+        "case": case, "shape": shape, "count": count, "seconds": best,
+        "peak_mb": peak_bytes / 1024 / 1024, "uploaded": bq.uploaded_bytes,
+        "loads": len(bq.loads),
+    }
+
+
+CASES = ["prepare_sql", "prepare_dataframe", "rows_to_arrow:names", "rows_to_arrow:typed",
+         "arrow_to_schema:names", "arrow_to_schema:typed", *STREAM_VARIANTS, "sync_query"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark synchronizace")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--shape", nargs="+", choices=sorted(SHAPES), default=["FA"])
+    parser.add_argument("--only", nargs="+", metavar="PŘÍPAD",
+                        help=f"jen případy začínající zadaným textem ({', '.join(CASES)})")
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="simulovaná doba load jobu v sekundách")
+    args = parser.parse_args(argv)
+
+    cases = [c for c in CASES if not args.only or any(c.startswith(o) for o in args.only)]
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{args.rows} řádků, dávka {args.batch_size}, nejlepší z {args.repeat}, "
+          f"latence loadu {args.load_latency:g} s")
+    for shape in args.shape:
+        print(f"\n{shape} ({len(SHAPES[shape].columns)} sloupců)")
+        print(f"  {'případ':<21} {'čas':>10} {'propustnost':>16} {'špička RSS':>11} {'nahráno':>10}")
+        for case in cases:
+            with ctx.Pool(1, logging.disable, (logging.CRITICAL,)) as pool:
+                r = pool.apply(_run_case, (case, shape, args.rows, args.repeat,
+                                           args.batch_size, args.load_latency))
+            unit = "volání/s" if case == "prepare_sql" else "řádků/s"
+            uploaded = f"{r['uploaded'] / 1024 / 1024:7.1f} MB" if r["loads"] else ""
+            print(f"  {case:<21} {r['seconds'] * 1000:8.1f} ms "
+                  f"{r['count'] / r['seconds']:>10,.0f} {unit:<8}"
+                  f"{r['peak_mb']:8.1f} MB {uploaded:>10}")
+
+
+if __name__ == "__main__":
+    main()
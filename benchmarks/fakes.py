@@ -0,0 +1,114 @@
+"""
+Fake MS SQL kurzor a BigQuery klient pro benchmarky - bez sítě a bez serverů.
+
+FakeCursor vrací syntetické řádky přes fetchmany, FakeBigQuery přečte každý
+nahrávaný soubor (jako by ho posílal po síti), zaznamená load joby
+i finalizační SQL a volitelně přidá latenci load jobu.
+"""
+
+import threading
+import time
+from typing import List, Optional
+
+from google.cloud.exceptions import NotFound
+
+
+class FakeCursor:
+    """Kurzor ve stylu pyodbc nad předem vygenerovanými řádky."""
+
+    def __init__(self, rows: list, description: list):
+        self.rows = rows
+        self.description = description
+        self.pos = 0
+        self.executed: List[str] = []
+
+    def execute(self, sql: str, *params):
+        self.executed.append(sql)
+        self.pos = 0
+        return self
+
+    def fetchmany(self, size: int) -> list:
+        chunk = self.rows[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+    def fetchone(self):
+        return (len(self.rows), 0, None)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor: FakeCursor):
+        self._cursor = cursor
+
+    def cursor(self) -> FakeCursor:
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+class FakeJob:
+    statement_type = None
+    dml_stats = None
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def result(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return self
+
+
+class FakeBigQuery:
+    """BigQuery klient: load joby a SQL jen zaznamená, tabulky neexistují (NotFound)."""
+
+    def __init__(self, load_latency: float = 0.0):
+        self.load_latency = load_latency
+        self.loads: List[tuple] = []
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def load_table_from_file(self, f, table_id: str, job_config=None) -> FakeJob:
+        nbytes = len(f.read())
+        with self._lock:
+            self.loads.append((table_id, nbytes))
+        return FakeJob(self.load_latency)
+
+    def query(self, sql: str) -> FakeJob:
+        with self._lock:
+            self.queries.append(sql)
+        return FakeJob()
+
+    def copy_table(self, source, destination, job_config=None) -> FakeJob:
+        return FakeJob()
+
+    def get_table(self, table_id: str):
+        raise NotFound(table_id)
+
+    def create_table(self, table, exists_ok: bool = False):
+        return table
+
+    def update_table(self, table, fields: list):
+        return table
+
+    def delete_table(self, table_id: str, not_found_ok: bool = False):
+        pass
+
+    def list_jobs(self, parent_job=None) -> list:
+        return []
+
+    def close(self):
+        pass
+
+    @property
+    def uploaded_bytes(self) -> int:
+        return sum(n for _, n in self.loads)
+
+    def reset(self, load_latency: Optional[float] = None):
+        self.loads, self.queries = [], []
+        if load_latency is not None:
+            self.load_latency = load_latency
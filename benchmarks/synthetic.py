@@ -0,0 +1,140 @@
+"""
+Syntetické výsledky dotazů ve tvaru FA.sql, PH.sql a SKzExtended.sql.
+
+Hodnoty mají typy, jaké vrací pyodbc z Pohody: Decimal (ceny, množství),
+GUID jako 16 bajtů, datetime/date, int reference s NULL, bool (RelStorn) a
+český text různé délky. Generátor je deterministický (seed), takže se
+běhy benchmarku dají porovnávat.
+"""
+
+import decimal
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple
+
+import pyarrow as pa
+
+FIRMY = [
+    "Lékárna U Zlatého hada s.r.o.", "Nemocnice Na Homolce", "Zdravotnické potřeby Žďár a.s.",
+    "Pavel Dvořák - velkoobchod", "Lékárna Šťastný Čtvrtek", None,
+]
+STREDISKA = ["Středisko Žižkov", "Centrála Brno", "Sklad Ústí nad Labem", "Eshop"]
+ZBOZI = [
+    "Léčivý přípravek 10 tbl.", "Dětská výživa s příchutí jahody 190 g",
+    "Obvazový materiál sterilní, čtvercový 10×10 cm, balení po 25 ks",
+    "Vitamín C 500 mg, 30 šumivých tablet s pomerančovou příchutí",
+    "Náplast hřejivá", "Krém na ruce s heřmánkem a měsíčkem lékařským 100 ml",
+]
+POZNAMKY = [
+    None, None, "Platba předem", "Doprava zdarma, zákazník si vyzvedne osobně na pobočce",
+    "Reklamace vyřízena dobropisem č. 25DV00123; zboží vráceno na sklad",
+]
+
+
+class Shape(NamedTuple):
+    """Tvar výsledku: názvy sloupců a generátor jednoho řádku."""
+    columns: List[str]
+    row: Callable[[random.Random, int], tuple]
+
+
+def _money(rnd: random.Random, hi: int, places: int = 2) -> decimal.Decimal:
+    return decimal.Decimal(rnd.randrange(1, hi)).scaleb(-places)
+
+
+def _guid(rnd: random.Random) -> bytes:
+    return uuid.UUID(int=rnd.getrandbits(128)).bytes_le
+
+
+def _null(rnd: random.Random, value, ratio: float = 0.1):
+    return None if rnd.random() < ratio else value
+
+
+def _datum(rnd: random.Random) -> datetime:
+    return datetime(2020, 1, 1) + timedelta(days=rnd.randrange(2000))
+
+
+def _fa_row(rnd: random.Random, i: int) -> tuple:
+    return (
+        f"FA-{i}", "faktury", "faktura vydaná", f"25FV{i:05d}", _datum(rnd),
+        _null(rnd, rnd.randrange(1, 40)), _null(rnd, f"C{rnd.randrange(40)}"),
+        rnd.randrange(1, 20), rnd.choice(STREDISKA), rnd.random() < 0.02,
+        rnd.randrange(1, 5000), f"ZBOZI{rnd.randrange(10000)}", rnd.choice(ZBOZI),
+        _guid(rnd), _money(rnd, 100000, 3), _money(rnd, 1000000), _null(rnd, decimal.Decimal("0.00")),
+        _money(rnd, 10000000), rnd.choice(FIRMY),
+        datetime(2025, 1, 1) + timedelta(seconds=rnd.randrange(10_000_000)),
+    )
+
+
+def _ph_row(rnd: random.Random, i: int) -> tuple:
+    return (
+        f"PH-{i}", "prodejky", f"25PR{i:05d}", _datum(rnd),
+        _null(rnd, rnd.randrange(1, 40)), _null(rnd, f"C{rnd.randrange(40)}"), "Maloobchod",
+        rnd.randrange(1, 20), f"S{rnd.randrange(20)}", rnd.choice(STREDISKA),
+        rnd.random() < 0.01, _null(rnd, rnd.randrange(1, 5000), 0.6),
+        f"ZBOZI{rnd.randrange(10000)}", rnd.choice(ZBOZI), _null(rnd, f"V{rnd.randrange(99999)}", 0.9),
+        _money(rnd, 10000, 3), _money(rnd, 100000), _null(rnd, _money(rnd, 500), 0.7),
+        _money(rnd, 1000000), _null(rnd, rnd.choice(FIRMY), 0.6),
+        _null(rnd, rnd.randrange(1, 30), 0.6), "CZ", rnd.choice(POZNAMKY), rnd.choice(POZNAMKY),
+        rnd.choice(["Hotově", "Kartou", "Stravenky"]), f"K{rnd.randrange(5)}", "Pokladna 1",
+        _null(rnd, rnd.choice(FIRMY), 0.8), _null(rnd, "Jan Novák", 0.8), "Prodej zboží",
+    )
+
+
+def _skz_row(rnd: random.Random, i: int) -> tuple:
+    return (
+        f"Z{i:06d}", _null(rnd, f"859{rnd.randrange(10**9, 10**10)}", 0.2),
+        # dlouhé názvy - řádky SKzExtended jsou výrazně širší než FA
+        " ".join(rnd.choice(ZBOZI) for _ in range(rnd.randrange(1, 4))),
+        _money(rnd, 100000, 3), _null(rnd, _money(rnd, 1000, 3), 0.5),
+        f"SKL{rnd.randrange(5)}", rnd.choice(STREDISKA),
+        _null(rnd, "Léčivo", 0.3), _null(rnd, "Vlastní značka", 0.5),
+        _null(rnd, "Volně prodejné", 0.3), _null(rnd, "Tablety", 0.3),
+        _null(rnd, f"{rnd.choice([10, 30, 60, 100])} ks", 0.3), rnd.random() < 0.9,
+        _money(rnd, 100000),
+    )
+
+
+SHAPES: Dict[str, Shape] = {
+    "FA": Shape([
+        "ID", "Agenda", "TypDokladu", "CisloDokladu", "Datum", "RefCin", "KodCinnost",
+        "RefStr", "Stredisko", "RelStorn", "RefAD", "Kod", "SText", "GUID",
+        "Mnozstvi", "KcJedn", "Sleva", "Kc", "Firma", "DatSave",
+    ], _fa_row),
+    "PH": Shape([
+        "ID", "Agenda", "CisloDokladu", "Datum", "RefCin", "KodCinnost", "Cinnost", "RefStr",
+        "KodStredisko", "Stredisko", "RelStorn", "RefAD", "Kod", "SText", "VCislo",
+        "Mnozstvi", "KcJedn", "Sleva", "Kc", "Firma", "RefZeme", "KodZeme", "Pozn", "Pozn2",
+        "TypUhrady", "KodKasa", "Kasa", "Firma_1", "Jmeno", "HlavickaSText",
+    ], _ph_row),
+    "SKz": Shape([
+        "IDS", "EAN", "Nazev", "StavZ", "MinLim", "sklad_zkratka", "sklad_nazev", "typ",
+        "znacka", "kategorie", "druh", "velikost_baleni", "viditelnost_bi", "VNakup",
+    ], _skz_row),
+}
+
+
+def synthetic_rows(shape: str, n: int, seed: int = 42) -> list:
+    """n řádků daného tvaru (FA / PH / SKz)."""
+    rnd = random.Random(seed)
+    row = SHAPES[shape].row
+    return [row(rnd, i) for i in range(n)]
+
+
+def description(shape: str, rows: list) -> list:
+    """cursor.description jako z pyodbc (typ = Python typ prvních ne-NULL hodnot)."""
+    result = []
+    for i, name in enumerate(SHAPES[shape].columns):
+        type_code = next((type(r[i]) for r in rows if r[i] is not None), str)
+        precision, scale = (19, 3) if type_code is decimal.Decimal else (None, None)
+        result.append((name, type_code, None, None, precision, scale, True))
+    return result
+
+
+def arrow_batch(shape: str, rows: list) -> pa.Table:
+    """Stejné řádky jako kolumnární dávka (to, co by vrátil arrow-odbc - GUID jako text)."""
+    columns = [list(c) for c in zip(*rows)]
+    for i, values in enumerate(columns):
+        if any(isinstance(v, bytes) for v in values):
+            columns[i] = [None if v is None else str(uuid.UUID(bytes_le=v)).upper() for v in values]
+    return pa.table([pa.array(c) for c in columns], names=SHAPES[shape].columns)
@@ -1,143 +1,164 @@
 #!/usr/bin/env python3
 """
 Kontrola stavu poslední synchronizace.
-Parsuje log a zobrazuje přehled.
+Čte lokální stav běhů (sync_state.db) indexovanými dotazy - bez parsování logu.
 """
 
+import argparse
+import json
 import os
-import re
 from datetime import datetime
 from pathlib import Path
 
+from sync_state import DEFAULT_STATE_FILE, StateStore
 
-def parse_log():
-    """Parsování sync.log a zobrazení stavu."""
-    log_file = Path("sync.log")
-    
-    if not log_file.exists():
-        print("❌ Log soubor sync.log nenalezen")
-        print("   Synchronizace ještě neběžela")
+STATUS = {
+    "success": "✅ Status:   ÚSPĚCH",
+    "failed": "❌ Status:   CHYBA",
+    "running": "⏳ Status:   BĚŽÍ nebo NEUKONČENO",
+}
+
+
+def state_files(config_path: str) -> list:
+    """Seznam stavových souborů ze všech bloků configu (bez configu výchozí)."""
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return [DEFAULT_STATE_FILE]
+    blocks = data if isinstance(data, list) else [data]
+    paths = [b.get("sync", {}).get("state_file", DEFAULT_STATE_FILE) for b in blocks]
+    return list(dict.fromkeys(paths))
+
+
+def _time(value) -> str:
+    return value[:19] if value else "-"
+
+
+def _size(nbytes: int) -> str:
+    return f"{nbytes / 1024 / 1024:.1f} MB"
+
+
+def show_block(store: StateStore, block: str, history: int):
+    runs = store.last_runs(block, max(1, history))
+    if not runs:
         return
-    
-    print("="*70)
-    print("📊 Přehled poslední synchronizace")
-    print("="*70)
+    last = runs[0]
+
+    print(f"🏢 Blok: {block}" + ("  (backfill)" if last["backfill"] else ""))
+    print(f"🕐 Start:    {_time(last['started_at'])}")
+    if last["finished_at"]:
+        print(f"🕐 Konec:    {_time(last['finished_at'])}")
+    if last["duration_s"] is not None:
+        print(f"⏱️  Trvání:  {last['duration_s']:.1f} s")
+    print(STATUS.get(last["outcome"], last["outcome"]))
+    if last["error"]:
+        print(f"   • {last['error'][:100]}")
     print()
-    
-    # Čtení logu
-    with open(log_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    if not lines:
-        print("Log soubor je prázdný")
-        return
-    
-    # Hledání poslední synchronizace
-    start_pattern = re.compile(r'START synchronizace Pohoda.*BigQuery')
-    success_pattern = re.compile(r'✓ Synchronizace dokončena úspěšně za ([\d.]+) sekund')
-    failure_pattern = re.compile(r'✗ Synchronizace selhala po ([\d.]+) sekundách')
-    table_pattern = re.compile(r'Synchronizace tabulky: (\w+)')
-    uploaded_pattern = re.compile(r'✓ Tabulka (\w+) úspěšně nahrána')
-    error_pattern = re.compile(r'ERROR - (.+)')
-    
-    # Analýza logu
-    last_sync_start = None
-    last_sync_end = None
-    duration = None
-    success = None
-    tables_processed = []
-    errors = []
-    
-    for i, line in enumerate(lines):
-        # Datum a čas z logu
-        timestamp_match = re.match(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})', line)
-        
-        if start_pattern.search(line):
-            if timestamp_match:
-                last_sync_start = timestamp_match.group(1)
-            tables_processed = []
-            errors = []
-            success = None
-        
-        if table_pattern.search(line):
-            match = table_pattern.search(line)
-            tables_processed.append(match.group(1))
-        
-        if uploaded_pattern.search(line):
-            pass  # Již zahrnuto v tables_processed
-        
-        if success_pattern.search(line):
-            match = success_pattern.search(line)
-            duration = match.group(1)
-            success = True
-            if timestamp_match:
-                last_sync_end = timestamp_match.group(1)
-        
-        if failure_pattern.search(line):
-            match = failure_pattern.search(line)
-            duration = match.group(1)
-            success = False
-            if timestamp_match:
-                last_sync_end = timestamp_match.group(1)
-        
-        if error_pattern.search(line) and last_sync_start:
-            match = error_pattern.search(line)
-            errors.append(match.group(1))
-    
-    # Zobrazení výsledků
-    if last_sync_start:
-        print(f"🕐 Start:    {last_sync_start}")
-        if last_sync_end:
-            print(f"🕐 Konec:    {last_sync_end}")
-        if duration:
-            print(f"⏱️  Trvání:  {duration} s")
+
+    tables = store.run_tables(last["id"])
+    if tables:
+        print(f"📋 Zpracované tabulky ({len(tables)}):")
+        for t in tables:
+            mark = {"success": "✓", "skipped": "⏭"}.get(t["outcome"], "✗")
+            stages = ", ".join(f"{k} {v:.1f} s" for k, v in t["stages"].items())
+            print(
+                f"   {mark} {t['database']} / {t['table_name']}: {t['rows_extracted']} řádků, "
+                f"{_size(t['bytes_uploaded'])}, {t['duration_s'] or 0:.1f} s"
+                + (
+                    f", vloženo {t['rows_inserted']} / aktualizováno {t['rows_updated']}"
+                    if t.get("rows_inserted") is not None else ""
+                )
+                + (f", špička RSS procesu {_size(t['peak_rss_bytes'])}" if t.get("peak_rss_bytes") else "")
+                + (f" ({stages})" if stages else "")
+            )
+            if t["error"]:
+                print(f"     • {t['error'][:100]}")
+        print()
+
+    if len(runs) > 1:
+        print(f"📜 Posledních {len(runs)} běhů:")
+        for r in runs:
+            icon = {"success": "✅", "failed": "❌"}.get(r["outcome"], "⏳")
+            dur = f"{r['duration_s']:.1f} s" if r["duration_s"] is not None else "-"
+            print(f"   {icon} {_time(r['started_at'])}  {dur}")
         print()
-        
-        if success is True:
-            print("✅ Status:   ÚSPĚCH")
-        elif success is False:
-            print("❌ Status:   CHYBA")
-        else:
-            print("⏳ Status:   BĚŽÍ nebo NEUKONČENO")
-        
+
+    # checkpointy zbývají jen po přerušeném běhu (úspěšný běh je smaže)
+    for backfill in (True, False):
+        checkpoints = store.checkpoints(block, backfill)
+        if not checkpoints:
+            continue
+        done = sum(c["status"] == "done" for c in checkpoints)
+        flags = "--backfill --resume" if backfill else "--resume"
+        print(f"⏸️  Přerušený běh: {done} hotových dvojic (pokračovat: {flags})")
+        for c in checkpoints:
+            if c["status"] == "partial":
+                print(f"   {c['database']} / {c['table_name']}: rozpracováno, "
+                      f"{c['rows']} řádků do klíče {c['last_key']}")
         print()
-        
-        if tables_processed:
-            print(f"📋 Zpracované tabulky ({len(tables_processed)}):")
-            for table in tables_processed:
-                print(f"   ✓ {table}")
-            print()
-        
-        if errors:
-            print(f"⚠️  Chyby ({len(errors)}):")
-            for error in errors[-5:]:  # Posledních 5 chyb
-                print(f"   • {error[:100]}")
-            if len(errors) > 5:
-                print(f"   ... a dalších {len(errors) - 5} chyb")
-            print()
-    else:
-        print("Žádná synchronizace nenalezena v logu")
+
+    last_ok = store.last_success_per_table(block)
+    if last_ok:
+        print("🟢 Poslední úspěšné nahrání:")
+        now = datetime.now()
+        for t in last_ok:
+            age = now - datetime.fromisoformat(t["finished_at"])
+            hours = age.total_seconds() / 3600
+            print(f"   {t['database']} / {t['table_name']}: {_time(t['finished_at'])} (před {hours:.1f} h)")
         print()
-    
-    # Velikost logu
-    log_size = log_file.stat().st_size
-    log_size_mb = log_size / 1024 / 1024
-    print(f"📁 Velikost logu: {log_size_mb:.2f} MB")
-    
+
+
+def show_status(config_path: str, block_filter: str = None, history: int = 1):
+    found = False
+    print("=" * 70)
+    print("📊 Přehled poslední synchronizace")
+    print("=" * 70)
     print()
-    print("="*70)
+
+    for path in state_files(config_path):
+        if not Path(path).exists():
+            continue
+        store = StateStore(path)
+        for block in store.blocks():
+            if block_filter and block != block_filter:
+                continue
+            found = True
+            show_block(store, block, history)
+
+    if not found:
+        print("❌ Stav synchronizace nenalezen")
+        print("   Synchronizace ještě neběžela")
+        print()
+
+    log_file = Path("sync.log")
+    if log_file.exists():
+        print(f"📁 Velikost logu: {log_file.stat().st_size / 1024 / 1024:.2f} MB")
+        print()
+
+    print("=" * 70)
     print()
     print("💡 Příkazy:")
     print("   tail -f sync.log          # živé sledování")
     print("   tail -n 50 sync.log       # posledních 50 řádků")
     print("   grep ERROR sync.log       # jen chyby")
-    print("="*70)
+    print("=" * 70)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stav synchronizace Pohoda -> BigQuery")
+    parser.add_argument("--config", default="config.json", help="Cesta ke configu")
+    parser.add_argument("--block", help="Jen jeden config blok podle 'name'")
+    parser.add_argument("--history", type=int, default=1, help="Kolik posledních běhů vypsat")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
     try:
-        parse_log()
+        args = parse_args()
+        os.chdir(Path(__file__).parent)
+        show_status(args.config, args.block, args.history)
     except KeyboardInterrupt:
         print("\n\nPřerušeno")
     except Exception as e:
-        print(f"Chyba při parsování logu: {e}")
+        print(f"Chyba při čtení stavu: {e}")
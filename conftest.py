@@ -28,6 +28,49 @@ _sentry.capture_exception = lambda *a, **k: None
 _sentry.capture_message = lambda *a, **k: None
 
 
+class _Span:
+    """Zaznamenává strom spanů (start_child) pro testy tracingu."""
+
+    def __init__(self, op=None, description=None, name=None, start_timestamp=None, **kwargs):
+        self.op = op
+        self.description = description or name
+        self.start_timestamp = start_timestamp
+        self.end_timestamp = None
+        self.finished = False
+        self.tags = {}
+        self.data = {}
+        self.status = None
+        self.children = []
+
+    def start_child(self, **kwargs):
+        child = _Span(**kwargs)
+        self.children.append(child)
+        return child
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def set_data(self, key, value):
+        self.data[key] = value
+
+    def set_status(self, status):
+        self.status = status
+
+    def finish(self, end_timestamp=None, **kwargs):
+        self.end_timestamp = end_timestamp
+        self.finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+_sentry.Span = _Span
+_sentry.start_transaction = lambda *a, **k: _Span(**k)
+
+
 # --- google.cloud.bigquery ------------------------------------------------
 class _SchemaField:
     def __init__(self, name, field_type, mode="NULLABLE"):
@@ -41,15 +84,38 @@ class _WriteDisposition:
     WRITE_TRUNCATE = "WRITE_TRUNCATE"
 
 
+class _SourceFormat:
+    PARQUET = "PARQUET"
+
+
 class _LoadJobConfig:
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
 
 
+class _CopyJobConfig(_LoadJobConfig):
+    pass
+
+
+class _TimePartitioningType:
+    DAY = "DAY"
+    HOUR = "HOUR"
+    MONTH = "MONTH"
+    YEAR = "YEAR"
+
+
+class _TimePartitioning:
+    def __init__(self, type_=None, field=None):
+        self.type_ = type_
+        self.field = field
+
+
 class _Table:
     def __init__(self, table_id, schema=None):
         self.table_id = table_id
         self.schema = schema or []
+        self.time_partitioning = None
+        self.clustering_fields = None
 
 
 class _Dataset:
@@ -71,6 +137,10 @@ _bigquery = _fake_module("google.cloud.bigquery")
 _bigquery.SchemaField = _SchemaField
 _bigquery.WriteDisposition = _WriteDisposition
 _bigquery.LoadJobConfig = _LoadJobConfig
+_bigquery.CopyJobConfig = _CopyJobConfig
+_bigquery.TimePartitioning = _TimePartitioning
+_bigquery.TimePartitioningType = _TimePartitioningType
+_bigquery.SourceFormat = _SourceFormat
 _bigquery.Table = _Table
 _bigquery.Dataset = _Dataset
 _bigquery.Client = _Client
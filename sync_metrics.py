@@ -0,0 +1,145 @@
+"""
+Metriky synchronizace pro node_exporter (textfile collector).
+
+Skript běží z cronu, takže není proces, který by šlo scrapovat. Na konci
+každého běhu bloku se proto zapíše textový soubor ve formátu Prometheus
+(`sync.metrics_file`, např. /var/lib/node_exporter/textfile/pohoda_{block}.prom),
+který node_exporter vystaví při dalším scrapu.
+
+Čítače (`*_total`) a histogramy časů fází jsou průběžné součty ve stavovém
+souboru (table_totals, stage_totals, run_totals), takže mezi běhy jen rostou
+a nezávisí na délce uchovávané historie běhů. `*_last_run_*` jsou hodnoty
+posledního běhu z jeho reportu.
+"""
+
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sync_state import STAGE_BUCKETS, StateStore
+
+PREFIX = "pohoda_sync"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(int(value or 0))
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+class MetricsText:
+    """Skládá výstup po rodinách metrik (HELP + TYPE, pak vzorky)."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def family(self, name: str, kind: str, help_text: str,
+               samples: List[tuple]):
+        """samples = [(labels, hodnota)] nebo pro histogram [(labels, pozorování)]."""
+        if not samples:
+            return
+        full = f"{PREFIX}_{name}"
+        self.lines.append(f"# HELP {full} {help_text}")
+        self.lines.append(f"# TYPE {full} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{full}{_labels(labels)} {_number(value)}")
+
+    def histogram(self, name: str, help_text: str, series: List[tuple],
+                  buckets=STAGE_BUCKETS):
+        """series = [(labels, počet, součet, kumulativní počty k buckets)]."""
+        if not series:
+            return
+        full = f"{PREFIX}_{name}"
+        self.lines.append(f"# HELP {full} {help_text}")
+        self.lines.append(f"# TYPE {full} histogram")
+        for labels, count, total, counts in series:
+            for bound, n in zip(buckets, counts):
+                self.lines.append(f"{full}_bucket{_labels({**labels, 'le': bound})} {n}")
+            self.lines.append(f"{full}_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+            self.lines.append(f"{full}_sum{_labels(labels)} {_number(float(total))}")
+            self.lines.append(f"{full}_count{_labels(labels)} {count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(store: StateStore, block: str, report: Optional[dict] = None) -> str:
+    """Metriky bloku ze stavového souboru (+ poslední běh z reportu)."""
+    out = MetricsText()
+    totals = store.table_totals(block)
+
+    def per_table(field: str, convert=lambda v: v) -> List[tuple]:
+        return [
+            ({"block": block, "database": t["database"], "table": t["table_name"]},
+             convert(t[field]))
+            for t in totals if t[field] is not None
+        ]
+
+    out.family("rows_total", "counter", "Stažené řádky (součet všech běhů).",
+               per_table("rows_extracted"))
+    out.family("uploaded_bytes_total", "counter", "Bajty nahrané do BigQuery (Parquet).",
+               per_table("bytes_uploaded"))
+    out.family("finalize_processed_bytes_total", "counter",
+               "Bajty zpracované finalizačními dotazy v BigQuery (MERGE, CTAS, ...).",
+               per_table("bytes_processed"))
+    out.family("table_failures_total", "counter", "Neúspěšná zpracování tabulky.",
+               per_table("failures"))
+    out.family("table_last_success_timestamp_seconds", "gauge",
+               "Konec posledního úspěšného nahrání tabulky (unix čas).",
+               per_table("last_success", _timestamp))
+
+    runs = store.run_totals(block)
+    out.family("runs_total", "counter", "Běhy bloku.", [({"block": block}, runs["runs"])])
+    out.family("run_failures_total", "counter", "Neúspěšné běhy bloku.",
+               [({"block": block}, runs["failures"])])
+    if runs["last_success"]:
+        out.family("last_success_timestamp_seconds", "gauge",
+                   "Konec posledního úspěšného běhu bloku (unix čas).",
+                   [({"block": block}, _timestamp(runs["last_success"]))])
+
+    out.histogram("stage_duration_seconds", "Doba fáze zpracování tabulky v jednom běhu.", [
+        ({"block": block, "database": t["database"], "table": t["table_name"],
+          "stage": t["stage"]}, t["count"], t["sum"], t["buckets"])
+        for t in store.stage_totals(block)
+    ])
+
+    if report and report.get("finished_at"):
+        out.family("last_run_success", "gauge", "1 = poslední běh bloku skončil úspěšně.",
+                   [({"block": block}, int(report.get("outcome") == "success"))])
+        out.family("last_run_timestamp_seconds", "gauge", "Konec posledního běhu bloku.",
+                   [({"block": block}, _timestamp(report["finished_at"]))])
+        out.family("last_run_duration_seconds", "gauge", "Doba posledního běhu bloku.",
+                   [({"block": block}, float(report.get("duration_s") or 0))])
+        tables = report.get("tables", [])
+        labels = [{"block": block, "database": t["database"], "table": t["table"]} for t in tables]
+        out.family("last_run_rows", "gauge", "Řádky stažené posledním během.",
+                   [(lbl, t["rows_extracted"]) for lbl, t in zip(labels, tables)])
+        out.family("last_run_table_duration_seconds", "gauge",
+                   "Doba zpracování tabulky v posledním běhu.",
+                   [(lbl, float(t["duration_s"])) for lbl, t in zip(labels, tables)])
+    return out.text()
+
+
+def write_textfile(path: str, text: str):
+    """Zapíše soubor atomicky (textfile collector nesmí načíst rozepsaný soubor)."""
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, target)
@@ -10,28 +10,51 @@ Logika:
 - Mode (full/incremental) se určuje u každého dotazu v configu.
 - Backfill spouští stejné dotazy proti historickým databázím (current je vždy
   poslední) a NIKDY netruncatuje cílovou tabulku - jen MERGE/append.
+- Dotaz s placeholderem <WATERMARK> a `watermark_column` v configu stahuje jen
+  řádky změněné od posledního úspěšného nahrání (stav v sync_state.db).
 """
 
 import argparse
 import decimal
+import io
 import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
+import queue
 import re
 import sys
+import tempfile
+import threading
+import time
 import uuid
-from datetime import date, datetime
-from logging.handlers import RotatingFileHandler
+from collections import deque
+from concurrent.futures import (
+    FIRST_EXCEPTION, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache, partial
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import pyodbc
 import sentry_sdk
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 from sentry_sdk import capture_exception
 
+from sync_metrics import render_metrics, write_textfile
+from sync_state import DEFAULT_STATE_FILE, StateStore
+
 logger = logging.getLogger("pohoda_sync")
 
 # Sloupce, které se NEpřevádějí na STRING.
@@ -50,6 +73,13 @@ PREFIX_TABLES = [
     "sFormUh", "Kasa",
 ]
 
+# Předkompilované regexy pro prefixování (FROM/JOIN tabulka).
+_PREFIX_PATTERNS = [
+    (re.compile(rf"\b{kw}\s+{table}\b", flags=re.IGNORECASE), kw, table)
+    for table in PREFIX_TABLES
+    for kw in ("FROM", "JOIN")
+]
+
 
 # ---------------------------------------------------------------------------
 # Čisté pomocné funkce (testovatelné bez připojení)
@@ -93,29 +123,238 @@ def dedupe_columns(columns: List[str]) -> List[str]:
     return result
 
 
-def prepare_sql(sql_content: str, linked_server: str, database: str, days_back: int) -> str:
-    """Přidá prefix k tabulkám a dosadí <DAYS_BACK>.
+def watermark_expression(watermark: Optional[datetime], days_back: int) -> str:
+    """T-SQL výraz dosazený za <WATERMARK>.
+
+    Bez uloženého watermarku (první běh, backfill) se použije okno days_back.
+    """
+    if watermark is None:
+        return f"(GETDATE() - {days_back})"
+    return f"CAST('{watermark.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]}' AS DATETIME2)"
+
+
+def _prefix_tables(sql_content: str, linked_server: Optional[str], database: str) -> str:
+    """FROM/JOIN tabulka -> [linked_server].[database].dbo.tabulka
+    (bez linked serveru jen [database].dbo.tabulka)."""
+    prefix = f"[{linked_server}].[{database}].dbo." if linked_server else f"[{database}].dbo."
+    # <DATABASE> stojí v SQL souborech uvnitř '...'
+    modified = sql_content.replace("<DATABASE>", database.replace("'", "''"))
+    for pattern, kw, table in _PREFIX_PATTERNS:
+        modified = pattern.sub(f"{kw} {prefix}{table}", modified)
+    return modified
+
+
+def prepare_sql(sql_content: str, linked_server: str, database: str, days_back: int,
+                watermark: Optional[datetime] = None) -> str:
+    """Přidá prefix k tabulkám a dosadí <DAYS_BACK>, <WATERMARK> a <DATABASE>.
 
     Args:
         sql_content: Obsah SQL souboru.
         linked_server: Název linked serveru.
         database: Název Pohoda databáze.
         days_back: Hodnota dosazená za placeholder <DAYS_BACK>.
+        watermark: Spodní hranice změn pro <WATERMARK> (None = okno days_back).
     """
-    prefix = f"[{linked_server}].[{database}].dbo."
-    modified = sql_content
-    for table in PREFIX_TABLES:
-        for kw in ("FROM", "JOIN"):
-            modified = re.sub(
-                rf"\b{kw}\s+{table}\b",
-                f"{kw} {prefix}{table}",
-                modified,
-                flags=re.IGNORECASE,
-            )
+    modified = _prefix_tables(sql_content, linked_server, database)
     modified = re.sub(r"<DAYS_BACK>", str(days_back), modified)
+    modified = modified.replace("<WATERMARK>", watermark_expression(watermark, days_back))
     return modified
 
 
+class CompiledSQL(NamedTuple):
+    """SQL šablona s ? parametry místo <DAYS_BACK>/<WATERMARK> (viz compile_sql).
+
+    slots: pořadí parametrů - "days_back" nebo "watermark" pro každý ?.
+    """
+
+    text: str
+    slots: Tuple[str, ...]
+
+    def params(self, days_back: int, watermark: Optional[datetime] = None) -> list:
+        if watermark is not None:
+            # stejná přesnost (ms) jako literál z watermark_expression
+            watermark = watermark.replace(microsecond=watermark.microsecond // 1000 * 1000)
+        values = {"days_back": days_back, "watermark": watermark}
+        return [values[slot] for slot in self.slots]
+
+
+_PLACEHOLDER_RE = re.compile(r"<DAYS_BACK>|<WATERMARK>")
+
+
+@lru_cache(maxsize=None)
+def compile_sql(sql_content: str, linked_server: str, database: str,
+                with_watermark: bool = False, strategy: str = "linked") -> CompiledSQL:
+    """Prefixuje tabulky a placeholdery nahradí ? parametry pyodbc.
+
+    Text dotazu pak nezávisí na days_back ani watermarku, takže SQL Server
+    znovu použije jednou sestavený plán. Výsledek se cachuje po dobu běhu
+    procesu (klíč = obsah souboru, linked server, databáze). Dvě varianty
+    <WATERMARK> podle with_watermark odpovídají watermark_expression.
+
+    strategy "linked" prefixuje čtyřdílnými názvy přes linked server,
+    "openquery" a "direct" jen [database].dbo. (dotaz běží přímo na serveru
+    s daty, viz build_statement).
+    """
+    slots: List[str] = []
+
+    def substitute(match) -> str:
+        if match.group(0) == "<DAYS_BACK>":
+            slots.append("days_back")
+            return "?"
+        if with_watermark:
+            slots.append("watermark")
+            return "CAST(? AS DATETIME2)"
+        slots.append("days_back")
+        return "(GETDATE() - ?)"
+
+    prefixed = _prefix_tables(
+        sql_content, linked_server if strategy == "linked" else None, database
+    )
+    text = _PLACEHOLDER_RE.sub(substitute, prefixed)
+    return CompiledSQL(text, tuple(slots))
+
+
+def _sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, datetime):
+        return f"'{value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]}'"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def _bq_string_literal(value: str) -> str:
+    """Textový literál pro BigQuery SQL (escapování zpětným lomítkem)."""
+    escaped = (
+        value.replace("\\", "\\\\").replace("'", "\\'")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+    return f"'{escaped}'"
+
+
+def render_sql(compiled: CompiledSQL, params: list) -> str:
+    """Dosadí parametry jako literály - text shodný s prepare_sql (testy, ladění)."""
+    return inline_params(compiled.text, params)
+
+
+def inline_params(sql: str, params: list) -> str:
+    """Nahradí `?` v textu dotazu literály hodnot (pro spojení bez parametrů).
+
+    `?` v textových literálech, [identifikátorech] a komentářích se nepočítá.
+    """
+    positions = [i for i, ch in enumerate(_sql_code(sql)) if ch == "?"]
+    if len(positions) != len(params):
+        raise ValueError(f"SQL má {len(positions)} parametrů, předáno {len(params)}")
+    out, start = [], 0
+    for pos, value in zip(positions, params):
+        out.append(sql[start:pos])
+        out.append(_sql_literal(value))
+        start = pos + 1
+    out.append(sql[start:])
+    return "".join(out)
+
+
+STRATEGIES = ("linked", "openquery", "direct")
+
+# Maximální délka dotazu v OPENQUERY (varchar(8000)).
+OPENQUERY_MAX_LENGTH = 8000
+
+
+def openquery_sql(linked_server: str, sql: str) -> str:
+    """Obalí dotaz do OPENQUERY - celý se vykoná na linked serveru."""
+    if len(sql) > OPENQUERY_MAX_LENGTH:
+        raise ValueError(
+            f"OPENQUERY: dotaz má {len(sql)} znaků, limit je {OPENQUERY_MAX_LENGTH}"
+        )
+    escaped = sql.replace("'", "''")
+    return f"SELECT * FROM OPENQUERY([{linked_server}], '{escaped}')"
+
+
+def build_statement(compiled: "CompiledSQL", params: list, strategy: str,
+                    linked_server: Optional[str] = None,
+                    wrap: Optional[Callable[[str], str]] = None) -> Tuple[str, list]:
+    """Text a parametry pro cursor.execute podle strategie databáze.
+
+    wrap obalí vlastní dotaz (např. fingerprint_sql) ještě před OPENQUERY,
+    aby se i agregace spočítala na vzdáleném serveru. OPENQUERY nebere
+    parametry - hodnoty se do textu dosadí jako literály.
+    """
+    if strategy == "openquery":
+        inner = render_sql(compiled, params)
+        return openquery_sql(linked_server, wrap(inner) if wrap else inner), []
+    return (wrap(compiled.text) if wrap else compiled.text), list(params)
+
+
+# Textové literály, identifikátory v [] a "" a komentáře T-SQL.
+_SQL_SKIP_RE = re.compile(
+    r"'(?:[^']|'')*'|\[(?:[^\]]|\]\])*\]|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S
+)
+
+
+def _sql_code(sql: str) -> str:
+    """Text dotazu s literály, [identifikátory] a komentáři nahrazenými mezerami
+    (pozice znaků zůstanou) - pro hledání klíčových slov a `?` jen v kódu."""
+    return _SQL_SKIP_RE.sub(lambda m: " " * len(m.group()), sql)
+
+
+def derived_table_problem(sql: str) -> Optional[str]:
+    """Proč dotaz nejde obalit jako odvozená tabulka `FROM (<sql>) q`, jinak None.
+
+    T-SQL nedovolí CTE (WITH) uvnitř poddotazu ani ORDER BY bez TOP/OFFSET.
+    """
+    code = _sql_code(sql)
+    if re.match(r"\s*WITH\b", code, re.IGNORECASE):
+        return "dotaz začíná CTE (WITH), nejde použít jako poddotaz"
+    depth, top = 0, []
+    for ch in code:
+        depth += (ch == "(") - (ch == ")")
+        top.append(ch if depth == 0 else " ")
+    top = "".join(top)
+    if (re.search(r"\bORDER\s+BY\b", top, re.IGNORECASE)
+            and not re.search(r"\b(TOP|OFFSET)\b", top, re.IGNORECASE)):
+        return "dotaz končí ORDER BY bez TOP, nejde použít jako poddotaz (ORDER BY odstraň)"
+    return None
+
+
+def _derived_table(sql: str) -> str:
+    """Dotaz bez koncového středníku pro `FROM (...) q`; ValueError, nejde-li obalit."""
+    problem = derived_table_problem(sql)
+    if problem:
+        raise ValueError(problem)
+    return re.sub(r"[;\s]+$", "", sql)
+
+
+def fingerprint_sql(sql: str, watermark_column: Optional[str] = None) -> str:
+    """Obalí připravený dotaz agregací pro levný otisk výsledku na SQL Serveru.
+
+    Vrací jeden řádek (počet řádků, CHECKSUM_AGG přes BINARY_CHECKSUM(*),
+    max. watermark_column). Dotaz nesmí mít duplicitní názvy sloupců.
+    Okno dotazu s <DAYS_BACK> se posouvá s GETDATE() - jakmile z něj vypadne
+    nejstarší den s doklady, otisk se změní i v neměnné historické databázi.
+    """
+    inner = _derived_table(sql)
+    max_change = f"MAX(q.[{watermark_column}])" if watermark_column else "NULL"
+    return (
+        "SELECT COUNT_BIG(*) AS row_count, "
+        "CHECKSUM_AGG(BINARY_CHECKSUM(*)) AS checksum, "
+        f"{max_change} AS max_change\n"
+        f"FROM (\n{inner}\n) q"
+    )
+
+
+def resume_sql(sql: str, key: str, after: Optional[str] = None) -> str:
+    """Obalí připravený dotaz řazením podle key - pro checkpointy s resume_key.
+
+    after ("?" nebo literál u OPENQUERY) omezí výsledek na řádky za klíčem
+    poslední nahrané dávky. Klíč musí být jedinečný a ne-NULL, dotaz nesmí
+    mít duplicitní názvy sloupců (stejně jako u fingerprint_sql).
+    """
+    inner = _derived_table(sql)
+    where = f"\nWHERE q.[{key}] > {after}" if after else ""
+    return f"SELECT *\nFROM (\n{inner}\n) q{where}\nORDER BY q.[{key}]"
+
+
 def build_bq_schema(columns: List[str]) -> List[bigquery.SchemaField]:
     """Sestaví BQ schéma z názvů sloupců (deterministicky, ne z dat).
 
@@ -135,15 +374,79 @@ def build_bq_schema(columns: List[str]) -> List[bigquery.SchemaField]:
     return schema
 
 
+# NUMERIC v BigQuery: 38 číslic, z toho max. 9 za desetinnou čárkou.
+_NUMERIC_SCALE = 9
+_NUMERIC_INTEGER_DIGITS = 29
+
+# Starší názvy typů, které vrací BigQuery API u existujících tabulek.
+_BQ_TYPE_ALIASES = {
+    "INTEGER": "INT64",
+    "FLOAT": "FLOAT64",
+    "BOOLEAN": "BOOL",
+    "BIGDECIMAL": "BIGNUMERIC",
+}
+
+
+def bq_type(field_type: str) -> str:
+    """Standardní SQL název BQ typu (INTEGER -> INT64 apod.)."""
+    field_type = field_type.upper()
+    return _BQ_TYPE_ALIASES.get(field_type, field_type)
+
+
+def _bq_type_from_description(item: tuple) -> str:
+    """BQ typ sloupce z položky pyodbc cursor.description.
+
+    item = (name, type_code, display_size, internal_size, precision, scale, null_ok),
+    type_code je Python typ, na který pyodbc hodnoty převádí.
+    """
+    type_code = item[1]
+    if type_code is bool:
+        return "BOOL"
+    if type_code is int:
+        return "INT64"
+    if type_code is float:
+        return "FLOAT64"
+    if type_code is decimal.Decimal:
+        precision, scale = item[4] or 38, item[5] or 0
+        if scale <= _NUMERIC_SCALE and precision - scale <= _NUMERIC_INTEGER_DIGITS:
+            return "NUMERIC"
+        return "BIGNUMERIC"
+    if type_code is datetime:
+        return "DATETIME"
+    if type_code is date:
+        return "DATE"
+    # str, GUID (bytes), time a ostatní
+    return "STRING"
+
+
+def infer_bq_schema(description, columns: List[str],
+                    overrides: Optional[Dict[str, str]] = None) -> List[bigquery.SchemaField]:
+    """Sestaví BQ schéma z typů, které hlásí ODBC driver (cursor.description).
+
+    overrides (z configu "column_types") má přednost: {"RefCin": "INT64"}.
+    """
+    overrides = overrides or {}
+    return [
+        bigquery.SchemaField(
+            col, bq_type(overrides.get(col, _bq_type_from_description(item))), mode="NULLABLE"
+        )
+        for col, item in zip(columns, description)
+    ]
+
+
+def _guid_to_string(val: bytes) -> str:
+    # GUID z SQL Serveru
+    try:
+        return str(uuid.UUID(bytes_le=val))
+    except Exception:
+        return val.hex()
+
+
 def _convert_value_to_string(val):
     if val is None or (not isinstance(val, (list, dict)) and pd.isna(val)):
         return None
     if isinstance(val, bytes):
-        # GUID z SQL Serveru
-        try:
-            return str(uuid.UUID(bytes_le=val))
-        except Exception:
-            return val.hex()
+        return _guid_to_string(val)
     if isinstance(val, datetime):
         return val.strftime("%Y-%m-%d %H:%M:%S")
     if isinstance(val, date):
@@ -189,6 +492,801 @@ def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+# ---------------------------------------------------------------------------
+# Arrow převod dávek (po sloupcích, bez pandas)
+# ---------------------------------------------------------------------------
+
+def _value_types(values: list) -> set:
+    types = set(map(type, values))
+    types.discard(type(None))
+    return types
+
+
+# Pořadí bajtů GUID uloženého jako bytes_le (viz uuid.UUID(bytes_le=...)).
+_GUID_LE_ORDER = [3, 2, 1, 0, 5, 4, 7, 6, 8, 9, 10, 11, 12, 13, 14, 15]
+
+
+def _arrow_guid_array(values: list) -> pa.Array:
+    """16bajtové GUID -> text 'xxxxxxxx-xxxx-...' hromadně přes numpy/Arrow."""
+    arr = pa.array(values, type=pa.binary(16))
+    raw = np.frombuffer(arr.buffers()[1], dtype=np.uint8)[: 16 * len(arr)]
+    hexed = raw.reshape(-1, 16)[:, _GUID_LE_ORDER].tobytes().hex()
+    flat = pa.array(np.frombuffer(hexed.encode("ascii"), dtype="S32")).cast(pa.string())
+    parts = [
+        pc.utf8_slice_codeunits(flat, a, b)
+        for a, b in ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))
+    ]
+    joined = pc.binary_join_element_wise(*parts, "-")
+    return pc.if_else(arr.is_null(), pa.scalar(None, pa.string()), joined)
+
+
+def _arrow_string_array(values: list, col: str) -> pa.Array:
+    """STRING sloupec - stejné texty jako _convert_value_to_string."""
+    types = _value_types(values)
+    if not types:
+        return pa.nulls(len(values), pa.string())
+    if types == {str}:
+        return pa.array(values, type=pa.string())
+    if types == {int}:
+        return pa.array(values, type=pa.int64()).cast(pa.string())
+    if types == {datetime}:
+        arr = pa.array(values, type=pa.timestamp("us"))
+        return arr.cast(pa.timestamp("s"), safe=False).cast(pa.string())
+    if types == {date}:
+        return pa.array(values, type=pa.date32()).cast(pa.string())
+    if types == {bool}:
+        return pc.if_else(pa.array(values, type=pa.bool_()), "True", "False")
+    if types == {decimal.Decimal}:
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if types == {bytes}:
+        try:
+            return _arrow_guid_array(values)
+        except (pa.ArrowException, ValueError):
+            return pa.array(
+                [None if v is None else _guid_to_string(v) for v in values], type=pa.string()
+            )
+    return pa.array([_convert_value_to_string(v) for v in values], type=pa.string())
+
+
+def _arrow_float_array(values: list, col: str) -> pa.Array:
+    """FLOAT64 sloupec - Decimal/int/float hromadně, ostatní po hodnotách."""
+    types = _value_types(values)
+    if not types:
+        return pa.nulls(len(values), pa.float64())
+    try:
+        if types <= {float, int}:
+            return pa.array(values, type=pa.float64(), from_pandas=True)
+        if types == {decimal.Decimal}:
+            return pa.array(values, type=pa.decimal128(38, 9)).cast(pa.float64())
+    except (pa.ArrowException, ValueError, TypeError):
+        pass
+    return pa.array(
+        [_convert_value_to_float(v, col) for v in values], type=pa.float64(), from_pandas=True
+    )
+
+
+def _arrow_timestamp_array(values: list, col: str) -> pa.Array:
+    """TIMESTAMP sloupec - datetime/date hromadně, ostatní přes pd.to_datetime."""
+    types = _value_types(values)
+    if not types:
+        return pa.nulls(len(values), pa.timestamp("us"))
+    if types == {datetime}:
+        return pa.array(values, type=pa.timestamp("us"))
+    if types == {date}:
+        return pa.array(values, type=pa.date32()).cast(pa.timestamp("us"))
+    converted = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce")
+    return pa.Array.from_pandas(converted).cast(pa.timestamp("us"), safe=False)
+
+
+def _int_value(value, col: str) -> int:
+    """int() bez tichého useknutí desetinné části (Decimal/float)."""
+    result = int(value)
+    if isinstance(value, (float, decimal.Decimal)) and result != value:
+        raise ValueError(f"{col}: hodnota {value} není celé číslo (INT64), uprav column_types")
+    return result
+
+
+def _arrow_int_array(values: list, col: str) -> pa.Array:
+    """INT64 sloupec (bool/Decimal/text s celým číslem se převede přes int())."""
+    types = _value_types(values)
+    if types <= {int, bool}:
+        return pa.array(values, type=pa.int64())
+    return pa.array([None if v is None else _int_value(v, col) for v in values], type=pa.int64())
+
+
+def _arrow_bool_array(values: list, col: str) -> pa.Array:
+    return pa.array([None if v is None else bool(v) for v in values], type=pa.bool_())
+
+
+def _arrow_decimal_array(arrow_type: pa.DataType):
+    def convert(values: list, col: str) -> pa.Array:
+        types = _value_types(values)
+        if types <= {decimal.Decimal}:
+            return pa.array(values, type=arrow_type)
+        return pa.array(
+            [None if v is None else decimal.Decimal(str(v)) for v in values], type=arrow_type
+        )
+    return convert
+
+
+def _arrow_date_array(values: list, col: str) -> pa.Array:
+    types = _value_types(values)
+    if types == {datetime}:
+        return pa.array(values, type=pa.timestamp("us")).cast(pa.date32())
+    return pa.array(values, type=pa.date32())
+
+
+# BQ typ (z build_bq_schema / infer_bq_schema) -> převodník sloupce na Arrow pole.
+# DATETIME i TIMESTAMP jdou jako timestamp bez zóny, o typu rozhodne schéma
+# temp tabulky.
+ARROW_CONVERTERS = {
+    "STRING": _arrow_string_array,
+    "FLOAT64": _arrow_float_array,
+    "TIMESTAMP": _arrow_timestamp_array,
+    "DATETIME": _arrow_timestamp_array,
+    "DATE": _arrow_date_array,
+    "INT64": _arrow_int_array,
+    "BOOL": _arrow_bool_array,
+    "NUMERIC": _arrow_decimal_array(pa.decimal128(38, 9)),
+    "BIGNUMERIC": _arrow_decimal_array(pa.decimal256(76, 38)),
+}
+
+
+# Vypočtený sloupec s hashem řádku (merge_hash), není ve výsledku dotazu.
+ROW_HASH_COLUMN = "_row_hash"
+
+
+def rows_to_arrow(rows: list, schema: List[bigquery.SchemaField]) -> pa.Table:
+    """Převede dávku řádků (tuple / pyodbc.Row) po sloupcích na pyarrow Table.
+
+    Typy sloupců se řídí BQ schématem z build_bq_schema; hodnoty odpovídají
+    prepare_dataframe (GUID -> text, Decimal -> float, NULL -> null), jen bez
+    pandas a bez převodu buňku po buňce přes .apply(). Končí-li schéma
+    sloupcem ROW_HASH_COLUMN, doplní se do něj row_hashes() ostatních sloupců.
+    """
+    if schema and schema[-1].name == ROW_HASH_COLUMN:
+        table = rows_to_arrow(rows, schema[:-1])
+        return table.append_column(
+            ROW_HASH_COLUMN, pa.array(row_hashes(table), type=pa.int64())
+        )
+    names = [f.name for f in schema]
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = []
+    for field, values in zip(schema, columns):
+        values = list(values)
+        convert = ARROW_CONVERTERS.get(field.field_type, _arrow_string_array)
+        try:
+            arrays.append(convert(values, field.name))
+        except Exception as e:
+            logger.warning(
+                f"Problém s převodem sloupce {field.name}: {e}, převádím na string"
+            )
+            # po hodnotách - _arrow_string_array by mohl spadnout znovu (velký int)
+            arrays.append(
+                pa.array([_convert_value_to_string(v) for v in values], type=pa.string())
+            )
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _cast_arrow_column(arr: pa.Array, field: bigquery.SchemaField) -> Optional[pa.Array]:
+    """Sloupec z kolumnárního fetche -> Arrow typ pole BQ schématu, bez Pythonu.
+
+    Texty odpovídají _arrow_string_array (datetime na sekundy, bool jako
+    True/False). None = typ se takhle převést nedá, jde se přes hodnoty.
+    """
+    t = arr.type
+    target = bq_type(field.field_type)
+    numeric = pa.types.is_integer(t) or pa.types.is_decimal(t)
+    if target == "STRING":
+        if pa.types.is_string(t) or pa.types.is_large_string(t):
+            return arr.cast(pa.string())
+        if numeric or pa.types.is_date(t):
+            return arr.cast(pa.string())
+        if pa.types.is_timestamp(t):
+            return arr.cast(pa.timestamp("s"), safe=False).cast(pa.string())
+        if pa.types.is_boolean(t):
+            return pc.if_else(arr, "True", "False")
+    elif target == "FLOAT64" and (numeric or pa.types.is_floating(t)):
+        return arr.cast(pa.float64())
+    elif target in ("TIMESTAMP", "DATETIME") and (pa.types.is_timestamp(t) or pa.types.is_date(t)):
+        return arr.cast(pa.timestamp("us"))
+    elif target == "DATE" and (pa.types.is_timestamp(t) or pa.types.is_date(t)):
+        return arr.cast(pa.date32(), safe=False)
+    elif target == "INT64" and (pa.types.is_integer(t) or pa.types.is_boolean(t)):
+        return arr.cast(pa.int64())
+    elif target == "BOOL" and pa.types.is_boolean(t):
+        return arr
+    elif target == "NUMERIC" and numeric:
+        return arr.cast(pa.decimal128(38, 9))
+    elif target == "BIGNUMERIC" and numeric:
+        return arr.cast(pa.decimal256(76, 38))
+    return None
+
+
+def arrow_to_schema(batch, schema: List[bigquery.SchemaField]) -> pa.Table:
+    """Arrow dávka z kolumnárního backendu -> tabulka se stejnými typy jako rows_to_arrow.
+
+    Sloupce se berou podle pořadí (názvy ze schématu, tj. po dedupe_columns).
+    Co nejde přetypovat v Arrow (GUID jako binary, text v číselném sloupci),
+    převede se přes hodnoty stejnými převodníky jako řádky z pyodbc.
+    """
+    if schema and schema[-1].name == ROW_HASH_COLUMN:
+        table = arrow_to_schema(batch, schema[:-1])
+        return table.append_column(
+            ROW_HASH_COLUMN, pa.array(row_hashes(table), type=pa.int64())
+        )
+    arrays = []
+    for field, column in zip(schema, batch.columns):
+        if isinstance(column, pa.ChunkedArray):
+            column = column.combine_chunks()
+        try:
+            arr = _cast_arrow_column(column, field)
+        except (pa.ArrowException, ValueError):
+            arr = None
+        if arr is None:
+            values = column.to_pylist()
+            convert = ARROW_CONVERTERS.get(field.field_type, _arrow_string_array)
+            try:
+                arr = convert(values, field.name)
+            except Exception as e:
+                logger.warning(
+                    f"Problém s převodem sloupce {field.name}: {e}, převádím na string"
+                )
+                arr = _arrow_string_array(values, field.name)
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, names=[f.name for f in schema])
+
+
+def arrow_to_parquet(table: pa.Table) -> io.BytesIO:
+    """Serializuje Arrow tabulku do Parquet bufferu připraveného k load jobu."""
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="snappy")
+    buf.seek(0)
+    return buf
+
+
+# Start procesů konverzního poolu (spawn - bezpečné vedle vláken a pyodbc).
+CONVERT_START_METHOD = "spawn"
+
+
+def _convert_in_worker(rows: list, fields: list) -> tuple:
+    """Převod dávky v procesu poolu -> (Arrow IPC stream, doba převodu v s)."""
+    started = time.perf_counter()
+    schema = [bigquery.SchemaField(name, field_type) for name, field_type in fields]
+    table = rows_to_arrow(rows, schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes(), time.perf_counter() - started
+
+
+def fetch_batches(cursor, batch_size, timer: Optional["StageTimer"] = None) -> Iterator[list]:
+    """Dávky z kurzoru; batch_size je počet řádků nebo BatchSizer (čte se před každým fetchmany)."""
+    while True:
+        size = batch_size.size if isinstance(batch_size, BatchSizer) else batch_size
+        t = time.perf_counter()
+        rows = cursor.fetchmany(size)
+        if timer is not None:
+            timer.add("fetch", time.perf_counter() - t, rows=len(rows))
+        if not rows:
+            return
+        yield rows
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> Optional[int]:
+    """Aktuální RSS procesu v bajtech z /proc/self/statm (mimo Linux None)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class BatchSizer:
+    """Velikost příštího fetchmany podle paměťového rozpočtu dávky.
+
+    Bez batch_bytes drží batch_size. S rozpočtem se počet řádků odvodí
+    z průměrné šířky řádku převedené dávky (Arrow nbytes / řádky), roste
+    nejvýš 2× za dávku a zmenší se, když load job trvá déle než
+    max_load_seconds. Přesáhne-li RSS procesu max_rss, dávka se půlí
+    (i bez batch_bytes; pak se pod limitem vrací zpět k batch_size). Po
+    každé dávce a loadu se navzorkuje RSS - peak_rss je špička RSS celého
+    procesu během dotazu (při souběžných dotazech včetně jejich paměti).
+    """
+
+    def __init__(self, batch_size: int, batch_bytes: Optional[int] = None,
+                 max_load_seconds: Optional[float] = None, max_rss: Optional[int] = None,
+                 min_rows: int = 100):
+        self.size = batch_size
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.max_load_seconds = max_load_seconds
+        self.max_rss = max_rss
+        self.min_rows = min_rows
+        self.row_bytes: Optional[float] = None
+        self.peak_rss = current_rss() or 0
+        self._lock = threading.Lock()
+
+    def _sample_rss(self) -> Optional[int]:
+        rss = current_rss()
+        if rss is not None:
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def observe(self, table: pa.Table):
+        """Po převodu dávky: podle šířky řádku (a RSS) nastaví další velikost."""
+        rss = self._sample_rss()
+        if not (self.batch_bytes or self.max_rss) or not table.num_rows:
+            return
+        with self._lock:
+            if self.batch_bytes:
+                row_bytes = table.nbytes / table.num_rows
+                # klouzavý průměr - jedna dávka s dlouhými texty velikost nerozhodí
+                self.row_bytes = (
+                    row_bytes if self.row_bytes is None else (self.row_bytes + row_bytes) / 2
+                )
+                size = min(int(self.batch_bytes / self.row_bytes), self.size * 2)
+            else:
+                size = min(self.batch_size, self.size * 2)
+            if self.max_rss and rss and rss > self.max_rss:
+                size = min(size, self.size // 2)
+            self.size = max(self.min_rows, size)
+
+    def observe_load(self, seconds: float):
+        """Po load jobu: příliš pomalý load drží dávky v paměti déle -> menší dávky."""
+        self._sample_rss()
+        if not self.batch_bytes or not self.max_load_seconds or seconds <= self.max_load_seconds:
+            return
+        with self._lock:
+            self.size = max(self.min_rows, int(self.size * self.max_load_seconds / seconds))
+
+
+class ConvertPool:
+    """Pool procesů pro BatchConverter - jeden na běh bloku, sdílený všemi dotazy.
+
+    Procesy se spustí až s první dávkou od convert_min_rows řádků (start()),
+    takže dotaz s malými dávkami spawn a import pandas/pyarrow v procesech
+    nezaplatí. Zavírá se jednou na konci běhu (close()).
+    """
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self.broken = False
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warmup: List[Future] = []
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Spustí procesy (jen poprvé); rozbíhají se, zatímco běží další fetch."""
+        with self._lock:
+            if self._executor is None and not self.broken:
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context(CONVERT_START_METHOD)
+                )
+                self._warmup = [
+                    self._executor.submit(_convert_in_worker, [], [])
+                    for _ in range(self.processes)
+                ]
+
+    def wait_ready(self):
+        wait(self._warmup)
+
+    def submit(self, rows: list, fields: list) -> Future:
+        self.start()
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            raise BrokenProcessPool("pool převodu už spadl")
+        return executor.submit(_convert_in_worker, [tuple(r) for r in rows], fields)
+
+    def mark_broken(self) -> bool:
+        """Proces poolu spadl - pool se zavře; True jen při prvním volání."""
+        with self._lock:
+            first, self.broken = not self.broken, True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return first
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class BatchConverter:
+    """Převod dávek na Arrow - v hlavním procesu, nebo v poolu procesů.
+
+    S sync.convert_processes > 1 jdou dávky od sync.convert_min_rows řádků
+    do poolu (ConvertPool, jako tuple, zpět Arrow IPC). Režie se změří: první
+    velká dávka se převede lokálně (a spustí pool), druhá samostatně v poolu;
+    stojí-li přenos hlavní proces víc než lokální převod, zbytek dotazu běží
+    lokálně. Spadne-li proces poolu (BrokenProcessPool), rozpracované dávky
+    se převedou lokálně a pool se už nepoužije.
+    """
+
+    def __init__(self, schema: List[bigquery.SchemaField], processes: int = 0,
+                 min_rows: int = 2000, name: str = "", timer: Optional["StageTimer"] = None,
+                 pool: Optional[ConvertPool] = None):
+        self.schema = schema
+        self.timer = timer
+        self.fields = [(f.name, f.field_type) for f in schema]
+        self.min_rows = min_rows
+        self.name = name
+        self._lock = threading.Lock()
+        # bez sdíleného poolu si converter vlastní pool vytvoří i zavře
+        self._own_pool = pool is None and processes > 1
+        self._pool = ConvertPool(processes) if self._own_pool else pool
+        self.processes = self._pool.processes if self._pool is not None else processes
+        self._local_cost: Optional[float] = None
+        # measure_local -> measure_pool -> (measuring) -> pool | local
+        self.state = "local"
+        if self._pool is not None and not self._pool.broken:
+            self.state = "measure_local"
+
+    def _local(self, rows: list) -> pa.Table:
+        return rows_to_arrow(rows, self.schema)
+
+    def _start(self, rows: list):
+        """Rozběhne převod: Future z poolu, nebo rovnou hotová tabulka."""
+        if isinstance(rows, (pa.RecordBatch, pa.Table)):
+            # kolumnární backend - Arrow přetypování je levné, pool nemá smysl
+            return arrow_to_schema(rows, self.schema)
+        with self._lock:
+            state = self.state
+            if len(rows) < self.min_rows or state in ("local", "measuring"):
+                state = "local"
+            elif state == "measure_pool":
+                self.state = "measuring"
+        if state == "pool":
+            try:
+                return self._pool.submit(rows, self.fields)
+            except BrokenProcessPool as e:
+                self._pool_broken(e)
+                return self._local(rows)
+        if state == "measure_local":
+            self._pool.start()
+            t = time.perf_counter()
+            table = self._local(rows)
+            with self._lock:
+                self._local_cost = (time.perf_counter() - t) / len(rows)
+                self.state = "measure_pool"
+            return table
+        if state == "measure_pool":
+            return self._measure_pool(rows)
+        return self._local(rows)
+
+    def _measure_pool(self, rows: list) -> pa.Table:
+        self._pool.wait_ready()
+        t = time.perf_counter()
+        try:
+            data, worker_s = self._pool.submit(rows, self.fields).result()
+        except BrokenProcessPool as e:
+            self._pool_broken(e)
+            return self._local(rows)
+        table = pa.ipc.open_stream(data).read_all()
+        overhead = (time.perf_counter() - t - worker_s) / len(rows)
+        use_pool = overhead < self._local_cost
+        logger.info(
+            f"[{self.name}]   převod: lokálně {self._local_cost * 1e6:.1f} µs/řádek, "
+            f"režie poolu {overhead * 1e6:.1f} µs/řádek -> "
+            + (f"pool {self.processes} procesů" if use_pool else "v hlavním procesu")
+        )
+        with self._lock:
+            self.state = "pool" if use_pool else "local"
+        return table
+
+    def _pool_broken(self, error: Exception):
+        """Proces poolu spadl - dál jen lokálně (zalogovat jednou za pool)."""
+        with self._lock:
+            self.state = "local"
+        if self._pool.mark_broken():
+            logger.warning(
+                f"[{self.name}]   pool převodu spadl ({error}), převádím v hlavním procesu"
+            )
+
+    def _timed_start(self, rows: list):
+        """_start; hotová tabulka se hned započte do fáze convert, dávka odeslaná
+        do poolu jako (Future, řádky, čas odeslání) až v _result."""
+        t = time.perf_counter()
+        item = self._start(rows)
+        seconds = time.perf_counter() - t
+        if isinstance(item, Future):
+            # řádky zůstávají kvůli lokálnímu převodu, kdyby pool spadl
+            return item, rows, seconds
+        if self.timer is not None:
+            self.timer.add("convert", seconds, rows=item.num_rows)
+        return item
+
+    def _result(self, item) -> pa.Table:
+        if isinstance(item, pa.Table):
+            return item
+        future, rows, submit_s = item
+        t = time.perf_counter()
+        try:
+            data, _ = future.result()
+            table = pa.ipc.open_stream(data).read_all()
+        except BrokenProcessPool as e:
+            self._pool_broken(e)
+            table = self._local(rows)
+        if self.timer is not None:
+            # odeslání + čekání hlavního procesu na pool, ne čas převodu v procesech
+            self.timer.add("convert", submit_s + time.perf_counter() - t, rows=table.num_rows)
+        return table
+
+    def convert(self, rows: list) -> pa.Table:
+        """Převede jednu dávku (blokuje) - pro souběžná vlákna pipeline."""
+        return self._result(self._timed_start(rows))
+
+    def imap(self, batches: Iterable[list]) -> Iterator[pa.Table]:
+        """Převede dávky se čtením dopředu; tabulky vrací ve stejném pořadí."""
+        pending: deque = deque()
+        ahead = 2 * self.processes if self._pool is not None else 0
+        for rows in batches:
+            pending.append(self._timed_start(rows))
+            while len(pending) > ahead:
+                yield self._result(pending.popleft())
+        while pending:
+            yield self._result(pending.popleft())
+
+    def close(self):
+        if self._own_pool:
+            self._pool.close()
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.fromisoformat(str(value))
+
+
+# Kolik Sentry spanů jedné fáze (fetch/convert/upload dávky) se zapíše na dotaz;
+# transakce má v Sentry limit 1000 spanů, zbytek je jen v součtech fází.
+MAX_STAGE_SPANS = 25
+
+
+def _utc_naive(value: datetime) -> datetime:
+    """Čas pro Sentry span - UTC bez zóny (jako časy spanů v sentry-sdk 1.x)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class StageTimer:
+    """Časy fází jednoho dotazu - součet sekund, počet, řádky a bajty na fázi.
+
+    Plní ho i vlákna pipeline, proto pod zámkem. Fáze, které běží souběžně
+    (fetch vedle uploadu), se překrývají - jejich součet může být větší než
+    celkový čas dotazu. Se `span` (Sentry span dotazu) se každá fáze zapíše
+    i jako jeho podřízený span - u dávek prvních MAX_STAGE_SPANS.
+    """
+
+    def __init__(self, span=None):
+        self.span = span
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, rows: int = 0, nbytes: int = 0,
+            started_at: Optional[datetime] = None):
+        with self._lock:
+            stage = self._stages.setdefault(
+                name, {"seconds": 0.0, "count": 0, "rows": 0, "bytes": 0}
+            )
+            stage["seconds"] += seconds
+            stage["count"] += 1
+            stage["rows"] += rows
+            stage["bytes"] += nbytes
+            trace = self.span is not None and stage["count"] <= MAX_STAGE_SPANS
+        if trace:
+            self._add_span(name, seconds, rows, nbytes, started_at)
+
+    def _add_span(self, name: str, seconds: float, rows: int, nbytes: int,
+                  started_at: Optional[datetime]):
+        """Span zpětně podle naměřeného času (fáze už skončila)."""
+        if started_at is not None:
+            start = _utc_naive(started_at)
+        else:
+            start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=seconds)
+        try:
+            child = self.span.start_child(op=f"sync.{name}", description=name,
+                                          start_timestamp=start)
+            child.set_data("rows", rows)
+            child.set_data("bytes", nbytes)
+            child.finish(end_timestamp=start + timedelta(seconds=seconds))
+        except Exception as e:
+            logger.debug(f"Sentry span {name}: {e}")
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def seconds(self) -> Dict[str, float]:
+        """Fáze -> sekundy (pro run_tables.stages)."""
+        with self._lock:
+            return {k: round(v["seconds"], 3) for k, v in self._stages.items()}
+
+    def report(self) -> Dict[str, dict]:
+        with self._lock:
+            return {k: {**v, "seconds": round(v["seconds"], 3)} for k, v in self._stages.items()}
+
+
+class LoadStats:
+    """Souhrn dávek nahraných do temp tabulky pro jeden dotaz.
+
+    Plní se z _load_batch (i z vláken pipeline), proto pod zámkem.
+    S `watermark_column` si drží i nejvyšší hodnotu toho sloupce.
+    """
+
+    def __init__(self, watermark_column: Optional[str] = None):
+        self.rows = 0
+        self.unchanged = 0
+        self.batches = 0
+        self.bytes = 0
+        self.watermark_column = watermark_column
+        self.max_watermark: Optional[datetime] = None
+        # DML statistiky finalizace ({"inserted": .., "updated": ..}), jsou-li k dispozici
+        self.dml: Optional[Dict[str, int]] = None
+        # špička RSS celého procesu během stahování (BatchSizer), v bajtech -
+        # při souběžných dotazech zahrnuje i jejich paměť
+        self.peak_rss: Optional[int] = None
+        self.timer = StageTimer()
+        self._lock = threading.Lock()
+
+    def add_bytes(self, nbytes: int):
+        with self._lock:
+            self.bytes += nbytes
+
+    @property
+    def extracted(self) -> int:
+        return self.rows + self.unchanged
+
+    def add(self, table: pa.Table, nbytes: int = 0, unchanged: int = 0) -> int:
+        """Započte dávku. `table` je celá dávka, `unchanged` řádků z ní se nenahrálo."""
+        batch_max = None
+        if self.watermark_column and table.num_rows:
+            batch_max = _as_datetime(pc.max(table.column(self.watermark_column)).as_py())
+        with self._lock:
+            self.rows += table.num_rows - unchanged
+            self.unchanged += unchanged
+            self.batches += 1
+            self.bytes += nbytes
+            if batch_max is not None and (
+                self.max_watermark is None or batch_max > self.max_watermark
+            ):
+                self.max_watermark = batch_max
+            return self.rows
+
+
+# Bez NULL dávají stejný hash jako int64/bool, takže starší indexy platí dál.
+_NULLABLE_PANDAS_TYPES = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+
+
+def row_hashes(table: pa.Table) -> np.ndarray:
+    """64bit hash každého řádku (int64) pro detekci změn.
+
+    Před hashováním se typy sjednotí tak, aby lokálně převedená dávka a tatáž
+    data načtená zpět z BigQuery daly stejný hash (timestamp bez časové zóny,
+    Decimal/NUMERIC jako float). Celá čísla a bool jdou do pandas jako nullable
+    Int64/boolean - jinak by NULL kdekoli ve sloupci změnil dtype (float64 /
+    object) a tím hash ostatních řádků dávky.
+    """
+    columns = []
+    for col in table.columns:
+        t = col.type
+        if pa.types.is_timestamp(t):
+            col = col.cast(pa.timestamp("us"))
+        elif pa.types.is_decimal(t):
+            col = col.cast(pa.float64())
+        elif pa.types.is_integer(t):
+            col = col.cast(pa.int64())
+        columns.append(col)
+    df = pa.Table.from_arrays(columns, names=table.column_names).to_pandas(
+        types_mapper=_NULLABLE_PANDAS_TYPES.get
+    )
+    return pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64)
+
+
+def table_row_hashes(table: pa.Table) -> np.ndarray:
+    """Hashe řádků - z ROW_HASH_COLUMN, je-li v tabulce, jinak row_hashes()."""
+    if ROW_HASH_COLUMN in table.column_names:
+        return table.column(ROW_HASH_COLUMN).to_numpy(zero_copy_only=False).astype(np.int64)
+    return row_hashes(table)
+
+
+class RowHashFilter:
+    """Propustí z dávky jen nové nebo změněné řádky (podle indexu klíč -> hash).
+
+    Index je v sync_state (row_hashes) pro (blok, cílová tabulka). Hashe
+    propuštěných řádků se zapíšou až commit() - po úspěšné finalizaci.
+    """
+
+    def __init__(self, store: StateStore, block: str, table_name: str, key: str):
+        self.store = store
+        self.block = block
+        self.table_name = table_name
+        self.key = key
+        self.pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, table: pa.Table) -> pa.Table:
+        if not table.num_rows:
+            return table
+        hashes = table_row_hashes(table).tolist()
+        keys = [None if k is None else str(k) for k in table.column(self.key).to_pylist()]
+        known = self.store.get_row_hashes(self.block, self.table_name, keys)
+        mask = [k is None or known.get(k) != h for k, h in zip(keys, hashes)]
+        with self._lock:
+            self.pending.update(
+                (k, h) for k, h, changed in zip(keys, hashes, mask) if changed and k is not None
+            )
+        return table.filter(pa.array(mask, type=pa.bool_()))
+
+    def commit(self):
+        with self._lock:
+            items, self.pending = list(self.pending.items()), {}
+        if items:
+            self.store.put_row_hashes(self.block, self.table_name, items)
+
+
+# Typy resume_key: uloží se do SQLite i pošlou jako parametr beze ztráty.
+# Decimal/datetime by šly jen přes text (str(datetime) má 6 desetinných míst
+# a SQL Server ho do datetime nepřevede).
+RESUME_KEY_TYPES = (int, str)
+
+
+class TableCheckpoint:
+    """Postup nahrávání dotazu s resume_key do temp tabulky (checkpointy pro --resume).
+
+    Dávky se číslují v pořadí fetch. Uloží se klíč poslední dávky, před
+    kterou jsou nahrané všechny dřívější - při upload_workers > 1 se dávky
+    dokončují mimo pořadí a přeskočit se smí jen souvislý začátek výsledku.
+    """
+
+    def __init__(self, store: StateStore, block: str, backfill: bool, database: str,
+                 table_name: str, temp_id: str, key: str, rows: int = 0, last_key=None):
+        self.store = store
+        self.ident = (block, backfill, database, table_name)
+        self.temp_id = temp_id
+        self.key = key
+        self.rows = rows
+        self.last_key = last_key
+        self._next = 0
+        self._done: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def key_of(self, table: pa.Table):
+        """Klíč posledního řádku dávky (int nebo str, viz RESUME_KEY_TYPES)."""
+        return table.column(self.key)[-1].as_py()
+
+    def batch_done(self, seq: int, rows: int, last_key):
+        with self._lock:
+            self._done[seq] = (rows, last_key)
+            if self._next not in self._done:
+                return
+            while self._next in self._done:
+                rows, self.last_key = self._done.pop(self._next)
+                self.rows += rows
+                self._next += 1
+            self.store.set_checkpoint(
+                *self.ident, "partial", self.temp_id, self.last_key, self.rows
+            )
+
+
 def databases_to_process(
     databases_cfg: dict, backfill: bool, database_filter: Optional[str] = None
 ) -> List[dict]:
@@ -212,25 +1310,95 @@ def databases_to_process(
     return ordered
 
 
+# Funkce pro PARTITION BY podle typu sloupce (granularita DAY/MONTH/YEAR).
+_PARTITION_TRUNC = {"DATE": "DATE_TRUNC", "DATETIME": "DATETIME_TRUNC", "TIMESTAMP": "TIMESTAMP_TRUNC"}
+
+
+def partition_spec(partition_by) -> Optional[tuple]:
+    """Config partition_by ("Datum" nebo {"column": "Datum", "granularity": "MONTH"})
+    -> (sloupec, granularita) nebo None."""
+    if not partition_by:
+        return None
+    if isinstance(partition_by, str):
+        return partition_by, "MONTH"
+    return partition_by["column"], partition_by.get("granularity", "MONTH").upper()
+
+
+def table_options_sql(schema: List[bigquery.SchemaField], partition_by=None,
+                      cluster_by=None) -> str:
+    """PARTITION BY / CLUSTER BY klauzule pro CREATE TABLE cílové tabulky."""
+    clauses = []
+    spec = partition_spec(partition_by)
+    if spec:
+        column, granularity = spec
+        types = {f.name: bq_type(f.field_type) for f in schema}
+        field_type = types.get(column)
+        if field_type not in _PARTITION_TRUNC:
+            raise ValueError(
+                f"partition_by: sloupec {column} musí být DATE, DATETIME nebo TIMESTAMP "
+                f"(je {field_type})"
+            )
+        if field_type == "DATE" and granularity == "DAY":
+            clauses.append(f"PARTITION BY `{column}`")
+        else:
+            clauses.append(
+                f"PARTITION BY {_PARTITION_TRUNC[field_type]}(`{column}`, {granularity})"
+            )
+    if cluster_by:
+        if isinstance(cluster_by, str):
+            cluster_by = [cluster_by]
+        clauses.append("CLUSTER BY " + ", ".join(f"`{c}`" for c in cluster_by))
+    return " ".join(clauses)
+
+
 def build_finalize_statements(
-    mode: str, backfill: bool, target_id: str, temp_id: str, key: str, columns: List[str]
+    mode: str, backfill: bool, target_id: str, temp_id: str, key: str, columns: List[str],
+    casts: Optional[Dict[str, str]] = None, options: str = "",
+    prune_column: Optional[str] = None, hash_column: Optional[str] = None,
+    database: Optional[str] = None,
 ) -> List[str]:
     """Sestaví SQL příkazy pro finalizaci (z temp tabulky do cílové).
 
     - normální + full: CREATE OR REPLACE TABLE target AS SELECT * FROM temp
     - incremental (i backfill): MERGE podle key
     - backfill + full: append (INSERT INTO target SELECT * FROM temp)
+    - per_database (dimenze): v transakci nahradí řádky s _database = database
+
+    casts: sloupec -> výraz nad S.`sloupec` převádějící hodnotu na typ
+    existující cílové tabulky, kde se liší od temp tabulky (viz cast_sql).
+    options: PARTITION BY / CLUSTER BY pro nově vytvářený cíl (table_options_sql).
+    prune_column: MERGE sáhne jen do partitions cíle v rozsahu min-max tohoto
+    sloupce v temp tabulce (+ NULL partition). Předpoklad: řádek s daným
+    klíčem nikdy nepřejde do partition mimo tento rozsah.
+    hash_column: sloupec s hashem řádku (je i v columns) - MERGE aktualizuje
+    jen řádky, jejichž hash se liší; cíl bez sloupce se o něj rozšíří.
     """
+    opts = f" {options}" if options else ""
     if mode == "full" and not backfill:
-        return [f"CREATE OR REPLACE TABLE `{target_id}` AS SELECT * FROM `{temp_id}`"]
+        return [f"CREATE OR REPLACE TABLE `{target_id}`{opts} AS SELECT * FROM `{temp_id}`"]
+
+    ensure = f"CREATE TABLE IF NOT EXISTS `{target_id}` LIKE `{temp_id}`{opts}"
+    casts = casts or {}
 
-    ensure = f"CREATE TABLE IF NOT EXISTS `{target_id}` LIKE `{temp_id}`"
+    def src(c: str) -> str:
+        return casts.get(c, f"S.`{c}`")
+
+    if mode == "per_database":
+        # sloupce jménem - databáze se můžou lišit pořadím i typy sloupců
+        insert_cols = ", ".join(f"`{c}`" for c in columns)
+        select = ", ".join(src(c) for c in columns)
+        return [ensure, (
+            f"BEGIN TRANSACTION;\n"
+            f"DELETE FROM `{target_id}` WHERE `{DATABASE_COLUMN}` = {_bq_string_literal(database)};\n"
+            f"INSERT INTO `{target_id}` ({insert_cols}) SELECT {select} FROM `{temp_id}` S;\n"
+            f"COMMIT TRANSACTION"
+        )]
 
     if mode == "incremental":
         non_key = [c for c in columns if c != key]
-        set_clause = ", ".join(f"T.`{c}` = S.`{c}`" for c in non_key)
+        set_clause = ", ".join(f"T.`{c}` = {src(c)}" for c in non_key)
         insert_cols = ", ".join(f"`{c}`" for c in columns)
-        insert_vals = ", ".join(f"S.`{c}`" for c in columns)
+        insert_vals = ", ".join(src(c) for c in columns)
         # Zdroj musí mít klíč unikátní (jinak BigQuery MERGE selže s
         # "must match at most one source row for each target row").
         # Deduplikujeme - na klíč ponecháme jeden řádek.
@@ -238,19 +1406,400 @@ def build_finalize_statements(
             f"(SELECT * FROM `{temp_id}` "
             f"QUALIFY ROW_NUMBER() OVER (PARTITION BY `{key}` ORDER BY `{key}`) = 1)"
         )
-        merge = f"""
+        on = f"T.`{key}` = {src(key)}"
+        declare = ""
+        if prune_column:
+            # Konstanty ze skriptových proměnných BigQuery použije k ořezání
+            # partitions (filtr přes poddotaz přímo v ON by neořezal). Blok
+            # BEGIN/END, aby šel MERGE spojit s dalšími příkazy do skriptu.
+            declare = (
+                f"BEGIN\n"
+                f"DECLARE prune_lo DEFAULT (SELECT MIN(`{prune_column}`) FROM `{temp_id}`);\n"
+                f"DECLARE prune_hi DEFAULT (SELECT MAX(`{prune_column}`) FROM `{temp_id}`);\n"
+            )
+            on += (
+                f" AND (T.`{prune_column}` BETWEEN prune_lo AND prune_hi"
+                f" OR T.`{prune_column}` IS NULL)"
+            )
+        matched = "WHEN MATCHED"
+        if hash_column:
+            matched += f" AND T.`{hash_column}` IS DISTINCT FROM S.`{hash_column}`"
+        merge = declare + f"""
             MERGE `{target_id}` T
             USING {dedup_source} S
-            ON T.`{key}` = S.`{key}`
-            WHEN MATCHED THEN UPDATE SET {set_clause}
+            ON {on}
+            {matched} THEN UPDATE SET {set_clause}
             WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
         """.strip()
+        if declare:
+            merge += ";\nEND"
+        if hash_column:
+            add = f"ALTER TABLE `{target_id}` ADD COLUMN IF NOT EXISTS `{hash_column}` INT64"
+            return [ensure, add, merge]
         return [ensure, merge]
 
     # backfill + full -> append
+    if casts:
+        insert_cols = ", ".join(f"`{c}`" for c in columns)
+        select = ", ".join(src(c) for c in columns)
+        return [ensure, f"INSERT INTO `{target_id}` ({insert_cols}) SELECT {select} FROM `{temp_id}` S"]
     return [ensure, f"INSERT INTO `{target_id}` SELECT * FROM `{temp_id}`"]
 
 
+def cast_sql(expr: str, source_type: str, target_type: str, scale: Optional[int] = None) -> str:
+    """Výraz převádějící hodnotu temp tabulky na typ existujícího cíle.
+
+    Do STRING cíle (tabulky ze starších verzí) vznikne přesně stejný text
+    jako z _arrow_string_array: True/False, datum a čas na sekundy, Decimal
+    se stejným počtem desetinných míst jako ze zdroje (scale). Kde se text
+    shodovat nedá (FLOAT64, NUMERIC bez scale), vyhodí ValueError - cíl je
+    potřeba převést full refreshem nebo smazáním a backfillem.
+    """
+    source_type, target_type = bq_type(source_type), bq_type(target_type)
+    if target_type != "STRING" or source_type in ("STRING", "INT64"):
+        return f"CAST({expr} AS {target_type})"
+    if source_type == "BOOL":
+        return f"CASE WHEN {expr} THEN 'True' WHEN NOT {expr} THEN 'False' END"
+    if source_type == "DATETIME":
+        return f"FORMAT_DATETIME('%Y-%m-%d %H:%M:%S', {expr})"
+    if source_type == "TIMESTAMP":
+        return f"FORMAT_TIMESTAMP('%Y-%m-%d %H:%M:%S', {expr}, 'UTC')"
+    if source_type == "DATE":
+        return f"FORMAT_DATE('%Y-%m-%d', {expr})"
+    if source_type in ("NUMERIC", "BIGNUMERIC") and scale is not None:
+        return f"FORMAT('%.{scale}f', {expr})"
+    raise ValueError(
+        f"{expr}: {source_type} nelze převést na STRING se stejným textem jako dřív, "
+        f"převeď cílovou tabulku (full refresh nebo smazání a backfill)"
+    )
+
+
+# Sloupec s názvem zdrojové databáze v dimenzích (a faktech pro view).
+DATABASE_COLUMN = "_database"
+
+# Sloupce dimenzí z configu jdou přímo do T-SQL - jen prosté identifikátory.
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def query_table_name(query_cfg: dict) -> str:
+    """Název cílové tabulky dotazu: "table" z configu, jinak název SQL souboru."""
+    return query_cfg.get("table") or Path(query_cfg["file"]).stem
+
+
+def dimension_query(dimension) -> dict:
+    """Config dimenze ("AD" nebo {"table": "AD", "columns": [...]}) -> query config
+    pro sync_query: celá číselníková tabulka do dim_<tabulka>, po databázích."""
+    if isinstance(dimension, str):
+        dimension = {"table": dimension}
+    table = dimension["table"]
+    if table not in PREFIX_TABLES:
+        raise ValueError(f"Dimenze {table} není v PREFIX_TABLES")
+    invalid = [c for c in dimension.get("columns", []) if not _IDENTIFIER_RE.fullmatch(c)]
+    if invalid:
+        raise ValueError(f"Dimenze {table}: neplatné názvy sloupců {invalid}")
+    columns = ", ".join(dimension.get("columns", ["*"]))
+    return {
+        "sql": f"SELECT '<DATABASE>' AS {DATABASE_COLUMN}, {columns} FROM {table}",
+        "table": f"dim_{table}",
+        "mode": "per_database",
+    }
+
+
+def build_view_sql(view_cfg: dict, table_id: Callable[[str], str]) -> str:
+    """CREATE OR REPLACE VIEW, který k faktům připojí dim_* tabulky.
+
+    view_cfg: {"name", "fact", "joins": [{"dimension": "AD", "on": "RefAD"}
+    nebo {"dimension": "sZeme", "on": "AD.RefZeme"}], "columns": [výrazy]}.
+    Alias dimenze = její název, faktů = f. Spojuje se i přes _database.
+    """
+    joins = []
+    for join in view_cfg.get("joins", []):
+        alias = join["dimension"]
+        left, _, column = join["on"].rpartition(".")
+        left = f"`{left}`" if left else "f"
+        joins.append(
+            f"LEFT JOIN `{table_id('dim_' + alias)}` `{alias}` "
+            f"ON `{alias}`.`{DATABASE_COLUMN}` = f.`{DATABASE_COLUMN}` "
+            f"AND `{alias}`.`{join.get('key', 'ID')}` = {left}.`{column}`"
+        )
+    select = ",\n  ".join(["f.*"] + list(view_cfg.get("columns", [])))
+    return (
+        f"CREATE OR REPLACE VIEW `{table_id(view_cfg['name'])}` AS\n"
+        f"SELECT\n  {select}\n"
+        f"FROM `{table_id(view_cfg['fact'])}` f\n"
+        + "\n".join(joins)
+    )
+
+
+def finalize_script(statements: List[str]) -> str:
+    """Spojí příkazy finalizace do jednoho BigQuery skriptu (jeden job).
+
+    Jediný příkaz zůstává samostatným dotazem (ne skriptem).
+    """
+    if len(statements) == 1:
+        return statements[0]
+    return ";\n".join(statements) + ";"
+
+
+def database_stages(dbs: List[dict], current: dict) -> List[List[dict]]:
+    """Rozdělí databáze na etapy pro souběžné zpracování.
+
+    Historie může běžet souběžně, current je vždy samostatná POSLEDNÍ etapa -
+    její MERGE se tak do každé cílové tabulky aplikuje až po historii.
+    """
+    history = [db for db in dbs if db is not current]
+    last = [db for db in dbs if db is current]
+    return [stage for stage in (history, last) if stage]
+
+
+def run_parallel(calls: List[Callable[[], None]], workers: int):
+    """Spustí volání v max. `workers` vláknech (1 = postupně, v pořadí).
+
+    První chyba zruší ještě nespuštěná volání, počká na běžící a vyhodí se.
+    """
+    if workers <= 1 or len(calls) <= 1:
+        for call in calls:
+            call()
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(calls))) as pool:
+        futures = [pool.submit(call) for call in calls]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for f in pending:
+            f.cancel()
+        wait(futures)
+    for f in futures:
+        if not f.cancelled() and f.exception() is not None:
+            raise f.exception()
+
+
+class FinalizeQueue:
+    """Finalizace na pozadí (sync.finalize_workers), zatímco se stahuje další dotaz.
+
+    Finalizace téže cílové tabulky jsou zřetězené - každá počká na předchozí
+    (i neúspěšnou), takže pořadí MERGE zůstane jako při postupném běhu.
+    Různé cílové tabulky se finalizují souběžně.
+    """
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="finalize")
+        self._last: Dict[str, Future] = {}
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+    def submit(self, target_id: str, fn: Callable[[], None]):
+        with self._lock:
+            prev = self._last.get(target_id)
+
+            def task():
+                if prev is not None:
+                    wait([prev])
+                fn()
+
+            future = self._executor.submit(task)
+            self._last[target_id] = future
+            self._futures.append(future)
+
+    def raise_failed(self):
+        """Vyhodí chybu první dokončené neúspěšné finalizace (zastaví další extrakce)."""
+        with self._lock:
+            futures = list(self._futures)
+        for f in futures:
+            if f.done() and f.exception() is not None:
+                raise f.exception()
+
+    def join(self) -> Optional[BaseException]:
+        """Počká na všechny finalizace a ukončí pool. Vrací první chybu."""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._executor.shutdown(wait=True)
+        for f in futures:
+            if f.exception() is not None:
+                return f.exception()
+        return None
+
+
+class ConnectionPool:
+    """Malý pool pyodbc spojení - každý souběžný worker dostane vlastní.
+
+    Spojení se vytváří líně až do `size`; kdo nic nedostane, čeká na vrácení.
+    """
+
+    def __init__(self, factory: Callable, size: int):
+        self._factory = factory
+        self._size = max(1, size)
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._all: list = []
+        self._lock = threading.Lock()
+
+    def add(self, conn):
+        with self._lock:
+            self._all.append(conn)
+        self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = len(self._all) < self._size
+            if create:
+                self._all.append(None)
+        if not create:
+            return self._idle.get()
+        try:
+            conn = self._factory()
+        except BaseException:
+            with self._lock:
+                self._all.remove(None)
+            raise
+        with self._lock:
+            self._all[self._all.index(None)] = conn
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close_all(self):
+        with self._lock:
+            conns = [c for c in self._all if c is not None]
+            self._all = []
+        for conn in conns:
+            conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Extrakční backendy (sync.extract_backend)
+# ---------------------------------------------------------------------------
+# Backend má connection(db, strategy, batch_size) -> context manager se
+# spojením ve stylu DB-API: cursor() s execute(sql, *params), description,
+# fetchmany(n) a fetchone(). fetchmany vrací buď řádky (pyodbc), nebo rovnou
+# Arrow dávku - tu BatchConverter jen přetypuje na BQ schéma (arrow_to_schema).
+
+class PyodbcBackend:
+    """Výchozí backend: pyodbc spojení z poolu, fetchmany vrací řádky."""
+
+    name = "pyodbc"
+
+    def __init__(self, syncer: "PohodaBigQuerySync"):
+        self.syncer = syncer
+
+    def connection(self, db: dict, strategy: str, batch_size: int):
+        return self.syncer._pool_for(db, strategy).connection()
+
+
+def _read_arrow_batches(sql: str, connection_string: str, batch_size: int):
+    """Čtečka Arrow dávek z arrow-odbc (volitelná závislost, import až při použití)."""
+    try:
+        from arrow_odbc import read_arrow_batches_from_odbc
+    except ImportError as e:
+        raise RuntimeError(
+            "sync.extract_backend=arrow-odbc vyžaduje balík arrow-odbc (pip install arrow-odbc)"
+        ) from e
+    return read_arrow_batches_from_odbc(
+        query=sql, connection_string=connection_string, batch_size=batch_size
+    )
+
+
+def arrow_description(schema: pa.Schema) -> list:
+    """Arrow schéma -> položky ve tvaru pyodbc cursor.description (pro infer_bq_schema)."""
+    description = []
+    for field in schema:
+        t = field.type
+        precision = scale = None
+        if pa.types.is_boolean(t):
+            type_code = bool
+        elif pa.types.is_integer(t):
+            type_code = int
+        elif pa.types.is_floating(t):
+            type_code = float
+        elif pa.types.is_decimal(t):
+            type_code, precision, scale = decimal.Decimal, t.precision, t.scale
+        elif pa.types.is_timestamp(t):
+            type_code = datetime
+        elif pa.types.is_date(t):
+            type_code = date
+        elif pa.types.is_binary(t) or pa.types.is_fixed_size_binary(t):
+            type_code = bytes
+        else:
+            type_code = str
+        description.append(
+            (field.name, type_code, None, None, precision, scale, field.nullable)
+        )
+    return description
+
+
+class ArrowOdbcCursor:
+    """Kurzor nad arrow-odbc - driver plní Arrow buffery přímo, bez Python řádků.
+
+    Parametry se do textu dosadí jako literály (arrow-odbc je posílá jako
+    text). fetchmany vrací celou RecordBatch, její velikost je batch_size.
+    """
+
+    def __init__(self, connection_string: str, batch_size: int):
+        self.connection_string = connection_string
+        self.batch_size = batch_size
+        self.description = None
+        self._batches = None
+
+    def execute(self, sql: str, *params):
+        reader = _read_arrow_batches(
+            inline_params(sql, list(params)), self.connection_string, self.batch_size
+        )
+        self.description = arrow_description(reader.schema)
+        self._batches = iter(reader)
+        return self
+
+    def fetchmany(self, size: Optional[int] = None):
+        for batch in self._batches or ():
+            if batch.num_rows:
+                return batch
+        return []
+
+    def fetchone(self) -> Optional[tuple]:
+        batch = self.fetchmany(1)
+        if not len(batch):
+            return None
+        return tuple(column[0].as_py() for column in batch.columns)
+
+    def close(self):
+        self._batches = None
+
+
+class ArrowOdbcConnection:
+    def __init__(self, connection_string: str, batch_size: int):
+        self.connection_string = connection_string
+        self.batch_size = batch_size
+
+    def cursor(self) -> ArrowOdbcCursor:
+        return ArrowOdbcCursor(self.connection_string, self.batch_size)
+
+
+class ArrowOdbcBackend:
+    """Kolumnární backend přes arrow-odbc; každý dotaz si otevře vlastní spojení."""
+
+    name = "arrow-odbc"
+
+    def __init__(self, syncer: "PohodaBigQuerySync"):
+        self.syncer = syncer
+
+    @contextmanager
+    def connection(self, db: dict, strategy: str, batch_size: int):
+        yield ArrowOdbcConnection(self.syncer._conn_str_for(db, strategy), batch_size)
+
+
+EXTRACT_BACKENDS = {
+    PyodbcBackend.name: PyodbcBackend,
+    ArrowOdbcBackend.name: ArrowOdbcBackend,
+}
+
+
 # ---------------------------------------------------------------------------
 # Hlavní třída - jeden config blok
 # ---------------------------------------------------------------------------
@@ -262,12 +1811,31 @@ class PohodaBigQuerySync:
         self.config = config
         self.name = config.get("name", "default")
         self.mssql_conn = None
+        self.mssql_pool: Optional[ConnectionPool] = None
         self.bq_client = None
+        self._table_locks: Dict[str, threading.Lock] = {}
+        self._table_locks_guard = threading.Lock()
+        self._state: Optional[StateStore] = None
+        self._run_id: Optional[int] = None
+        self._finalizer: Optional[FinalizeQueue] = None
+        self._transaction = None
+        self._resume = False
+        self._sql_files: Dict[str, str] = {}
+        self._direct_pools: Dict[tuple, ConnectionPool] = {}
+        self._direct_pools_guard = threading.Lock()
+        self._convert_pool: Optional[ConvertPool] = None
+        self._convert_pool_guard = threading.Lock()
+        # report běhu (JSON) - tabulky plní _record_table, souhrn _finish_run
+        self.report: dict = {"block": self.name, "tables": []}
+        backend = config.get("sync", {}).get("extract_backend", PyodbcBackend.name)
+        if backend not in EXTRACT_BACKENDS:
+            raise ValueError(f"Neznámý extract_backend '{backend}'")
+        self.extract = EXTRACT_BACKENDS[backend](self)
 
     # --- připojení ---------------------------------------------------------
 
-    def connect_mssql(self):
-        cfg = self.config["mssql"]
+    def _mssql_conn_str(self, overrides: Optional[dict] = None) -> str:
+        cfg = {**self.config["mssql"], **(overrides or {})}
         conn_str = (
             f"DRIVER={{{cfg['driver']}}};"
             f"SERVER={cfg['server']};"
@@ -278,8 +1846,25 @@ class PohodaBigQuerySync:
         )
         if cfg.get("trust_server_certificate", False):
             conn_str += "TrustServerCertificate=yes;"
+        return conn_str
+
+    def _parallelism(self) -> tuple:
+        sync_cfg = self.config.get("sync", {})
+        return (
+            max(1, sync_cfg.get("max_parallel_databases", 1)),
+            max(1, sync_cfg.get("max_parallel_queries", 1)),
+        )
+
+    def connect_mssql(self):
+        cfg = self.config["mssql"]
+        conn_str = self._mssql_conn_str()
         try:
             self.mssql_conn = pyodbc.connect(conn_str)
+            db_workers, query_workers = self._parallelism()
+            self.mssql_pool = ConnectionPool(
+                lambda: pyodbc.connect(conn_str), db_workers * query_workers
+            )
+            self.mssql_pool.add(self.mssql_conn)
             logger.info(f"[{self.name}] Připojeno k MS SQL: {cfg['server']}")
         except pyodbc.Error as e:
             logger.error(f"[{self.name}] Chyba připojení k MS SQL: {e}")
@@ -311,8 +1896,32 @@ class PohodaBigQuerySync:
             self.bq_client.create_dataset(dataset, timeout=30)
             logger.info(f"[{self.name}] Dataset {cfg['dataset']} vytvořen")
 
+    def _shared_convert_pool(self) -> Optional[ConvertPool]:
+        """ConvertPool běhu (sync.convert_processes > 1) - procesy až při potřebě."""
+        processes = self.config["sync"].get("convert_processes", 0)
+        if processes <= 1:
+            return None
+        with self._convert_pool_guard:
+            if self._convert_pool is None:
+                self._convert_pool = ConvertPool(processes)
+            return self._convert_pool
+
     def close(self):
-        if self.mssql_conn:
+        if self._convert_pool is not None:
+            self._convert_pool.close()
+            self._convert_pool = None
+        for pool in self._direct_pools.values():
+            try:
+                pool.close_all()
+            except Exception as e:
+                logger.warning(f"[{self.name}] Chyba při zavírání MS SQL: {e}")
+        self._direct_pools = {}
+        if self.mssql_pool:
+            try:
+                self.mssql_pool.close_all()
+            except Exception as e:
+                logger.warning(f"[{self.name}] Chyba při zavírání MS SQL: {e}")
+        elif self.mssql_conn:
             try:
                 self.mssql_conn.close()
             except Exception as e:
@@ -325,54 +1934,598 @@ class PohodaBigQuerySync:
 
     # --- pomocné -----------------------------------------------------------
 
+    def _strategy(self, db: dict) -> str:
+        """Jak se dotazuje databáze: linked / openquery / direct.
+
+        Z "strategy" u databáze nebo sync.strategy (výchozí linked). "auto"
+        zvolí direct, má-li databáze vlastní "server", jinak openquery.
+        linked i openquery potřebují u databáze "linked_server".
+        """
+        strategy = db.get("strategy", self.config["sync"].get("strategy", "linked"))
+        if strategy == "auto":
+            strategy = "direct" if db.get("server") else "openquery"
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Neznámá strategy '{strategy}' pro {db.get('database')}")
+        if strategy != "direct" and not db.get("linked_server"):
+            raise ValueError(
+                f"Databáze {db.get('database')}: strategy {strategy} potřebuje linked_server "
+                f"(nebo server pro direct)"
+            )
+        return strategy
+
+    @staticmethod
+    def _direct_overrides(db: dict) -> dict:
+        overrides = {"database": db["database"]}
+        for k in ("server", "username", "password", "driver"):
+            if db.get(k):
+                overrides[k] = db[k]
+        return overrides
+
+    def _conn_str_for(self, db: dict, strategy: str) -> str:
+        """Connection string pro databázi (direct přímo na ni, jinak hlavní server)."""
+        return self._mssql_conn_str(self._direct_overrides(db) if strategy == "direct" else None)
+
+    def _pool_for(self, db: dict, strategy: str) -> ConnectionPool:
+        """Pool spojení pro databázi - u direct vlastní spojení přímo na ni."""
+        if strategy != "direct":
+            return self.mssql_pool
+        overrides = self._direct_overrides(db)
+        key = (overrides.get("server", self.config["mssql"]["server"]), db["database"])
+        with self._direct_pools_guard:
+            if key not in self._direct_pools:
+                conn_str = self._mssql_conn_str(overrides)
+                _, query_workers = self._parallelism()
+                self._direct_pools[key] = ConnectionPool(
+                    lambda: pyodbc.connect(conn_str), query_workers
+                )
+                logger.info(f"[{self.name}] Přímé spojení na {key[0]} / {key[1]}")
+            return self._direct_pools[key]
+
+    @property
+    def state(self) -> StateStore:
+        """Lokální stav (sync.state_file), otevřený až při prvním použití."""
+        if self._state is None:
+            path = self.config.get("sync", {}).get("state_file", DEFAULT_STATE_FILE)
+            self._state = StateStore(path)
+        return self._state
+
     def _table_id(self, table_name: str) -> str:
         cfg = self.config["bigquery"]
         return f"{cfg['project_id']}.{cfg['dataset']}.{table_name}"
 
-    def _load_sql_file(self, sql_file: str) -> str:
-        path = Path(sql_file)
-        if not path.exists():
-            raise FileNotFoundError(f"SQL soubor {sql_file} nenalezen")
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+    def _query_span(self, database: str, table_name: str, mode: str, strategy: str,
+                    backfill: bool):
+        """Sentry span jednoho dotazu v transakci bloku (bez transakce None)."""
+        if self._transaction is None:
+            return None
+        span = self._transaction.start_child(
+            op="sync.query", description=f"{database} / {table_name}"
+        )
+        span.set_tag("database", database)
+        span.set_tag("table", table_name)
+        span.set_tag("mode", mode)
+        span.set_tag("strategy", strategy)
+        span.set_tag("backfill", backfill)
+        return span
+
+    def _record_table(self, database: str, table_name: str, mode: str,
+                      stats: "LoadStats", started: float,
+                      error: Optional[BaseException] = None, skipped: bool = False):
+        """Zapíše výsledek dvojice databáze × tabulka do reportu běhu a historie (sync_state).
+
+        Uzavře i Sentry span dotazu - volá se jako poslední krok v každé větvi.
+        """
+        duration = round(time.perf_counter() - started, 3)
+        span = stats.timer.span
+        if span is not None:
+            span.set_tag(
+                "outcome", "skipped" if skipped else "success" if error is None else "failed"
+            )
+            span.set_data("rows", stats.extracted)
+            span.set_data("rows_uploaded", stats.rows)
+            span.set_data("bytes_uploaded", stats.bytes)
+            span.set_status("ok" if error is None else "internal_error")
+            span.finish()
+        stages = stats.timer.report()
+        bytes_processed = sum(
+            v["bytes"] for k, v in stages.items() if k.startswith("finalize:")
+        )
+        self.report["tables"].append({
+            "database": database,
+            "table": table_name,
+            "mode": mode,
+            "outcome": "skipped" if skipped else "success" if error is None else "failed",
+            "error": str(error) if error else None,
+            "duration_s": duration,
+            "rows_extracted": stats.extracted,
+            "rows_uploaded": stats.rows,
+            "batches": stats.batches,
+            "bytes_uploaded": stats.bytes,
+            # RSS celého procesu během tabulky, ne paměť jen této tabulky
+            "process_peak_rss_bytes": stats.peak_rss,
+            "bytes_processed": bytes_processed,
+            "dml": stats.dml,
+            "stages": stages,
+        })
+        if self._run_id is None:
+            return
+        try:
+            self.state.record_table(
+                self._run_id, self.name, database, table_name,
+                mode=mode,
+                rows=stats.extracted,
+                bytes_uploaded=stats.bytes,
+                duration_s=duration,
+                stages=stats.timer.seconds(),
+                watermark=stats.max_watermark,
+                dml=stats.dml,
+                peak_rss=stats.peak_rss,
+                bytes_processed=bytes_processed,
+                success=error is None,
+                error=str(error) if error else None,
+                skipped=skipped,
+            )
+        except Exception as e:
+            logger.warning(f"[{self.name}] Nepodařilo se zapsat stav běhu: {e}")
+
+    def _table_lock(self, target_id: str) -> threading.Lock:
+        """Zámek cílové tabulky - finalizace do jedné tabulky nikdy neběží souběžně."""
+        with self._table_locks_guard:
+            return self._table_locks.setdefault(target_id, threading.Lock())
 
-    def _create_temp_table(self, temp_id: str, schema: List[bigquery.SchemaField]):
+    def _load_sql_file(self, sql_file: str) -> str:
+        """Obsah SQL souboru (načte se jednou za běh procesu)."""
+        if sql_file not in self._sql_files:
+            path = Path(sql_file)
+            if not path.exists():
+                raise FileNotFoundError(f"SQL soubor {sql_file} nenalezen")
+            with open(path, "r", encoding="utf-8") as f:
+                self._sql_files[sql_file] = f.read()
+        return self._sql_files[sql_file]
+
+    def _create_temp_table(self, temp_id: str, schema: List[bigquery.SchemaField],
+                           partition_by=None, cluster_by=None):
+        """Založí temp tabulku; s partition_by/cluster_by (pro copy job do cíle)
+        rovnou se stejným partitioningem a clusteringem jako cíl."""
         try:
             self.bq_client.delete_table(temp_id, not_found_ok=True)
         except Exception:
             pass
         table = bigquery.Table(temp_id, schema=schema)
+        spec = partition_spec(partition_by)
+        if spec:
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=getattr(bigquery.TimePartitioningType, spec[1]), field=spec[0]
+            )
+        if cluster_by:
+            table.clustering_fields = [cluster_by] if isinstance(cluster_by, str) else cluster_by
         self.bq_client.create_table(table)
 
-    def _stream_to_temp(self, cursor, columns, schema, temp_id, batch_size) -> int:
-        """Streamuje řádky z kurzoru po dávkách do temp tabulky."""
-        job_config = bigquery.LoadJobConfig(
+    def _set_temp_expiry(self, temp_id: str, expires: Optional[datetime]):
+        """Nastaví (None = zruší) expiraci temp tabulky ponechané pro --resume,
+        aby ji BigQuery smazal, i když se běh už nikdy nenaváže."""
+        try:
+            table = self.bq_client.get_table(temp_id)
+            table.expires = expires
+            self.bq_client.update_table(table, ["expires"])
+        except Exception as e:
+            logger.warning(f"[{self.name}] Nepodařilo se nastavit expiraci {temp_id}: {e}")
+
+    def _temp_exists(self, temp_id: str) -> bool:
+        try:
+            self.bq_client.get_table(temp_id)
+            return True
+        except NotFound:
+            return False
+
+    def _query_schema(self, query_cfg: dict, description, columns: List[str]):
+        """BQ schéma výsledku dotazu.
+
+        Výchozí "names" = build_bq_schema podle názvů sloupců; "inferred"
+        (sync.schema nebo schema u dotazu) = typy z cursor.description.
+        column_types u dotazu přepíše typ jednotlivých sloupců v obou režimech.
+        """
+        overrides = query_cfg.get("column_types")
+        source = query_cfg.get("schema", self.config["sync"].get("schema", "names"))
+        if source == "inferred":
+            return infer_bq_schema(description, columns, overrides)
+        schema = build_bq_schema(columns)
+        if overrides:
+            schema = [
+                bigquery.SchemaField(f.name, bq_type(overrides[f.name]), mode=f.mode)
+                if f.name in overrides else f
+                for f in schema
+            ]
+        return schema
+
+    def _target_casts(self, target_id: str, schema: List[bigquery.SchemaField],
+                      scales: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+        """Porovná schéma temp tabulky s existující cílovou tabulkou.
+
+        Vrací sloupec -> výraz převodu na typ cíle (cast_sql) pro sloupce
+        s jiným typem; scales = počet desetinných míst Decimal sloupců
+        z cursor.description (pro STRING cíl). Typ cíle zůstane a hodnoty se
+        při finalizaci přetypují. Full refresh tohle nevolá - jde copy jobem
+        WRITE_TRUNCATE a cíl převezme schéma (nové typy) temp tabulky; jinak
+        se na nové typy tabulka převede smazáním a backfillem.
+        """
+        try:
+            target = self.bq_client.get_table(target_id)
+        except NotFound:
+            return {}
+        existing = {f.name: bq_type(f.field_type) for f in target.schema}
+        changed = {
+            f.name: existing[f.name]
+            for f in schema
+            if f.name in existing and existing[f.name] != bq_type(f.field_type)
+        }
+        if changed:
+            detail = ", ".join(
+                f"{f.name} {changed[f.name]} -> {bq_type(f.field_type)}"
+                for f in schema if f.name in changed
+            )
+            logger.info(
+                f"[{self.name}] {target_id}: typy se liší od cílové tabulky ({detail}), "
+                f"ponechávám typ cíle"
+            )
+        scales = scales or {}
+        return {
+            f.name: cast_sql(f"S.`{f.name}`", f.field_type, changed[f.name], scales.get(f.name))
+            for f in schema if f.name in changed
+        }
+
+    def _target_layout_matches(self, target_id: str, partition_by=None, cluster_by=None) -> bool:
+        """Má existující cíl partitioning a clustering podle configu? (Neexistující = ano.)
+
+        Copy job WRITE_TRUNCATE do cíle s jiným partitioningem selže a CREATE OR
+        REPLACE partitioning změnit nedovolí - full refresh pak cíl smaže a copy
+        job ho založí znovu podle temp tabulky.
+        """
+        try:
+            target = self.bq_client.get_table(target_id)
+        except NotFound:
+            return True
+        spec = partition_spec(partition_by)
+        tp = target.time_partitioning
+        have = ((tp.field, str(tp.type_).upper()) if tp else None,
+                list(target.clustering_fields or []))
+        want = (spec, [cluster_by] if isinstance(cluster_by, str) else list(cluster_by or []))
+        if have == want:
+            return True
+        logger.warning(
+            f"[{self.name}] {target_id}: partitioning/clustering cíle {have} neodpovídá "
+            f"configu {want}, cíl se při full refreshi smaže a založí znovu"
+        )
+        return False
+
+    def _temp_load_config(self, schema: List[bigquery.SchemaField]) -> "bigquery.LoadJobConfig":
+        return bigquery.LoadJobConfig(
             write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            source_format=bigquery.SourceFormat.PARQUET,
             schema=schema,
-            ignore_unknown_values=True,
         )
-        total = 0
-        while True:
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
-                break
-            df = pd.DataFrame.from_records(
-                [tuple(r) for r in rows], columns=columns
-            )
-            df = prepare_dataframe(df)
-            job = self.bq_client.load_table_from_dataframe(
-                df, temp_id, job_config=job_config
-            )
+
+    def _load_batch(self, table: pa.Table, temp_id, job_config, stats: LoadStats,
+                    row_filter: Optional[RowHashFilter] = None,
+                    sizer: Optional[BatchSizer] = None) -> int:
+        """Převede jednu dávku, počká na její load job a započte ji do stats.
+
+        S row_filter se nahrají jen nové/změněné řádky (dávka bez změn se
+        nenahrává vůbec). Vrací průběžný počet nahraných řádků.
+        """
+        upload = row_filter.filter(table) if row_filter else table
+        nbytes = 0
+        if upload.num_rows:
+            t = time.perf_counter()
+            buf = arrow_to_parquet(upload)
+            nbytes = buf.getbuffer().nbytes
+            stats.timer.add("serialize", time.perf_counter() - t, upload.num_rows, nbytes)
+            t = time.perf_counter()
+            job = self.bq_client.load_table_from_file(buf, temp_id, job_config=job_config)
             job.result()
-            total += len(df)
-            logger.info(f"[{self.name}]   nahráno do temp: {total} řádků")
-        return total
+            elapsed = time.perf_counter() - t
+            stats.timer.add("upload", elapsed, upload.num_rows, nbytes)
+            if sizer is not None:
+                sizer.observe_load(elapsed)
+        return stats.add(table, nbytes, unchanged=table.num_rows - upload.num_rows)
+
+    def _stream_to_temp(self, cursor, columns, schema, temp_id, batch_size,
+                        stats: Optional[LoadStats] = None,
+                        row_filter: Optional[RowHashFilter] = None,
+                        checkpoint: Optional[TableCheckpoint] = None) -> int:
+        """Streamuje řádky z kurzoru po dávkách do temp tabulky.
+
+        Při sync.spool se dávky skládají do lokálních Parquet souborů
+        (_stream_to_temp_spooled), při sync.upload_workers > 1 běží fetch
+        a upload souběžně (_stream_to_temp_pipelined), jinak dávku po dávce.
+        S checkpoint se po každé nahrané dávce (souboru) uloží její klíč.
+        """
+        stats = stats if stats is not None else LoadStats()
+        sync_cfg = self.config["sync"]
+        converter = BatchConverter(
+            schema, min_rows=sync_cfg.get("convert_min_rows", 2000), name=self.name,
+            timer=stats.timer, pool=self._shared_convert_pool(),
+        )
+        sizer = self._batch_sizer(batch_size)
+        try:
+            if sync_cfg.get("spool"):
+                return self._stream_to_temp_spooled(
+                    cursor, schema, temp_id, sizer, stats, row_filter, converter, checkpoint
+                )
+            workers = sync_cfg.get("upload_workers", 1)
+            if workers > 1:
+                return self._stream_to_temp_pipelined(
+                    cursor, schema, temp_id, sizer, workers, stats, row_filter, converter,
+                    checkpoint,
+                )
+
+            job_config = self._temp_load_config(schema)
+            for seq, table in enumerate(converter.imap(fetch_batches(cursor, sizer, stats.timer))):
+                sizer.observe(table)
+                total = self._load_batch(table, temp_id, job_config, stats, row_filter, sizer)
+                if checkpoint is not None:
+                    checkpoint.batch_done(seq, table.num_rows, checkpoint.key_of(table))
+                logger.info(f"[{self.name}]   nahráno do temp: {total} řádků")
+            return stats.rows
+        finally:
+            converter.close()
+            stats.peak_rss = sizer.peak_rss or None
+            if sizer.batch_bytes and sizer.row_bytes:
+                logger.info(
+                    f"[{self.name}]   dávky: ~{sizer.row_bytes:.0f} B/řádek, "
+                    f"poslední {sizer.size} řádků, špička RSS procesu {sizer.peak_rss / 1024 / 1024:.0f} MB"
+                )
+
+    def _batch_sizer(self, batch_size: int) -> BatchSizer:
+        """BatchSizer z sync.batch_bytes_mb / max_load_seconds / max_rss_mb (MB -> bajty)."""
+        sync_cfg = self.config["sync"]
+        mb = 1024 * 1024
+        batch_mb = sync_cfg.get("batch_bytes_mb")
+        max_rss_mb = sync_cfg.get("max_rss_mb")
+        return BatchSizer(
+            batch_size,
+            batch_bytes=int(batch_mb * mb) if batch_mb else None,
+            max_load_seconds=sync_cfg.get("max_load_seconds", 60),
+            max_rss=int(max_rss_mb * mb) if max_rss_mb else None,
+            min_rows=sync_cfg.get("min_batch_size", 100),
+        )
+
+    def _upload_spool_file(self, path: str, temp_id: str, job_config, stats: LoadStats,
+                           rows: int = 0, on_done: Optional[Callable[[], None]] = None):
+        size = os.path.getsize(path)
+        t = time.perf_counter()
+        with open(path, "rb") as f:
+            self.bq_client.load_table_from_file(f, temp_id, job_config=job_config).result()
+        stats.timer.add("upload", time.perf_counter() - t, rows, size)
+        stats.add_bytes(size)
+        if on_done is not None:
+            on_done()
+        os.remove(path)
+        logger.info(
+            f"[{self.name}]   nahrán spool soubor {size / 1024 / 1024:.1f} MB "
+            f"(celkem {stats.rows} řádků)"
+        )
+
+    def _stream_to_temp_spooled(self, cursor, schema, temp_id, sizer: BatchSizer,
+                                stats: LoadStats,
+                                row_filter: Optional[RowHashFilter] = None,
+                                converter: Optional[BatchConverter] = None,
+                                checkpoint: Optional[TableCheckpoint] = None) -> int:
+        """Dávky do komprimovaného Parquet souboru, jeden load job na soubor.
+
+        Soubor se uzavře po dosažení sync.spool_file_max_mb (výchozí 512 MB)
+        a nahraje na pozadí, zatímco se plní další - na disku jsou tak
+        nejvýš dva soubory. Všechny soubory se po nahrání i při chybě mažou.
+        """
+        sync_cfg = self.config["sync"]
+        spool_dir = sync_cfg.get("spool_dir") or tempfile.gettempdir()
+        max_bytes = int(sync_cfg.get("spool_file_max_mb", 512) * 1024 * 1024)
+        prefix = f"{temp_id.rsplit('.', 1)[-1]}_"
+        job_config = self._temp_load_config(schema)
+
+        files: List[str] = []
+        writer = None
+        file_rows = 0
+        # checkpoint souboru: (řádky z kurzoru, klíč poslední dávky)
+        file_extracted, file_key = 0, None
+        pending = None
+        uploader = ThreadPoolExecutor(max_workers=1)
+
+        def roll():
+            nonlocal writer, pending, file_rows, file_extracted
+            writer.close()
+            writer = None
+            if pending is not None:
+                t = time.perf_counter()
+                pending.result()
+                stats.timer.add("upload_wait", time.perf_counter() - t)
+            on_done = None
+            if checkpoint is not None:
+                on_done = partial(
+                    checkpoint.batch_done, len(files) - 1, file_extracted, file_key
+                )
+            pending = uploader.submit(
+                self._upload_spool_file, files[-1], temp_id, job_config, stats, file_rows,
+                on_done,
+            )
+            file_rows = file_extracted = 0
+
+        try:
+            converter = converter or BatchConverter(schema, timer=stats.timer)
+            for table in converter.imap(fetch_batches(cursor, sizer, stats.timer)):
+                sizer.observe(table)
+                upload = row_filter.filter(table) if row_filter else table
+                stats.add(table, unchanged=table.num_rows - upload.num_rows)
+                if checkpoint is not None:
+                    file_extracted += table.num_rows
+                    file_key = checkpoint.key_of(table)
+                if not upload.num_rows:
+                    continue
+                if writer is None:
+                    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".parquet", dir=spool_dir)
+                    os.close(fd)
+                    files.append(path)
+                    writer = pq.ParquetWriter(path, upload.schema, compression="zstd")
+                t = time.perf_counter()
+                writer.write_table(upload)
+                stats.timer.add("serialize", time.perf_counter() - t, upload.num_rows)
+                file_rows += upload.num_rows
+                if os.path.getsize(files[-1]) >= max_bytes:
+                    roll()
+            if writer is not None:
+                roll()
+            if pending is not None:
+                t = time.perf_counter()
+                pending.result()
+                stats.timer.add("upload_wait", time.perf_counter() - t)
+        finally:
+            if writer is not None:
+                writer.close()
+            uploader.shutdown(wait=True)
+            for path in files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return stats.rows
+
+    def _stream_to_temp_pipelined(self, cursor, schema, temp_id, sizer: BatchSizer, workers,
+                                  stats: LoadStats,
+                                  row_filter: Optional[RowHashFilter] = None,
+                                  converter: Optional[BatchConverter] = None,
+                                  checkpoint: Optional[TableCheckpoint] = None) -> int:
+        """Fetch v producer vlákně -> omezená fronta -> `workers` vláken převod + load.
+
+        Fronta (sync.pipeline_queue_size, výchozí 2× workers) drží backpressure:
+        když BigQuery nestíhá, fetch čeká. První chyba (fetch i upload) zastaví
+        obě strany a po doběhnutí vláken se znovu vyhodí.
+        """
+        queue_size = self.config["sync"].get("pipeline_queue_size", workers * 2)
+        batches: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        job_config = self._temp_load_config(schema)
+        converter = converter or BatchConverter(schema, timer=stats.timer)
+        stop = threading.Event()
+        lock = threading.Lock()
+        errors: List[BaseException] = []
+
+        def fail(exc: BaseException):
+            with lock:
+                errors.append(exc)
+            stop.set()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                seq = 0
+                while not stop.is_set():
+                    t = time.perf_counter()
+                    rows = cursor.fetchmany(sizer.size)
+                    stats.timer.add("fetch", time.perf_counter() - t, rows=len(rows))
+                    if not rows:
+                        break
+                    t = time.perf_counter()
+                    if not put((seq, rows)):
+                        return
+                    seq += 1
+                    # fetch čeká na volné místo ve frontě = BigQuery nestíhá
+                    stats.timer.add("queue_wait", time.perf_counter() - t)
+            except BaseException as e:
+                fail(e)
+            finally:
+                for _ in range(workers):
+                    put(None)
+
+        def consume():
+            while not stop.is_set():
+                try:
+                    item = batches.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    return
+                seq, rows = item
+                try:
+                    table = converter.convert(rows)
+                    sizer.observe(table)
+                    done = self._load_batch(table, temp_id, job_config, stats, row_filter, sizer)
+                    if checkpoint is not None:
+                        checkpoint.batch_done(seq, table.num_rows, checkpoint.key_of(table))
+                except BaseException as e:
+                    fail(e)
+                    return
+                logger.info(f"[{self.name}]   nahráno do temp: {done} řádků")
+
+        with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+            futures = [pool.submit(produce)] + [pool.submit(consume) for _ in range(workers)]
+            wait(futures)
+
+        if errors:
+            raise errors[0]
+        return stats.rows
 
     # --- jeden dotaz × jedna databáze -------------------------------------
 
-    def sync_query(self, db: dict, query_cfg: dict, backfill: bool):
-        sql_file = query_cfg["file"]
-        table_name = Path(sql_file).stem
+    def _script_jobs(self, job) -> list:
+        """Joby jednotlivých příkazů - u skriptu podřízené joby, jinak job sám."""
+        if getattr(job, "statement_type", None) == "SCRIPT":
+            return list(self.bq_client.list_jobs(parent_job=job))
+        return [job]
+
+    def _dml_stats(self, job, jobs: Optional[list] = None) -> Optional[Dict[str, int]]:
+        """Počty vložených/aktualizovaných/smazaných řádků dokončeného query jobu.
+
+        U skriptu (DECLARE + MERGE) je nese až podřízený job, sečtou se.
+        """
+        jobs = jobs if jobs is not None else self._script_jobs(job)
+        result = None
+        for j in jobs:
+            dml = getattr(j, "dml_stats", None)
+            if dml is None:
+                continue
+            result = result or {"inserted": 0, "updated": 0, "deleted": 0}
+            result["inserted"] += dml.inserted_row_count or 0
+            result["updated"] += dml.updated_row_count or 0
+            result["deleted"] += dml.deleted_row_count or 0
+        return result
+
+    @staticmethod
+    def _record_job_stages(timer: StageTimer, jobs: list):
+        """Doba každého příkazu finalizace z časů BQ jobu -> fáze finalize:<typ>."""
+        for job in jobs:
+            job_started, job_ended = getattr(job, "started", None), getattr(job, "ended", None)
+            if job_started is None or job_ended is None:
+                continue
+            kind = getattr(job, "statement_type", None) or getattr(job, "job_type", None) or "job"
+            timer.add(
+                f"finalize:{kind.lower()}",
+                (job_ended - job_started).total_seconds(),
+                rows=getattr(job, "num_dml_affected_rows", None) or 0,
+                nbytes=getattr(job, "total_bytes_processed", None) or 0,
+                started_at=job_started,
+            )
+
+    def _query_fingerprint(self, conn, sql: str, params: Optional[list] = None) -> tuple:
+        """Otisk výsledku; sql už je obalené fingerprint_sql (viz build_statement)."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, *(params or []))
+            row_count, checksum, max_change = cursor.fetchone()
+        finally:
+            cursor.close()
+        max_change = _as_datetime(max_change)
+        return (int(row_count), checksum, max_change.isoformat() if max_change else None)
+
+    def sync_query(self, db: dict, query_cfg: dict, backfill: bool, force: bool = False):
+        sql_file = query_cfg.get("file")
+        table_name = query_table_name(query_cfg)
         mode = query_cfg.get("mode", "incremental")
         key = query_cfg.get("key", "ID")
 
@@ -383,92 +2536,513 @@ class PohodaBigQuerySync:
         else:
             days_back = query_cfg.get("days_back", sync_cfg.get("days_back", 7))
 
-        linked_server = db["linked_server"]
+        linked_server = db.get("linked_server")
         database = db["database"]
 
+        watermark_column = query_cfg.get("watermark_column")
+        watermark = None
+        if watermark_column and not backfill:
+            stored = self.state.get_watermark(self.name, database, table_name)
+            if stored is not None:
+                overlap = query_cfg.get(
+                    "watermark_overlap_minutes", sync_cfg.get("watermark_overlap_minutes", 60)
+                )
+                watermark = stored - timedelta(minutes=overlap)
+
+        strategy = self._strategy(db)
         logger.info(
             f"[{self.name}] {database} / {table_name} "
-            f"(mode={mode}, backfill={backfill}, days_back={days_back})"
+            f"(mode={mode}, backfill={backfill}, days_back={days_back}"
+            + (f", watermark={watermark:%Y-%m-%d %H:%M:%S}" if watermark else "")
+            + (f", strategy={strategy}" if strategy != "linked" else "")
+            + ")"
         )
 
-        sql = prepare_sql(self._load_sql_file(sql_file), linked_server, database, days_back)
+        stats = LoadStats(watermark_column)
+        timer = stats.timer
+        started = time.perf_counter()
+
+        # --resume: hotové dvojice přeskočit, rozpracovanou navázat na temp tabulku
+        resume_key = query_cfg.get("resume_key")
+        saved = (
+            self.state.get_checkpoint(self.name, backfill, database, table_name)
+            if self._resume else None
+        )
+        if saved and saved["status"] == "done":
+            logger.info(
+                f"[{self.name}] ⏭ {database} / {table_name}: hotovo v přerušeném běhu, přeskakuji"
+            )
+            self._record_table(database, table_name, mode, stats, started, skipped=True)
+            return
+        if saved and not (resume_key and saved["temp_id"] and saved["last_key"] is not None
+                          and self._temp_exists(saved["temp_id"])):
+            # nenavazuje se - dvojice začne znovu, starou temp tabulku smazat
+            if saved["temp_id"]:
+                self.bq_client.delete_table(saved["temp_id"], not_found_ok=True)
+            saved = None
+
+        compiled = compile_sql(
+            query_cfg["sql"] if "sql" in query_cfg else self._load_sql_file(sql_file),
+            linked_server, database, watermark is not None,
+            strategy,
+        )
+        # otisk i resume_key obalují dotaz jako poddotaz
+        problem = derived_table_problem(compiled.text)
+        if problem and resume_key:
+            raise ValueError(f"{table_name}: resume_key nejde použít - {problem}")
+        wrap, after_params = None, []
+        if resume_key:
+            after = None
+            if saved:
+                # OPENQUERY nebere parametry - klíč jako literál
+                after = _sql_literal(saved["last_key"]) if strategy == "openquery" else "?"
+                after_params = [] if strategy == "openquery" else [saved["last_key"]]
+            wrap = lambda q: resume_sql(q, resume_key, after)  # noqa: E731
+        sql, params = build_statement(
+            compiled, compiled.params(days_back, watermark), strategy, linked_server, wrap=wrap
+        )
+        params += after_params
 
         target_id = self._table_id(table_name)
-        temp_id = f"{target_id}_temp_{int(datetime.now().timestamp())}"
+        if saved:
+            temp_id = saved["temp_id"]
+        else:
+            temp_id = f"{target_id}_temp_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
+        checkpoint = None
+        if resume_key:
+            checkpoint = TableCheckpoint(
+                self.state, self.name, backfill, database, table_name, temp_id, resume_key,
+                *((saved["rows"], saved["last_key"]) if saved else ()),
+            )
 
-        cursor = self.mssql_conn.cursor()
-        try:
-            cursor.execute(sql)
-            columns = dedupe_columns([d[0] for d in cursor.description])
-            schema = build_bq_schema(columns)
+        row_filter = None
+        if query_cfg.get("row_hash"):
+            if mode == "incremental":
+                row_filter = RowHashFilter(self.state, self.name, table_name, key)
+            else:
+                logger.warning(
+                    f"[{self.name}] {table_name}: row_hash funguje jen s mode=incremental, ignoruji"
+                )
 
-            self._create_temp_table(temp_id, schema)
-            total = self._stream_to_temp(cursor, columns, schema, temp_id, batch_size)
-            cursor.close()
+        # Uzavřené roky se při backfillu skoro nemění - stačí porovnat otisk.
+        check_fingerprint = (
+            backfill
+            and db is not self.config["databases"]["current"]
+            and query_cfg.get("skip_unchanged", sync_cfg.get("backfill_skip_unchanged", True))
+        )
+        fingerprint = None
+        if problem and check_fingerprint:
+            logger.warning(f"[{self.name}] {table_name}: otisk se nepočítá - {problem}")
+            check_fingerprint = False
 
-            statements = build_finalize_statements(
-                mode, backfill, target_id, temp_id, key, columns
-            )
-            for stmt in statements:
-                self.bq_client.query(stmt).result()
+        if self._finalizer is not None:
+            self._finalizer.raise_failed()
 
-            logger.info(
-                f"[{self.name}] ✓ {database} / {table_name}: {total} řádků "
-                f"({'append' if backfill and mode == 'full' else mode})"
+        handed_off = False
+        with self.extract.connection(db, strategy, batch_size) as conn:
+            cursor = conn.cursor()
+            try:
+                timer.span = self._query_span(database, table_name, mode, strategy, backfill)
+                if check_fingerprint:
+                    with timer.stage("fingerprint"):
+                        fingerprint = self._query_fingerprint(conn, *build_statement(
+                            compiled, compiled.params(days_back, watermark), strategy,
+                            linked_server, wrap=lambda q: fingerprint_sql(q, watermark_column),
+                        ))
+                    stored = self.state.get_fingerprint(self.name, database, table_name)
+                    if not force and fingerprint == stored:
+                        logger.info(
+                            f"[{self.name}] ⏭ {database} / {table_name}: beze změny "
+                            f"od posledního backfillu ({fingerprint[0]} řádků), přeskakuji"
+                        )
+                        self.state.set_checkpoint(self.name, backfill, database, table_name, "done")
+                        self._record_table(
+                            database, table_name, mode, stats, started, skipped=True
+                        )
+                        return
+
+                # execute vrací, až server začne posílat výsledek (čas do prvního řádku)
+                with timer.stage("execute"):
+                    cursor.execute(sql, *params)
+                description = cursor.description
+                columns = dedupe_columns([d[0] for d in description])
+                if watermark_column and watermark_column not in columns:
+                    raise ValueError(
+                        f"{sql_file or table_name}: watermark_column '{watermark_column}' "
+                        f"není ve výsledku dotazu (sloupce: {', '.join(columns)})"
+                    )
+                if resume_key:
+                    if resume_key not in columns:
+                        raise ValueError(f"resume_key '{resume_key}' není ve výsledku dotazu")
+                    key_type = description[columns.index(resume_key)][1]
+                    if key_type not in RESUME_KEY_TYPES:
+                        raise ValueError(
+                            f"resume_key '{resume_key}' má typ {key_type.__name__}, "
+                            f"podporované jsou jen celá čísla a text"
+                        )
+                schema = self._query_schema(query_cfg, description, columns)
+                hash_column = None
+                if query_cfg.get("merge_hash") and mode == "incremental":
+                    hash_column = ROW_HASH_COLUMN
+                    columns = columns + [ROW_HASH_COLUMN]
+                    schema = schema + [bigquery.SchemaField(ROW_HASH_COLUMN, "INT64")]
+                options = table_options_sql(
+                    schema, query_cfg.get("partition_by"), query_cfg.get("cluster_by")
+                )
+                spec = partition_spec(query_cfg.get("partition_by"))
+                prune_column = spec[0] if spec and query_cfg.get("prune_merge") else None
+
+                # Full refresh = copy job temp -> cíl (WRITE_TRUNCATE): atomická
+                # výměna bez druhého zápisu a bez query bajtů za CTAS. Cíl s jiným
+                # partitioningem/clusteringem se smaže a copy job ho založí znovu.
+                replace = mode == "full" and not backfill
+                recreate_target = replace and not self._target_layout_matches(
+                    target_id, query_cfg.get("partition_by"), query_cfg.get("cluster_by")
+                )
+                if saved:
+                    logger.info(
+                        f"[{self.name}]   navazuji v {temp_id} za {resume_key} = "
+                        f"{saved['last_key']} ({saved['rows']} řádků nahráno dříve)"
+                    )
+                    self._set_temp_expiry(temp_id, None)
+                else:
+                    with timer.stage("create_temp"):
+                        if replace:
+                            self._create_temp_table(
+                                temp_id, schema,
+                                query_cfg.get("partition_by"), query_cfg.get("cluster_by"),
+                            )
+                        else:
+                            self._create_temp_table(temp_id, schema)
+                with timer.stage("stream"):
+                    total = self._stream_to_temp(
+                        cursor, columns, schema, temp_id, batch_size, stats, row_filter,
+                        checkpoint,
+                    )
+                cursor.close()
+
+                if replace:
+                    # copy job přebírá schéma temp tabulky, SQL se nestaví
+                    statements = []
+                else:
+                    # i schéma podle názvů může mířit do cíle s typy z dřívějšího "inferred"
+                    scales = {c: d[5] for c, d in zip(columns, description) if len(d) > 5}
+                    casts = self._target_casts(target_id, schema, scales)
+                    statements = build_finalize_statements(
+                        mode, backfill, target_id, temp_id, key, columns, casts,
+                        options, prune_column, hash_column, database,
+                    )
+                if row_filter and total == 0 and not saved:
+                    # nic se nezměnilo - MERGE prázdné temp tabulky by nic neudělal
+                    statements = []
+
+                def finalize():
+                    error = None
+                    try:
+                        jobs = []
+                        with timer.stage("finalize"), self._table_lock(target_id):
+                            if replace:
+                                if recreate_target:
+                                    self.bq_client.delete_table(target_id, not_found_ok=True)
+                                job = self.bq_client.copy_table(
+                                    temp_id, target_id,
+                                    job_config=bigquery.CopyJobConfig(
+                                        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+                                    ),
+                                )
+                                job.result()
+                                jobs = [job]
+                            elif statements:
+                                job = self.bq_client.query(finalize_script(statements))
+                                job.result()
+                                jobs = self._script_jobs(job)
+                                stats.dml = self._dml_stats(job, jobs)
+                        self._record_job_stages(timer, jobs)
+
+                        if row_filter:
+                            row_filter.commit()
+                        if fingerprint is not None:
+                            self.state.set_fingerprint(self.name, database, table_name, fingerprint)
+                        if stats.max_watermark is not None:
+                            self.state.set_watermark(
+                                self.name, database, table_name, stats.max_watermark
+                            )
+                        self.state.set_checkpoint(self.name, backfill, database, table_name, "done")
+                    except Exception as e:
+                        error = e
+                        logger.error(f"[{self.name}] Chyba u {database}/{table_name}: {e}")
+                        capture_exception(e)
+                        raise
+                    finally:
+                        with timer.stage("cleanup"):
+                            try:
+                                self.bq_client.delete_table(temp_id, not_found_ok=True)
+                            except Exception:
+                                pass
+                        self._record_table(database, table_name, mode, stats, started, error)
+                    logger.info(
+                        f"[{self.name}] ✓ {database} / {table_name}: {total} řádků "
+                        f"({'append' if backfill and mode == 'full' else mode})"
+                        + (f", beze změny {stats.unchanged}" if row_filter else "")
+                        + (
+                            f", DML: vloženo {stats.dml['inserted']}, "
+                            f"aktualizováno {stats.dml['updated']}"
+                            if stats.dml else ""
+                        )
+                    )
+
+                # od teď se o chyby i smazání temp tabulky stará finalize()
+                handed_off = True
+                if self._finalizer is not None:
+                    self._finalizer.submit(target_id, finalize)
+                else:
+                    finalize()
+            except Exception as e:
+                if handed_off:
+                    raise
+                logger.error(f"[{self.name}] Chyba u {database}/{table_name}: {e}")
+                self._record_table(database, table_name, mode, stats, started, e)
+                capture_exception(e)
+                raise
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+                # s checkpointem se nahraná část ponechá pro --resume
+                keep_temp = checkpoint is not None and checkpoint.rows > 0
+                if not handed_off and keep_temp:
+                    keep_days = sync_cfg.get("resume_keep_days", 7)
+                    logger.info(
+                        f"[{self.name}]   temp tabulka {temp_id} ponechána pro --resume "
+                        f"({checkpoint.rows} řádků do {resume_key} = {checkpoint.last_key}, "
+                        f"vyprší za {keep_days} dní)"
+                    )
+                    self._set_temp_expiry(
+                        temp_id, datetime.now(timezone.utc) + timedelta(days=keep_days)
+                    )
+                elif not handed_off:
+                    try:
+                        self.bq_client.delete_table(temp_id, not_found_ok=True)
+                    except Exception:
+                        pass
+
+    def rebuild_row_hash_index(self, query_cfg: dict) -> int:
+        """Sestaví index klíč -> hash pro dotaz znovu z obsahu cílové tabulky v BQ.
+
+        Čte tabulku přes list_rows (bez query poplatku). Neexistující cílová
+        tabulka = prázdný index. Vrací počet zaindexovaných řádků.
+        """
+        table_name = query_table_name(query_cfg)
+        key = query_cfg.get("key", "ID")
+        target_id = self._table_id(table_name)
+        self.state.clear_row_hashes(self.name, table_name)
+        try:
+            batches = self.bq_client.list_rows(target_id).to_arrow_iterable()
+        except NotFound:
+            logger.info(f"[{self.name}] {table_name}: cílová tabulka neexistuje, index prázdný")
+            return 0
+        total = 0
+        for batch in batches:
+            table = pa.Table.from_batches([batch])
+            keys = [None if k is None else str(k) for k in table.column(key).to_pylist()]
+            hashes = table_row_hashes(table).tolist()
+            self.state.put_row_hashes(
+                self.name, table_name, ((k, h) for k, h in zip(keys, hashes) if k is not None)
             )
+            total += table.num_rows
+        logger.info(f"[{self.name}] ✓ {table_name}: index hashů obnoven ({total} řádků)")
+        return total
+
+    def rebuild_hash_indexes(self, only: Optional[List[str]] = None) -> bool:
+        """--rebuild-hash-index: obnoví indexy všech dotazů s row_hash v bloku."""
+        try:
+            self.connect_bigquery()
+            for query_cfg in self.config["sync"]["queries"]:
+                if only and query_cfg["file"] not in only:
+                    continue
+                if query_cfg.get("row_hash"):
+                    self.rebuild_row_hash_index(query_cfg)
+            return True
         except Exception as e:
-            logger.error(f"[{self.name}] Chyba u {database}/{table_name}: {e}")
+            logger.error(f"[{self.name}] ✗ Obnova indexu hashů selhala: {e}")
             capture_exception(e)
-            raise
+            return False
         finally:
-            try:
-                cursor.close()
-            except Exception:
-                pass
-            try:
-                self.bq_client.delete_table(temp_id, not_found_ok=True)
-            except Exception:
-                pass
+            self.close()
 
     # --- běh bloku ---------------------------------------------------------
 
+    def _run_databases(self, dbs: List[dict], queries: List[dict], backfill: bool,
+                       force: bool = False):
+        """Projde databáze × dotazy, souběžně dle sync.max_parallel_databases/queries.
+
+        Current databáze běží vždy jako poslední etapa (viz database_stages).
+        Pořadí MERGE mezi historickými databázemi je při souběhu libovolné.
+        """
+        db_workers, query_workers = self._parallelism()
+        finalize_workers = self.config["sync"].get("finalize_workers", 0)
+
+        def run_database(db):
+            run_parallel(
+                [lambda q=q: self.sync_query(db, q, backfill, force) for q in queries],
+                query_workers,
+            )
+
+        self._finalizer = FinalizeQueue(finalize_workers) if finalize_workers > 0 else None
+        try:
+            for stage in database_stages(dbs, self.config["databases"]["current"]):
+                run_parallel([lambda db=db: run_database(db) for db in stage], db_workers)
+        finally:
+            # na rozběhnuté finalizace se čeká i po chybě extrakce
+            error = self._finalizer.join() if self._finalizer is not None else None
+            self._finalizer = None
+        if error is not None:
+            raise error
+
     def run(self, backfill: bool = False, database: Optional[str] = None,
-            only: Optional[List[str]] = None) -> bool:
+            only: Optional[List[str]] = None, force: bool = False, resume: bool = False) -> bool:
+        """Běh bloku jako Sentry transakce (spany dotazů a fází viz StageTimer)."""
+        with sentry_sdk.start_transaction(op="sync.block", name=f"pohoda_sync {self.name}") as tx:
+            tx.set_tag("block", self.name)
+            tx.set_tag("backfill", backfill)
+            self._transaction = tx
+            try:
+                ok = self._run(backfill, database, only, force, resume)
+            finally:
+                self._transaction = None
+            tx.set_status("ok" if ok else "internal_error")
+            return ok
+
+    def _run(self, backfill: bool, database: Optional[str], only: Optional[List[str]],
+             force: bool, resume: bool = False) -> bool:
         start = datetime.now()
         logger.info("=" * 70)
         logger.info(
             f"[{self.name}] START (backfill={backfill}"
             + (f", database={database}" if database else "")
+            + (", resume" if resume else "")
             + ")"
         )
+        self._resume = resume
+        self.report = {
+            "block": self.name, "backfill": backfill, "started_at": start.isoformat(), "tables": [],
+        }
+        try:
+            self._run_id = self.state.start_run(self.name, backfill)
+        except Exception as e:
+            logger.warning(f"[{self.name}] Nepodařilo se založit záznam běhu: {e}")
         try:
             self.connect_mssql()
             self.connect_bigquery()
+            if resume:
+                done = [c for c in self.state.checkpoints(self.name, backfill)
+                        if c["status"] == "done"]
+                logger.info(f"[{self.name}] --resume: {len(done)} hotových dvojic z přerušeného běhu")
+            else:
+                self._discard_checkpoints(backfill)
 
             dbs = databases_to_process(self.config["databases"], backfill, database)
             if not dbs:
                 logger.warning(f"[{self.name}] Žádná databáze ke zpracování (filter={database})")
+                self._finish_run(True)
                 return True
 
             queries = self.config["sync"]["queries"]
             if only:
                 queries = [q for q in queries if q["file"] in only]
-
-            for db in dbs:
-                for query_cfg in queries:
-                    self.sync_query(db, query_cfg, backfill)
+                if self.config["sync"].get("dimensions"):
+                    logger.info(
+                        f"[{self.name}] --only: dimenze se přeskakují, view se obnoví "
+                        f"nad dim_* tabulkami z dřívějších běhů"
+                    )
+            else:
+                # číselníky jednou za databázi a běh, před fakty
+                queries = [
+                    dimension_query(d) for d in self.config["sync"].get("dimensions", [])
+                ] + queries
+
+            self._run_databases(dbs, queries, backfill, force)
+            self._create_views()
+            # jen zpracované dvojice - checkpointy mimo --database/--only zůstanou
+            self._discard_checkpoints(backfill, [
+                (db["database"], query_table_name(q)) for db in dbs for q in queries
+            ])
 
             dur = (datetime.now() - start).total_seconds()
             logger.info(f"[{self.name}] ✓ Hotovo za {dur:.1f}s")
+            self._finish_run(True)
             return True
         except Exception as e:
             dur = (datetime.now() - start).total_seconds()
             logger.error(f"[{self.name}] ✗ Selhalo po {dur:.1f}s: {e}")
             capture_exception(e)
+            self._finish_run(False, e)
             return False
         finally:
             self.close()
 
+    def _discard_checkpoints(self, backfill: bool, pairs: Optional[List[tuple]] = None):
+        """Zahodí checkpointy i ponechané temp tabulky - všechny (běh bez --resume
+        začíná znovu), nebo jen dvojice (databáze, tabulka) z pairs."""
+        for checkpoint in self.state.checkpoints(self.name, backfill):
+            if pairs is not None and (checkpoint["database"], checkpoint["table_name"]) not in pairs:
+                continue
+            if checkpoint["status"] == "partial" and checkpoint["temp_id"]:
+                try:
+                    self.bq_client.delete_table(checkpoint["temp_id"], not_found_ok=True)
+                except Exception as e:
+                    logger.warning(
+                        f"[{self.name}] Nepodařilo se smazat {checkpoint['temp_id']}: {e}"
+                    )
+        self.state.clear_checkpoints(self.name, backfill, pairs)
+
+    def _create_views(self):
+        """Vytvoří/obnoví view ze sync.views (fakta + dim_* tabulky)."""
+        for view_cfg in self.config["sync"].get("views", []):
+            self.bq_client.query(build_view_sql(view_cfg, self._table_id)).result()
+            logger.info(f"[{self.name}] ✓ view {view_cfg['name']}")
+
+    def _finish_run(self, success: bool, error: Optional[BaseException] = None):
+        now = datetime.now()
+        self.report.update(
+            finished_at=now.isoformat(),
+            duration_s=round(
+                (now - datetime.fromisoformat(self.report.get("started_at", now.isoformat())))
+                .total_seconds(), 3
+            ),
+            outcome="success" if success else "failed",
+            error=str(error) if error else None,
+        )
+        if self._run_id is not None:
+            try:
+                self.state.finish_run(self._run_id, success, str(error) if error else None)
+            except Exception as e:
+                logger.warning(f"[{self.name}] Nepodařilo se uzavřít záznam běhu: {e}")
+        self._prune_history()
+        self._write_metrics()
+
+    def _prune_history(self):
+        """Smaže běhy starší než sync.history_keep_days (0 = ponechat vše)."""
+        keep_days = self.config["sync"].get("history_keep_days", 90)
+        if not keep_days:
+            return
+        try:
+            self.state.prune_history(self.name, datetime.now() - timedelta(days=keep_days))
+        except Exception as e:
+            logger.warning(f"[{self.name}] Nepodařilo se promazat historii běhů: {e}")
+
+    def _write_metrics(self):
+        """Metriky pro node_exporter do sync.metrics_file ({block} = název bloku)."""
+        path = self.config["sync"].get("metrics_file")
+        if not path:
+            return
+        path = path.replace("{block}", self.name)
+        try:
+            write_textfile(path, render_metrics(self.state, self.name, self.report))
+        except Exception as e:
+            logger.warning(f"[{self.name}] Nepodařilo se zapsat metriky: {e}")
+
 
 # ---------------------------------------------------------------------------
 # Orchestrace + CLI
@@ -513,6 +3087,153 @@ def setup_sentry(blocks: List[dict]):
             return
 
 
+class BlockLogFilter(logging.Filter):
+    """Doplní prefix [blok] ke zprávám, které ho ještě nemají (např. z knihoven)."""
+
+    def __init__(self, block_name: str):
+        super().__init__()
+        self.prefix = f"[{block_name}]"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg = record.getMessage()
+        if not msg.startswith(self.prefix):
+            record.msg = f"{self.prefix} {msg}"
+            record.args = None
+        return True
+
+
+# Start procesů bloků (--parallel-blocks; spawn - bez zděděných spojení a vláken).
+BLOCK_START_METHOD = "spawn"
+
+
+def _block_process(block: dict, blocks: List[dict], run_kwargs: dict, log_queue,
+                   report_path: Optional[str] = None):
+    """Vstupní bod procesu pro jeden blok (--parallel-blocks).
+
+    Logy jdou přes frontu do rodiče (jediný zapisovatel do sync.log), Sentry
+    se inicializuje znovu - přednostně z vlastního bloku. Report bloku se
+    předá rodiči přes soubor report_path.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(getattr(logging, block.get("logging", {}).get("log_level", "INFO")))
+    handler = QueueHandler(log_queue)
+    handler.addFilter(BlockLogFilter(block.get("name", "default")))
+    root.addHandler(handler)
+
+    setup_sentry([block] + blocks)
+    syncer = PohodaBigQuerySync(block)
+    ok = syncer.run(**run_kwargs)
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(syncer.report, f, default=str)
+    sys.exit(0 if ok else 1)
+
+
+def _read_block_report(path: str, name: str, exitcode: Optional[int]) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        # proces spadl dřív, než report zapsal
+        return {"block": name, "outcome": "failed",
+                "error": f"proces skončil s kódem {exitcode}", "tables": []}
+
+
+def run_blocks_parallel(blocks: List[dict], workers: int, run_kwargs: dict,
+                        reports: Optional[list] = None) -> bool:
+    """Spustí bloky v samostatných procesech, max. `workers` najednou.
+
+    Každý blok má vlastní proces, takže pád jednoho (i tvrdý, např. v ODBC
+    driveru) neovlivní ostatní. Vrací True, jen když všechny skončily s 0.
+    Do `reports` se doplní reporty bloků (v pořadí dokončení).
+    """
+    ctx = multiprocessing.get_context(BLOCK_START_METHOD)
+    log_queue = ctx.Queue()
+    listener = QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
+    report_dir = tempfile.TemporaryDirectory(prefix="pohoda_reports_")
+
+    pending = list(enumerate(blocks))
+    running: Dict[int, tuple] = {}
+    all_ok = True
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                i, block = pending.pop(0)
+                name = block.get("name", "default")
+                report_path = os.path.join(report_dir.name, f"{i}.json")
+                proc = ctx.Process(
+                    target=_block_process,
+                    args=(block, blocks, run_kwargs, log_queue, report_path),
+                    name=f"block-{name}",
+                )
+                proc.start()
+                running[proc.sentinel] = (proc, name, report_path)
+
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                proc, name, report_path = running.pop(sentinel)
+                proc.join()
+                if proc.exitcode != 0:
+                    all_ok = False
+                    logger.error(f"[{name}] ✗ Proces bloku skončil s kódem {proc.exitcode}")
+                if reports is not None:
+                    reports.append(_read_block_report(report_path, name, proc.exitcode))
+    finally:
+        for proc, _, _ in running.values():
+            proc.join()
+        listener.stop()
+        report_dir.cleanup()
+    return all_ok
+
+
+def summarize_stages(block_reports: List[dict]) -> Dict[str, dict]:
+    """Součty fází přes všechny tabulky všech bloků."""
+    totals: Dict[str, dict] = {}
+    for block in block_reports:
+        for table in block.get("tables", []):
+            for name, stage in table.get("stages", {}).items():
+                total = totals.setdefault(name, {"seconds": 0.0, "count": 0, "rows": 0, "bytes": 0})
+                for k in total:
+                    total[k] += stage.get(k, 0)
+    for total in totals.values():
+        total["seconds"] = round(total["seconds"], 3)
+    return totals
+
+
+def run_report_path(blocks: List[dict], started: datetime,
+                    override: Optional[str] = None) -> Optional[str]:
+    """Cesta k JSON reportu: --report, jinak sync.report_dir prvního bloku (bez něj vypnuto)."""
+    if override:
+        return override
+    report_dir = blocks[0].get("sync", {}).get("report_dir") if blocks else None
+    if not report_dir:
+        return None
+    return str(Path(report_dir) / f"run_{started:%Y%m%d_%H%M%S}.json")
+
+
+def write_run_report(path: str, block_reports: List[dict], started: datetime, ok: bool,
+                     argv: Optional[List[str]] = None):
+    """Zapíše report jednoho spuštění (všechny bloky) atomicky - přes dočasný soubor."""
+    finished = datetime.now()
+    report = {
+        "started_at": started.isoformat(),
+        "finished_at": finished.isoformat(),
+        "duration_s": round((finished - started).total_seconds(), 3),
+        "outcome": "success" if ok else "failed",
+        "argv": argv if argv is not None else sys.argv[1:],
+        "stages": summarize_stages(block_reports),
+        "blocks": block_reports,
+    }
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, target)
+
+
 def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Synchronizace Pohoda (MS SQL) -> BigQuery"
@@ -523,6 +3244,18 @@ def parse_args(argv=None):
     parser.add_argument("--database", help="Omezit na jednu konkrétní databázi")
     parser.add_argument("--block", help="Omezit na jeden config blok podle 'name'")
     parser.add_argument("--only", help="Omezit na vybrané SQL soubory (čárkou oddělené)")
+    parser.add_argument("--force", action="store_true",
+                        help="Při --backfill nepřeskakovat historické databáze beze změny")
+    parser.add_argument("--resume", action="store_true",
+                        help="Navázat na přerušený běh (se stejnými parametry): přeskočit "
+                             "hotové dvojice databáze × dotaz, u resume_key pokračovat "
+                             "od poslední nahrané dávky")
+    parser.add_argument("--rebuild-hash-index", action="store_true",
+                        help="Jen obnovit lokální index hashů řádků (row_hash) z BigQuery")
+    parser.add_argument("--parallel-blocks", type=int, default=1, metavar="N",
+                        help="Spustit až N config bloků souběžně v samostatných procesech")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Kam zapsat JSON report běhu (jinak sync.report_dir/run_<čas>.json, je-li nastaven)")
     return parser.parse_args(argv)
 
 
@@ -545,11 +3278,34 @@ def main(argv=None):
 
     only = [s.strip() for s in args.only.split(",")] if args.only else None
 
-    all_ok = True
-    for block in blocks:
-        syncer = PohodaBigQuerySync(block)
-        ok = syncer.run(backfill=args.backfill, database=args.database, only=only)
-        all_ok = all_ok and ok
+    run_kwargs = {
+        "backfill": args.backfill, "database": args.database, "only": only, "force": args.force,
+        "resume": args.resume,
+    }
+
+    if args.rebuild_hash_index:
+        all_ok = all([PohodaBigQuerySync(block).rebuild_hash_indexes(only) for block in blocks])
+        sys.exit(0 if all_ok else 1)
+
+    started = datetime.now()
+    reports: List[dict] = []
+    if args.parallel_blocks > 1 and len(blocks) > 1:
+        all_ok = run_blocks_parallel(blocks, args.parallel_blocks, run_kwargs, reports)
+    else:
+        all_ok = True
+        for block in blocks:
+            syncer = PohodaBigQuerySync(block)
+            ok = syncer.run(**run_kwargs)
+            reports.append(syncer.report)
+            all_ok = all_ok and ok
+
+    report_path = run_report_path(blocks, started, args.report)
+    if report_path:
+        try:
+            write_run_report(report_path, reports, started, all_ok, argv)
+            logger.info(f"Report běhu: {report_path}")
+        except OSError as e:
+            logger.warning(f"Nepodařilo se zapsat report běhu: {e}")
 
     sys.exit(0 if all_ok else 1)
 
@@ -0,0 +1,540 @@
+"""
+Lokální stav synchronizace v SQLite (výchozí soubor sync_state.db).
+
+Drží to, co musí přežít mezi běhy z cronu a nedá se levně zjistit z BigQuery:
+- watermarks: nejvyšší hodnota sloupce změny (DatSave/DatCreate) skutečně
+  nahraná do BigQuery pro (blok, databáze, tabulka)
+- fingerprints: otisk (počet řádků, checksum, max. změna) dotazu nad historickou
+  databází z posledního úspěšného backfillu - nezměněné se příště přeskočí
+- row_hashes: index klíč -> hash řádku cílové tabulky pro detekci změn
+  (lze kdykoli znovu sestavit z BigQuery, viz --rebuild-hash-index)
+- runs / run_tables: historie běhů (jeden řádek na běh bloku a na každou
+  dvojici databáze × tabulka) - z ní čte check_status.py místo parsování logu;
+  starší běhy maže prune_history()
+- table_totals / stage_totals / run_totals: průběžné součty pro metriky
+  (čítače a histogramy fází), přičítají se při zápisu běhu, takže přežijí
+  promazání historie
+- checkpoints: postup rozpracovaného běhu pro --resume - hotové dvojice
+  databáze × tabulka a u dotazů s resume_key ponechaná temp tabulka a klíč
+  poslední nahrané dávky
+
+Každá operace si otevírá vlastní spojení, takže store lze bez zamykání
+používat z více vláken i procesů (--parallel-blocks).
+"""
+
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_STATE_FILE = "sync_state.db"
+
+# Max. počet parametrů v jednom IN (...) - pod limitem starších SQLite (999).
+_IN_CHUNK = 900
+
+# Hranice histogramu časů fází v sekundách (od rychlého create_temp po hodinový
+# backfill). stage_totals.buckets drží kumulativní počty k těmto hranicím.
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    block       TEXT NOT NULL,
+    database    TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (block, database, table_name)
+);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    block       TEXT NOT NULL,
+    database    TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    row_count   INTEGER NOT NULL,
+    checksum    INTEGER,
+    max_change  TEXT,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (block, database, table_name)
+);
+
+CREATE TABLE IF NOT EXISTS row_hashes (
+    block       TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    hash        INTEGER NOT NULL,
+    PRIMARY KEY (block, table_name, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    block        TEXT NOT NULL,
+    backfill     INTEGER NOT NULL DEFAULT 0,
+    started_at   TEXT NOT NULL,
+    finished_at  TEXT,
+    duration_s   REAL,
+    outcome      TEXT NOT NULL DEFAULT 'running',
+    error        TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_block_id ON runs (block, id);
+
+CREATE TABLE IF NOT EXISTS run_tables (
+    run_id          INTEGER NOT NULL REFERENCES runs (id),
+    block           TEXT NOT NULL,
+    database        TEXT NOT NULL,
+    table_name      TEXT NOT NULL,
+    mode            TEXT,
+    rows_extracted  INTEGER NOT NULL DEFAULT 0,
+    bytes_uploaded  INTEGER NOT NULL DEFAULT 0,
+    duration_s      REAL,
+    stages          TEXT,
+    watermark       TEXT,
+    outcome         TEXT NOT NULL,
+    error           TEXT,
+    finished_at     TEXT NOT NULL,
+    rows_inserted   INTEGER,
+    rows_updated    INTEGER,
+    peak_rss_bytes  INTEGER,
+    bytes_processed INTEGER
+);
+CREATE INDEX IF NOT EXISTS run_tables_run ON run_tables (run_id);
+
+-- last_key bez typu: SQLite si ponechá typ hodnoty (int zůstane int, text text)
+CREATE TABLE IF NOT EXISTS checkpoints (
+    block       TEXT NOT NULL,
+    backfill    INTEGER NOT NULL,
+    database    TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    temp_id     TEXT,
+    last_key,
+    rows        INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (block, backfill, database, table_name)
+);
+CREATE INDEX IF NOT EXISTS run_tables_last
+    ON run_tables (block, database, table_name, outcome, finished_at);
+
+CREATE TABLE IF NOT EXISTS table_totals (
+    block           TEXT NOT NULL,
+    database        TEXT NOT NULL,
+    table_name      TEXT NOT NULL,
+    rows_extracted  INTEGER NOT NULL DEFAULT 0,
+    bytes_uploaded  INTEGER NOT NULL DEFAULT 0,
+    bytes_processed INTEGER NOT NULL DEFAULT 0,
+    failures        INTEGER NOT NULL DEFAULT 0,
+    last_success    TEXT,
+    PRIMARY KEY (block, database, table_name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stage_totals (
+    block       TEXT NOT NULL,
+    database    TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    count       INTEGER NOT NULL,
+    sum         REAL NOT NULL,
+    buckets     TEXT NOT NULL,
+    PRIMARY KEY (block, database, table_name, stage)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS run_totals (
+    block         TEXT PRIMARY KEY,
+    runs          INTEGER NOT NULL DEFAULT 0,
+    failures      INTEGER NOT NULL DEFAULT 0,
+    last_success  TEXT
+);
+"""
+
+# Sloupce přidané do existujících tabulek po prvním vydání (stav ze starší
+# verze se při otevření doplní přes ALTER TABLE).
+MIGRATIONS = [
+    ("run_tables", "rows_inserted", "INTEGER"),
+    ("run_tables", "rows_updated", "INTEGER"),
+    ("run_tables", "peak_rss_bytes", "INTEGER"),
+    ("run_tables", "bytes_processed", "INTEGER"),
+]
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+class StateStore:
+    """Tenká vrstva nad SQLite souborem se stavem synchronizace."""
+
+    def __init__(self, path: str = DEFAULT_STATE_FILE):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            existing_tables = {
+                r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+            conn.executescript(SCHEMA)
+            for table, column, column_type in MIGRATIONS:
+                existing = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            if "runs" in existing_tables and "table_totals" not in existing_tables:
+                self._seed_totals(conn)
+
+    @staticmethod
+    def _seed_totals(conn):
+        """Stav ze starší verze: součty pro metriky jednou dopočítá z historie."""
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO table_totals
+            SELECT block, database, table_name, SUM(rows_extracted), SUM(bytes_uploaded),
+                   SUM(COALESCE(bytes_processed, 0)), SUM(outcome = 'failed'),
+                   MAX(CASE WHEN outcome = 'success' THEN finished_at END)
+            FROM run_tables GROUP BY block, database, table_name
+            """
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO run_totals
+            SELECT block, COUNT(*), SUM(outcome = 'failed'),
+                   MAX(CASE WHEN outcome = 'success' THEN finished_at END)
+            FROM runs WHERE outcome != 'running' GROUP BY block
+            """
+        )
+        # přepsáním celých řádků (ne přičtením) je dopočet idempotentní
+        stages_by_key: Dict[tuple, list] = {}
+        rows = conn.execute(
+            "SELECT block, database, table_name, stages FROM run_tables WHERE stages IS NOT NULL"
+        ).fetchall()
+        for block, database, table_name, stages in rows:
+            for stage, seconds in json.loads(stages).items():
+                stages_by_key.setdefault((block, database, table_name, stage), []).append(seconds)
+        conn.executemany(
+            "INSERT OR REPLACE INTO stage_totals VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(*key, len(values), float(sum(values)),
+              json.dumps([sum(v <= bound for v in values) for bound in STAGE_BUCKETS]))
+             for key, values in stages_by_key.items()],
+        )
+
+    @staticmethod
+    def _add_stage(conn, block: str, database: str, table_name: str, stage: str,
+                   seconds: float):
+        """Přičte jedno pozorování fáze do stage_totals (počet, součet, buckety)."""
+        row = conn.execute(
+            "SELECT count, sum, buckets FROM stage_totals "
+            "WHERE block = ? AND database = ? AND table_name = ? AND stage = ?",
+            (block, database, table_name, stage),
+        ).fetchone()
+        count, total, buckets = (
+            (row[0], row[1], json.loads(row[2])) if row else (0, 0.0, [0] * len(STAGE_BUCKETS))
+        )
+        buckets = [n + (seconds <= bound) for n, bound in zip(buckets, STAGE_BUCKETS)]
+        conn.execute(
+            "INSERT OR REPLACE INTO stage_totals VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (block, database, table_name, stage, count + 1, total + seconds, json.dumps(buckets)),
+        )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # --- watermarks --------------------------------------------------------
+
+    def get_watermark(self, block: str, database: str, table_name: str) -> Optional[datetime]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM watermarks WHERE block = ? AND database = ? AND table_name = ?",
+                (block, database, table_name),
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def set_watermark(self, block: str, database: str, table_name: str, value: datetime):
+        """Uloží watermark; existující hodnotu jen posune dopředu, nikdy zpět."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO watermarks (block, database, table_name, value, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (block, database, table_name) DO UPDATE SET
+                    value = MAX(value, excluded.value),
+                    updated_at = excluded.updated_at
+                """,
+                (block, database, table_name, _iso(value), _iso(datetime.now())),
+            )
+
+    # --- fingerprints -------------------------------------------------------
+
+    def get_fingerprint(self, block: str, database: str, table_name: str) -> Optional[tuple]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT row_count, checksum, max_change FROM fingerprints "
+                "WHERE block = ? AND database = ? AND table_name = ?",
+                (block, database, table_name),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def set_fingerprint(self, block: str, database: str, table_name: str, fingerprint: tuple):
+        row_count, checksum, max_change = fingerprint
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fingerprints "
+                "(block, database, table_name, row_count, checksum, max_change, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (block, database, table_name, row_count, checksum, max_change,
+                 _iso(datetime.now())),
+            )
+
+    # --- row_hashes ---------------------------------------------------------
+
+    def get_row_hashes(self, block: str, table_name: str, keys: List[str]) -> Dict[str, int]:
+        result: Dict[str, int] = {}
+        unique = list({k for k in keys if k is not None})
+        with self._connect() as conn:
+            for i in range(0, len(unique), _IN_CHUNK):
+                chunk = unique[i:i + _IN_CHUNK]
+                result.update(conn.execute(
+                    f"SELECT key, hash FROM row_hashes WHERE block = ? AND table_name = ? "
+                    f"AND key IN ({', '.join('?' * len(chunk))})",
+                    (block, table_name, *chunk),
+                ).fetchall())
+        return result
+
+    def put_row_hashes(self, block: str, table_name: str, items: Iterable[Tuple[str, int]]):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO row_hashes (block, table_name, key, hash) VALUES (?, ?, ?, ?)",
+                ((block, table_name, k, h) for k, h in items),
+            )
+
+    def clear_row_hashes(self, block: str, table_name: str):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM row_hashes WHERE block = ? AND table_name = ?", (block, table_name)
+            )
+
+    # --- historie běhů -----------------------------------------------------
+
+    def start_run(self, block: str, backfill: bool = False) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO runs (block, backfill, started_at) VALUES (?, ?, ?)",
+                (block, int(backfill), _iso(datetime.now())),
+            )
+            return cur.lastrowid
+
+    def finish_run(self, run_id: int, success: bool, error: Optional[str] = None):
+        now = datetime.now()
+        with self._connect() as conn:
+            block, started = conn.execute(
+                "SELECT block, started_at FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            conn.execute(
+                "UPDATE runs SET finished_at = ?, duration_s = ?, outcome = ?, error = ? "
+                "WHERE id = ?",
+                (
+                    _iso(now),
+                    (now - datetime.fromisoformat(started)).total_seconds(),
+                    "success" if success else "failed",
+                    error,
+                    run_id,
+                ),
+            )
+            conn.execute(
+                """
+                INSERT INTO run_totals (block, runs, failures, last_success) VALUES (?, 1, ?, ?)
+                ON CONFLICT (block) DO UPDATE SET
+                    runs = runs + 1,
+                    failures = failures + excluded.failures,
+                    last_success = COALESCE(excluded.last_success, last_success)
+                """,
+                (block, int(not success), _iso(now) if success else None),
+            )
+
+    def record_table(self, run_id: int, block: str, database: str, table_name: str, *,
+                     mode: str, rows: int, bytes_uploaded: int, duration_s: float,
+                     stages: Dict[str, float], watermark: Optional[datetime],
+                     success: bool, error: Optional[str] = None, skipped: bool = False,
+                     dml: Optional[Dict[str, int]] = None, peak_rss: Optional[int] = None,
+                     bytes_processed: Optional[int] = None):
+        dml = dml or {}
+        outcome = "skipped" if skipped else "success" if success else "failed"
+        finished_at = _iso(datetime.now())
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO run_tables (
+                    run_id, block, database, table_name, mode, rows_extracted,
+                    bytes_uploaded, duration_s, stages, watermark, outcome, error, finished_at,
+                    rows_inserted, rows_updated, peak_rss_bytes, bytes_processed
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    run_id, block, database, table_name, mode, rows, bytes_uploaded,
+                    duration_s, json.dumps(stages), _iso(watermark) if watermark else None,
+                    outcome, error, finished_at, dml.get("inserted"), dml.get("updated"),
+                    peak_rss, bytes_processed,
+                ),
+            )
+            # součty pro metriky - ve stejné transakci (zámek drží už INSERT výše)
+            conn.execute(
+                """
+                INSERT INTO table_totals (
+                    block, database, table_name, rows_extracted, bytes_uploaded,
+                    bytes_processed, failures, last_success
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (block, database, table_name) DO UPDATE SET
+                    rows_extracted = rows_extracted + excluded.rows_extracted,
+                    bytes_uploaded = bytes_uploaded + excluded.bytes_uploaded,
+                    bytes_processed = bytes_processed + excluded.bytes_processed,
+                    failures = failures + excluded.failures,
+                    last_success = COALESCE(excluded.last_success, last_success)
+                """,
+                (block, database, table_name, rows, bytes_uploaded, bytes_processed or 0,
+                 int(outcome == "failed"), finished_at if outcome == "success" else None),
+            )
+            for stage, seconds in stages.items():
+                self._add_stage(conn, block, database, table_name, stage, float(seconds))
+
+    def prune_history(self, block: str, before: datetime) -> int:
+        """Smaže dokončené běhy bloku začaté před `before` i jejich run_tables.
+
+        Součty pro metriky (table_totals, ...) zůstávají. Vrací počet smazaných běhů.
+        """
+        with self._connect() as conn:
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM runs WHERE block = ? AND started_at < ? AND outcome != 'running'",
+                (block, _iso(before)),
+            )]
+            for i in range(0, len(ids), _IN_CHUNK):
+                chunk = ids[i:i + _IN_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM run_tables WHERE run_id IN ({marks})", chunk)
+                conn.execute(f"DELETE FROM runs WHERE id IN ({marks})", chunk)
+        return len(ids)
+
+    # --- checkpointy (--resume) ----------------------------------------------
+
+    def get_checkpoint(self, block: str, backfill: bool, database: str,
+                       table_name: str) -> Optional[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                "SELECT * FROM checkpoints "
+                "WHERE block = ? AND backfill = ? AND database = ? AND table_name = ?",
+                (block, int(backfill), database, table_name),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def set_checkpoint(self, block: str, backfill: bool, database: str, table_name: str,
+                       status: str, temp_id: Optional[str] = None, last_key=None, rows: int = 0):
+        """status: 'partial' (část nahraná v temp_id do last_key) nebo 'done'."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(block, backfill, database, table_name, status, temp_id, last_key, rows, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (block, int(backfill), database, table_name, status, temp_id, last_key, rows,
+                 _iso(datetime.now())),
+            )
+
+    def checkpoints(self, block: str, backfill: Optional[bool] = None) -> List[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM checkpoints WHERE block = ? AND (? IS NULL OR backfill = ?) "
+                "ORDER BY database, table_name",
+                (block, None if backfill is None else int(backfill),
+                 None if backfill is None else int(backfill)),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def clear_checkpoints(self, block: str, backfill: bool,
+                          pairs: Optional[List[Tuple[str, str]]] = None):
+        """Smaže checkpointy bloku - všechny, nebo jen dvojice (databáze, tabulka)."""
+        with self._connect() as conn:
+            if pairs is None:
+                conn.execute(
+                    "DELETE FROM checkpoints WHERE block = ? AND backfill = ?",
+                    (block, int(backfill)),
+                )
+                return
+            conn.executemany(
+                "DELETE FROM checkpoints "
+                "WHERE block = ? AND backfill = ? AND database = ? AND table_name = ?",
+                [(block, int(backfill), database, table) for database, table in pairs],
+            )
+
+    # --- dotazy pro check_status ---------------------------------------------
+
+    def blocks(self) -> List[str]:
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT block FROM runs ORDER BY block")]
+
+    def last_runs(self, block: str, limit: int = 1) -> List[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM runs WHERE block = ? ORDER BY id DESC LIMIT ?", (block, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def run_tables(self, run_id: int) -> List[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM run_tables WHERE run_id = ? ORDER BY rowid", (run_id,)
+            ).fetchall()
+        result = []
+        for r in rows:
+            item = dict(r)
+            item["stages"] = json.loads(item["stages"]) if item["stages"] else {}
+            result.append(item)
+        return result
+
+    def last_success_per_table(self, block: str) -> List[dict]:
+        """Z table_totals - nezávislé na promazané historii běhů."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                """
+                SELECT database, table_name, last_success AS finished_at
+                FROM table_totals
+                WHERE block = ? AND last_success IS NOT NULL
+                ORDER BY database, table_name
+                """,
+                (block,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    # --- souhrny pro metriky (sync_metrics) ------------------------------------
+
+    def table_totals(self, block: str) -> List[dict]:
+        """Průběžné součty na (databáze, tabulka) - podklad pro čítače."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM table_totals WHERE block = ? ORDER BY database, table_name",
+                (block,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def stage_totals(self, block: str) -> List[dict]:
+        """Histogramy fází na (databáze, tabulka, fáze): count, sum, buckets (k STAGE_BUCKETS)."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM stage_totals WHERE block = ? ORDER BY database, table_name, stage",
+                (block,),
+            ).fetchall()
+        return [{**dict(r), "buckets": json.loads(r["buckets"])} for r in rows]
+
+    def run_totals(self, block: str) -> dict:
+        """Počet dokončených běhů, neúspěšných běhů a čas posledního úspěšného běhu bloku."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT runs, failures, last_success FROM run_totals WHERE block = ?", (block,)
+            ).fetchone()
+        runs, failures, last_success = row or (0, 0, None)
+        return {"runs": runs, "failures": failures, "last_success": last_success}
@@ -0,0 +1,110 @@
+"""Unit testy pro sync_metrics (textfile pro node_exporter)."""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import sync_metrics
+import sync_state
+
+
+def record(store, run_id, table, success=True, stages=None, rows=10):
+    store.record_table(
+        run_id, "a", "pohoda_2025", table, mode="incremental", rows=rows, bytes_uploaded=100,
+        duration_s=2.0, stages=stages or {}, watermark=None, success=success,
+        error=None if success else "chyba", bytes_processed=5000,
+    )
+
+
+def samples(text: str) -> dict:
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            result[name] = float(value)
+    return result
+
+
+def test_render_metrics_counters_from_history(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    first = store.start_run("a")
+    record(store, first, "FA", stages={"fetch": 0.3, "upload": 45.0})
+    store.finish_run(first, True)
+    second = store.start_run("a")
+    record(store, second, "FA", success=False, stages={"fetch": 2.0})
+    record(store, second, "PH", rows=7)
+    store.finish_run(second, False, "chyba")
+
+    text = sync_metrics.render_metrics(store, "a")
+    m = samples(text)
+    fa = 'block="a",database="pohoda_2025",table="FA"'
+    assert m[f"pohoda_sync_rows_total{{{fa}}}"] == 20
+    assert m[f"pohoda_sync_uploaded_bytes_total{{{fa}}}"] == 200
+    assert m[f"pohoda_sync_finalize_processed_bytes_total{{{fa}}}"] == 10000
+    assert m[f"pohoda_sync_table_failures_total{{{fa}}}"] == 1
+    assert f"pohoda_sync_table_last_success_timestamp_seconds{{{fa}}}" in m
+    assert m['pohoda_sync_runs_total{block="a"}'] == 2
+    assert m['pohoda_sync_run_failures_total{block="a"}'] == 1
+
+    fetch = f'{fa},stage="fetch"'
+    assert m[f'pohoda_sync_stage_duration_seconds_bucket{{{fetch},le="0.5"}}'] == 1
+    assert m[f'pohoda_sync_stage_duration_seconds_bucket{{{fetch},le="5"}}'] == 2
+    assert m[f'pohoda_sync_stage_duration_seconds_bucket{{{fetch},le="+Inf"}}'] == 2
+    assert m[f"pohoda_sync_stage_duration_seconds_sum{{{fetch}}}"] == 2.3
+    assert "# TYPE pohoda_sync_stage_duration_seconds histogram" in text
+    assert "pohoda_sync_last_run_success" not in text
+
+
+def _history(store):
+    first = store.start_run("a")
+    record(store, first, "FA", stages={"fetch": 0.3, "upload": 45.0})
+    store.finish_run(first, True)
+    second = store.start_run("a")
+    record(store, second, "FA", success=False, stages={"fetch": 2.0})
+    store.finish_run(second, False, "chyba")
+
+
+def test_render_metrics_unchanged_after_history_pruned(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    _history(store)
+    before = sync_metrics.render_metrics(store, "a")
+    assert store.prune_history("a", datetime.now() + timedelta(days=1)) == 2
+    assert store.last_runs("a") == []
+    assert sync_metrics.render_metrics(store, "a") == before
+    assert [t["table_name"] for t in store.last_success_per_table("a")] == ["FA"]
+
+
+def test_totals_seeded_once_from_older_state(tmp_path):
+    path = tmp_path / "state.db"
+    store = sync_state.StateStore(path)
+    _history(store)
+    expected = sync_metrics.render_metrics(store, "a")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "DROP TABLE table_totals; DROP TABLE stage_totals; DROP TABLE run_totals;"
+    )
+    conn.close()
+
+    sync_state.StateStore(path)
+    sync_state.StateStore(path)  # podruhé už nic nepřičte
+    assert sync_metrics.render_metrics(sync_state.StateStore(path), "a") == expected
+
+
+def test_render_metrics_last_run_and_label_escaping(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    report = {
+        "finished_at": datetime(2025, 3, 1, 2, 0).isoformat(), "outcome": "failed",
+        "duration_s": 12.5,
+        "tables": [{"database": 'po"hoda', "table": "FA", "rows_extracted": 3, "duration_s": 1.5}],
+    }
+    m = samples(sync_metrics.render_metrics(store, "a", report))
+    assert m['pohoda_sync_last_run_success{block="a"}'] == 0
+    assert m['pohoda_sync_last_run_duration_seconds{block="a"}'] == 12.5
+    assert m['pohoda_sync_last_run_rows{block="a",database="po\\"hoda",table="FA"}'] == 3
+
+
+def test_write_textfile_replaces_atomically(tmp_path):
+    path = tmp_path / "textfile" / "pohoda_a.prom"
+    sync_metrics.write_textfile(str(path), "x 1\n")
+    sync_metrics.write_textfile(str(path), "x 2\n")
+    assert path.read_text(encoding="utf-8") == "x 2\n"
+    assert list(path.parent.iterdir()) == [path]
@@ -0,0 +1,113 @@
+"""Unit testy pro sync_state (lokální SQLite stav)."""
+
+from datetime import datetime
+
+import sync_state
+
+
+def test_watermark_missing_is_none(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    assert store.get_watermark("a", "pohoda_2025", "FA") is None
+
+
+def test_watermark_roundtrip_and_only_moves_forward(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    store.set_watermark("a", "pohoda_2025", "FA", datetime(2025, 3, 1, 10, 0, 0, 500))
+    assert store.get_watermark("a", "pohoda_2025", "FA") == datetime(2025, 3, 1, 10, 0, 0, 500)
+
+    store.set_watermark("a", "pohoda_2025", "FA", datetime(2025, 2, 1))
+    assert store.get_watermark("a", "pohoda_2025", "FA") == datetime(2025, 3, 1, 10, 0, 0, 500)
+
+    store.set_watermark("a", "pohoda_2025", "FA", datetime(2025, 3, 2))
+    assert store.get_watermark("a", "pohoda_2025", "FA") == datetime(2025, 3, 2)
+
+
+def test_watermark_keyed_by_block_database_table(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    store.set_watermark("a", "pohoda_2025", "FA", datetime(2025, 1, 1))
+    assert store.get_watermark("b", "pohoda_2025", "FA") is None
+    assert store.get_watermark("a", "pohoda_2024", "FA") is None
+    assert store.get_watermark("a", "pohoda_2025", "PH") is None
+
+
+def test_run_history_roundtrip(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    run_id = store.start_run("a", backfill=True)
+    store.record_table(
+        run_id, "a", "pohoda_2025", "FA", mode="incremental", rows=120, bytes_uploaded=4096,
+        duration_s=3.5, stages={"execute": 1.0, "stream": 2.0, "finalize": 0.5},
+        watermark=datetime(2025, 3, 1), success=True,
+    )
+    store.record_table(
+        run_id, "a", "pohoda_2025", "PH", mode="incremental", rows=0, bytes_uploaded=0,
+        duration_s=0.2, stages={}, watermark=None, success=False, error="timeout",
+    )
+    store.finish_run(run_id, success=False, error="timeout")
+
+    last = store.last_runs("a")[0]
+    assert last["id"] == run_id and last["outcome"] == "failed" and last["backfill"] == 1
+    assert last["duration_s"] >= 0
+
+    tables = store.run_tables(run_id)
+    assert [t["table_name"] for t in tables] == ["FA", "PH"]
+    assert tables[0]["stages"]["stream"] == 2.0
+    assert tables[1]["error"] == "timeout"
+
+    assert [(t["database"], t["table_name"]) for t in store.last_success_per_table("a")] == [
+        ("pohoda_2025", "FA")
+    ]
+    assert store.blocks() == ["a"]
+
+
+def test_last_runs_newest_first(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    ids = [store.start_run("a") for _ in range(3)]
+    assert [r["id"] for r in store.last_runs("a", 2)] == ids[:0:-1]
+
+
+def test_migration_adds_new_columns_to_old_state(tmp_path):
+    import sqlite3
+    path = tmp_path / "state.db"
+    conn = sqlite3.connect(path)
+    old_schema = sync_state.SCHEMA.replace(
+        ",\n    rows_inserted   INTEGER,\n    rows_updated    INTEGER,\n    peak_rss_bytes  INTEGER,"
+        "\n    bytes_processed INTEGER", ""
+    )
+    assert old_schema != sync_state.SCHEMA
+    conn.executescript(old_schema)
+    conn.close()
+
+    store = sync_state.StateStore(path)
+    run_id = store.start_run("a")
+    store.record_table(
+        run_id, "a", "pohoda_2025", "FA", mode="incremental", rows=3, bytes_uploaded=0,
+        duration_s=1.0, stages={}, watermark=None, success=True,
+        dml={"inserted": 1, "updated": 2, "deleted": 0}, peak_rss=512 * 1024 * 1024,
+        bytes_processed=2048,
+    )
+    [t] = store.run_tables(run_id)
+    assert (t["rows_inserted"], t["rows_updated"]) == (1, 2)
+    assert t["peak_rss_bytes"] == 512 * 1024 * 1024 and t["bytes_processed"] == 2048
+
+
+def test_checkpoints_roundtrip_keyed_by_backfill(tmp_path):
+    store = sync_state.StateStore(tmp_path / "state.db")
+    store.set_checkpoint("a", True, "pohoda_2023", "FA", "partial", "p.d.FA_temp", 1200, 5000)
+    store.set_checkpoint("a", True, "pohoda_2023", "PH", "done")
+    cp = store.get_checkpoint("a", True, "pohoda_2023", "FA")
+    assert (cp["status"], cp["temp_id"], cp["last_key"], cp["rows"]) == (
+        "partial", "p.d.FA_temp", 1200, 5000
+    )
+    assert store.get_checkpoint("a", False, "pohoda_2023", "FA") is None
+
+    # textový klíč zůstane textem
+    store.set_checkpoint("a", True, "pohoda_2023", "FA", "partial", "p.d.FA_temp", "FA-0099", 99)
+    assert store.get_checkpoint("a", True, "pohoda_2023", "FA")["last_key"] == "FA-0099"
+
+    assert [c["table_name"] for c in store.checkpoints("a", True)] == ["FA", "PH"]
+    store.clear_checkpoints("a", False)
+    assert len(store.checkpoints("a")) == 2
+    store.clear_checkpoints("a", True, [("pohoda_2023", "PH"), ("pohoda_2025", "PH")])
+    assert [c["table_name"] for c in store.checkpoints("a")] == ["FA"]
+    store.clear_checkpoints("a", True)
+    assert store.checkpoints("a") == []
@@ -1,10 +1,18 @@
 """Unit testy pro sync_pohoda_to_bigquery (bez živých připojení)."""
 
 import decimal
+import sys
 import json
+import os
+import re
+import threading
+import time
 import uuid
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 import sync_pohoda_to_bigquery as s
@@ -27,6 +35,79 @@ def test_load_config_single_object_wrapped(tmp_path):
     assert blocks[0]["name"] == "solo"
 
 
+# --- CLI / logování bloků -------------------------------------------------
+
+def test_parse_args_parallel_blocks():
+    assert s.parse_args([]).parallel_blocks == 1
+    assert s.parse_args(["--parallel-blocks", "3"]).parallel_blocks == 3
+
+
+def test_block_log_filter_prefixes_only_foreign_messages():
+    import logging
+
+    f = s.BlockLogFilter("firmaA")
+    own = logging.LogRecord("x", logging.INFO, "", 0, "[firmaA] START %s", ("ok",), None)
+    foreign = logging.LogRecord("x", logging.INFO, "", 0, "retry %d", (2,), None)
+    f.filter(own)
+    f.filter(foreign)
+    assert own.getMessage() == "[firmaA] START ok"
+    assert foreign.getMessage() == "[firmaA] retry 2"
+
+
+class FakeBlockSync:
+    """Blok pro run_blocks_parallel: chování podle názvu (ok*, fail, raise, crash)."""
+
+    def __init__(self, config):
+        self.name = config["name"]
+        self.report = {"block": self.name, "outcome": None, "tables": []}
+
+    def run(self, **kwargs):
+        if self.name == "crash":
+            os._exit(3)  # tvrdý pád (např. v ODBC driveru) - bez reportu
+        if self.name == "raise":
+            raise RuntimeError("neošetřená chyba bloku")
+        ok = self.name.startswith("ok")
+        self.report.update(outcome="success" if ok else "failed", kwargs=kwargs)
+        return ok
+
+
+@pytest.fixture
+def fork_blocks(monkeypatch):
+    # spawn by v dětském procesu neměl fake moduly z conftest ani FakeBlockSync
+    monkeypatch.setattr(s, "BLOCK_START_METHOD", "fork")
+    monkeypatch.setattr(s, "PohodaBigQuerySync", FakeBlockSync)
+
+
+def test_run_blocks_parallel_isolates_failing_blocks(fork_blocks):
+    names = ["crash", "ok1", "fail", "raise", "ok2"]
+    reports = []
+    ok = s.run_blocks_parallel([{"name": n} for n in names], 2, {"backfill": True}, reports)
+    assert ok is False  # souhrnný exit kód 1
+    by_name = {r["block"]: r for r in reports}
+    assert sorted(by_name) == sorted(names)
+    for name in ("ok1", "ok2"):
+        assert by_name[name]["outcome"] == "success"
+        assert by_name[name]["kwargs"] == {"backfill": True}
+    assert by_name["fail"]["outcome"] == "failed" and "error" not in by_name["fail"]
+    assert by_name["crash"]["error"] == "proces skončil s kódem 3"
+    assert by_name["raise"]["error"] == "proces skončil s kódem 1"
+
+
+def test_run_blocks_parallel_all_ok(fork_blocks):
+    reports = []
+    assert s.run_blocks_parallel([{"name": "ok1"}, {"name": "ok2"}], 4, {}, reports)
+    assert [r["outcome"] for r in reports] == ["success", "success"]
+
+
+def test_read_block_report_falls_back_without_valid_report(tmp_path):
+    broken = tmp_path / "0.json"
+    broken.write_text('{"block": "a", "tab', encoding="utf-8")
+    for path in (broken, tmp_path / "missing.json"):
+        assert s._read_block_report(str(path), "a", -9) == {
+            "block": "a", "outcome": "failed", "error": "proces skončil s kódem -9", "tables": [],
+        }
+
+
 # --- dedupe_columns -------------------------------------------------------
 
 def test_dedupe_columns():
@@ -51,6 +132,132 @@ def test_prepare_sql_no_placeholder_is_noop_window():
     assert "JOIN [SRV].[db].dbo.sSklad" in out
 
 
+def test_prepare_sql_watermark_fallback_to_days_back():
+    sql = "SELECT * FROM FA h WHERE COALESCE(h.DatSave, h.DatCreate) >= <WATERMARK>"
+    out = s.prepare_sql(sql, "SRV", "db", 7)
+    assert out.endswith(">= (GETDATE() - 7)")
+
+
+def test_prepare_sql_watermark_literal():
+    sql = "SELECT * FROM FA h WHERE COALESCE(h.DatSave, h.DatCreate) >= <WATERMARK>"
+    out = s.prepare_sql(sql, "SRV", "db", 7, datetime(2025, 3, 1, 9, 15, 30, 250000))
+    assert out.endswith(">= CAST('2025-03-01T09:15:30.250' AS DATETIME2)")
+    assert "<WATERMARK>" not in out
+
+
+@pytest.mark.parametrize("sql_file", sorted(Path(__file__).resolve().parent.parent.glob("*.sql")))
+@pytest.mark.parametrize("watermark", [None, datetime(2025, 3, 1, 9, 15, 30, 250999)])
+def test_compile_sql_renders_same_as_prepare_sql(sql_file, watermark):
+    sql = sql_file.read_text(encoding="utf-8") + "\nAND y >= <WATERMARK>"
+    compiled = s.compile_sql(sql, "SRV", "pohoda_2025", watermark is not None)
+    assert "<DAYS_BACK>" not in compiled.text and "<WATERMARK>" not in compiled.text
+    rendered = s.render_sql(compiled, compiled.params(14, watermark))
+    assert rendered == s.prepare_sql(sql, "SRV", "pohoda_2025", 14, watermark)
+
+
+def test_compile_sql_text_independent_of_window_and_cached():
+    sql = "SELECT * FROM FA h WHERE h.Datum >= GETDATE() - <DAYS_BACK> AND h.DatSave >= <WATERMARK>"
+    compiled = s.compile_sql(sql, "SRV", "db", True)
+    assert compiled.text == (
+        "SELECT * FROM [SRV].[db].dbo.FA h WHERE h.Datum >= GETDATE() - ? "
+        "AND h.DatSave >= CAST(? AS DATETIME2)"
+    )
+    assert compiled.params(7, datetime(2025, 1, 1)) == [7, datetime(2025, 1, 1)]
+    assert s.compile_sql(sql, "SRV", "db", True) is compiled
+    assert s.compile_sql(sql, "SRV", "db", False).params(30) == [30, 30]
+
+
+def test_compile_sql_openquery_and_direct_use_remote_names():
+    sql = "SELECT * FROM FA h LEFT JOIN AD ad ON ad.ID = h.RefAD WHERE h.Datum >= GETDATE() - <DAYS_BACK>"
+    for strategy in ("openquery", "direct"):
+        compiled = s.compile_sql(sql, "SRV", "db", False, strategy)
+        assert "FROM [db].dbo.FA h LEFT JOIN [db].dbo.AD ad" in compiled.text
+        assert "[SRV]" not in compiled.text
+
+
+def test_build_statement_openquery_inlines_and_wraps():
+    sql = "SELECT * FROM FA h WHERE h.Kod <> 'X' AND h.DatSave >= <WATERMARK>"
+    compiled = s.compile_sql(sql, "SRV", "db", True, "openquery")
+    params = compiled.params(7, datetime(2025, 3, 1))
+    text, out_params = s.build_statement(compiled, params, "openquery", "SRV")
+    assert out_params == []
+    assert text == (
+        "SELECT * FROM OPENQUERY([SRV], 'SELECT * FROM [db].dbo.FA h WHERE h.Kod <> ''X'' "
+        "AND h.DatSave >= CAST(''2025-03-01T00:00:00.000'' AS DATETIME2)')"
+    )
+
+    fp, _ = s.build_statement(compiled, params, "openquery", "SRV", wrap=s.fingerprint_sql)
+    assert fp.startswith("SELECT * FROM OPENQUERY([SRV], 'SELECT COUNT_BIG(*)")
+
+    text, out_params = s.build_statement(compiled, params, "linked")
+    assert (text, out_params) == (compiled.text, params)
+
+
+def test_inline_params_ignores_question_marks_in_literals_and_comments():
+    sql = (
+        "SELECT CASE WHEN h.Kc < 0 THEN '?' ELSE [Kód?] END -- proč?\n"
+        "FROM FA h /* ? */ WHERE h.Datum >= GETDATE() - ? AND h.Kod <> 'a?b'"
+    )
+    assert s.inline_params(sql, [7]) == sql.replace("- ?", "- 7")
+    with pytest.raises(ValueError, match="1 parametrů, předáno 2"):
+        s.inline_params(sql, [7, 8])
+
+
+def test_openquery_sql_length_limit():
+    with pytest.raises(ValueError, match="limit"):
+        s.openquery_sql("SRV", "SELECT 1 " + "x" * 8000)
+
+
+def test_fingerprint_sql_wraps_query():
+    sql = "SELECT a FROM X\n-- AND x IS NOT NULL\n;\n"
+    out = s.fingerprint_sql(sql, "DatZmena")
+    assert out.startswith("SELECT COUNT_BIG(*) AS row_count, CHECKSUM_AGG(BINARY_CHECKSUM(*))")
+    assert "MAX(q.[DatZmena]) AS max_change" in out
+    assert out.endswith("SELECT a FROM X\n-- AND x IS NOT NULL\n) q")
+    assert "NULL AS max_change" in s.fingerprint_sql(sql)
+
+
+@pytest.mark.parametrize("sql, problem", [
+    ("SELECT a FROM X ORDER BY a;", "ORDER BY bez TOP"),
+    ("WITH c AS (SELECT a FROM X) SELECT a FROM c", "CTE"),
+    ("-- úvod\n  with c AS (SELECT 1 a) SELECT a FROM c", "CTE"),
+    ("SELECT TOP 10 a FROM X ORDER BY a", None),
+    ("SELECT a FROM X ORDER BY a OFFSET 0 ROWS", None),
+    ("SELECT a, ROW_NUMBER() OVER (ORDER BY a) r FROM X", None),
+    ("SELECT a FROM X WHERE t = 'ORDER BY' -- ORDER BY a\n", None),
+    ("SELECT [order by] FROM X /* WITH */", None),
+])
+def test_derived_table_problem(sql, problem):
+    found = s.derived_table_problem(sql)
+    assert (found is None) if problem is None else (problem in found)
+    if problem:
+        with pytest.raises(ValueError, match=problem):
+            s.fingerprint_sql(sql)
+        with pytest.raises(ValueError, match=problem):
+            s.resume_sql(sql, "a")
+
+
+def test_sql_files_can_be_wrapped_as_derived_table():
+    from pathlib import Path
+
+    for path in Path(__file__).parent.parent.glob("*.sql"):
+        assert s.derived_table_problem(path.read_text(encoding="utf-8")) is None, path.name
+
+
+def test_sql_files_have_unique_column_names():
+    # fingerprint_sql obaluje dotaz jako odvozenou tabulku - názvy musí být unikátní
+    import re
+    from pathlib import Path
+
+    for path in Path(__file__).parent.parent.glob("*.sql"):
+        select = path.read_text(encoding="utf-8").split("FROM ")[0]
+        names = []
+        for item in re.split(r"\n\s*,", select):
+            item = item.strip().rstrip(",")
+            names.append(re.split(r"[\s.]", item)[-1].strip("[]").lower())
+        assert len(names) == len(set(names)), path.name
+
+
 # --- build_bq_schema ------------------------------------------------------
 
 def test_build_bq_schema_types():
@@ -102,6 +309,122 @@ def test_prepare_dataframe_duplicate_columns():
     assert list(out.columns) == ["RefZeme", "RefZeme_1"]
 
 
+# --- rows_to_arrow ----------------------------------------------------------
+
+def test_rows_to_arrow_types_and_nulls():
+    g = uuid.uuid4()
+    rows = [
+        ("FA-1", g.bytes_le, decimal.Decimal("2.5"), "3.0", date(2025, 1, 15),
+         decimal.Decimal("10"), datetime(2025, 1, 15, 8, 30, 5, 120)),
+        (None, None, None, None, None, None, None),
+    ]
+    schema = s.build_bq_schema(["ID", "GUID", "Mnozstvi", "Kc", "Datum", "Text", "DatSave"])
+    out = s.rows_to_arrow(rows, schema).to_pydict()
+
+    assert out["ID"] == ["FA-1", None]
+    assert out["GUID"] == [str(g), None]
+    assert out["Mnozstvi"] == [2.5, None]
+    assert out["Kc"] == [3.0, None]
+    assert out["Datum"] == [datetime(2025, 1, 15), None]
+    assert out["Text"] == ["10", None]
+    assert out["DatSave"] == ["2025-01-15 08:30:05", None]
+
+
+def test_rows_to_arrow_matches_prepare_dataframe():
+    rows = [
+        (decimal.Decimal("1.50"), 7, "x", date(2024, 12, 31), decimal.Decimal("0.125")),
+        (decimal.Decimal("-3"), 8, None, None, None),
+        (None, 12, "ž", date(2025, 2, 1), decimal.Decimal("4")),
+    ]
+    columns = ["Kc", "RefCin", "SText", "Datum", "Mnozstvi"]
+    schema = s.build_bq_schema(columns)
+
+    expected = s.prepare_dataframe(pd.DataFrame.from_records(rows, columns=columns))
+    got = s.rows_to_arrow(rows, schema).to_pandas()
+
+    for col in columns:
+        exp = [None if pd.isna(v) else v for v in expected[col]]
+        act = [None if pd.isna(v) else v for v in got[col]]
+        assert exp == act, col
+
+
+def test_rows_to_arrow_int_with_nulls_stays_integer_text():
+    # pandas by sloupec s NULL povýšil na float ("7.0"); Arrow drží "7"
+    schema = s.build_bq_schema(["RefCin"])
+    out = s.rows_to_arrow([(7,), (None,)], schema).to_pydict()
+    assert out["RefCin"] == ["7", None]
+
+
+def test_infer_bq_schema_from_description():
+    description = [
+        ("ID", str, None, 40, 40, 0, True),
+        ("RefCin", int, None, 10, 10, 0, True),
+        ("RelStorn", bool, None, 1, 1, 0, True),
+        ("Kc", decimal.Decimal, None, 19, 19, 2, True),
+        ("Kurz", decimal.Decimal, None, 38, 38, 12, True),
+        ("Datum", date, None, 10, 10, 0, True),
+        ("DatSave", datetime, None, 23, 23, 3, True),
+        ("Podil", float, None, 53, 53, 0, True),
+        ("GUID", bytes, None, 16, 16, 0, True),
+    ]
+    schema = s.infer_bq_schema(
+        description, [d[0] for d in description], {"RefCin": "INTEGER", "Podil": "NUMERIC"}
+    )
+    assert {f.name: f.field_type for f in schema} == {
+        "ID": "STRING", "RefCin": "INT64", "RelStorn": "BOOL", "Kc": "NUMERIC",
+        "Kurz": "BIGNUMERIC", "Datum": "DATE", "DatSave": "DATETIME", "Podil": "NUMERIC",
+        "GUID": "STRING",
+    }
+
+
+def test_rows_to_arrow_inferred_types():
+    schema = [
+        s.bigquery.SchemaField(name, t)
+        for name, t in [("RefCin", "INT64"), ("RelStorn", "BOOL"), ("Kc", "NUMERIC"),
+                        ("Kurz", "BIGNUMERIC"), ("Datum", "DATE"), ("DatSave", "DATETIME")]
+    ]
+    rows = [
+        (7, True, decimal.Decimal("12.50"), decimal.Decimal("1.000000000001"),
+         datetime(2025, 1, 2, 3, 4), datetime(2025, 1, 2, 3, 4, 5)),
+        (None, None, None, None, None, None),
+    ]
+    table = s.rows_to_arrow(rows, schema)
+    assert table.schema.types == [
+        pa.int64(), pa.bool_(), pa.decimal128(38, 9), pa.decimal256(76, 38),
+        pa.date32(), pa.timestamp("us"),
+    ]
+    assert table.to_pylist()[0] == {
+        "RefCin": 7, "RelStorn": True, "Kc": decimal.Decimal("12.500000000"),
+        "Kurz": decimal.Decimal("1.00000000000100000000000000000000000000"),
+        "Datum": date(2025, 1, 2), "DatSave": datetime(2025, 1, 2, 3, 4, 5),
+    }
+    assert set(table.to_pylist()[1].values()) == {None}
+
+
+def test_rows_to_arrow_empty_batch():
+    schema = s.build_bq_schema(["ID", "Kc"])
+    table = s.rows_to_arrow([], schema)
+    assert table.num_rows == 0
+    assert table.column_names == ["ID", "Kc"]
+
+
+# --- LoadStats ---------------------------------------------------------------
+
+def test_load_stats_tracks_max_watermark_from_text_column():
+    schema = s.build_bq_schema(["ID", "DatSave"])
+    stats = s.LoadStats("DatSave")
+    stats.add(s.rows_to_arrow([("a", datetime(2025, 1, 2, 8, 0)), ("b", None)], schema))
+    stats.add(s.rows_to_arrow([("c", datetime(2025, 1, 1, 23, 0))], schema))
+    assert stats.rows == 3 and stats.batches == 2
+    assert stats.max_watermark == datetime(2025, 1, 2, 8, 0)
+
+
+def test_load_stats_without_watermark_column():
+    stats = s.LoadStats()
+    stats.add(s.rows_to_arrow([("a",)], s.build_bq_schema(["ID"])))
+    assert stats.rows == 1 and stats.max_watermark is None
+
+
 # --- databases_to_process -------------------------------------------------
 
 DBS = {
@@ -128,6 +451,94 @@ def test_databases_filter():
     assert [d["database"] for d in out] == ["pohoda_2024"]
 
 
+def test_database_stages_current_last():
+    dbs = s.databases_to_process(DBS, backfill=True)
+    stages = s.database_stages(dbs, DBS["current"])
+    assert [[d["database"] for d in st] for st in stages] == [
+        ["pohoda_2024", "pohoda_2023"], ["pohoda_2025"]
+    ]
+
+
+def test_database_stages_filtered_history_only():
+    dbs = s.databases_to_process(DBS, backfill=True, database_filter="pohoda_2023")
+    stages = s.database_stages(dbs, DBS["current"])
+    assert [[d["database"] for d in st] for st in stages] == [["pohoda_2023"]]
+
+
+# --- run_parallel / ConnectionPool ------------------------------------------
+
+def test_run_parallel_sequential_keeps_order():
+    seen = []
+    s.run_parallel([lambda i=i: seen.append(i) for i in range(5)], 1)
+    assert seen == [0, 1, 2, 3, 4]
+
+
+def test_run_parallel_raises_first_error_and_skips_pending():
+    seen = []
+
+    def boom():
+        raise ValueError("dotaz selhal")
+
+    calls = [boom] + [lambda i=i: (time.sleep(0.05), seen.append(i)) for i in range(20)]
+    with pytest.raises(ValueError, match="dotaz selhal"):
+        s.run_parallel(calls, 2)
+    assert len(seen) < 20
+
+
+def test_connection_pool_reuses_and_caps_connections():
+    created = []
+
+    class Conn:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def factory():
+        created.append(Conn())
+        return created[-1]
+
+    pool = s.ConnectionPool(factory, 2)
+    in_use = []
+
+    def worker():
+        with pool.connection() as conn:
+            in_use.append(conn)
+            time.sleep(0.02)
+
+    s.run_parallel([worker] * 6, 4)
+    assert len(created) == 2
+    assert set(map(id, in_use)) == set(map(id, created))
+    pool.close_all()
+    assert all(c.closed for c in created)
+
+
+# --- _run_databases ----------------------------------------------------------
+
+def test_run_databases_parallel_current_merges_last():
+    syncer = s.PohodaBigQuerySync({
+        "name": "t",
+        "databases": DBS,
+        "sync": {"max_parallel_databases": 2, "max_parallel_queries": 3},
+    })
+    log = []
+    lock = threading.Lock()
+
+    def fake_sync_query(db, query_cfg, backfill, force=False):
+        time.sleep(0.01)
+        with lock:
+            log.append((db["database"], query_cfg["file"]))
+
+    syncer.sync_query = fake_sync_query
+    queries = [{"file": f} for f in ("FA.sql", "PH.sql", "SKz.sql")]
+    dbs = s.databases_to_process(DBS, backfill=True)
+    syncer._run_databases(dbs, queries, backfill=True)
+
+    assert len(log) == 9
+    assert all(db == "pohoda_2025" for db, _ in log[-3:])
+    assert sorted(f for _, f in log[-3:]) == ["FA.sql", "PH.sql", "SKz.sql"]
+
+
 # --- build_finalize_statements --------------------------------------------
 
 def test_finalize_full_normal_replaces():
@@ -159,7 +570,1340 @@ def test_finalize_backfill_full_appends():
     assert "SELECT * FROM `p.d.FA_temp`" in stmts[1]
 
 
+def test_finalize_casts_to_existing_target_types():
+    casts = {"RefCin": s.cast_sql("S.`RefCin`", "INT64", "STRING")}
+    merge = s.build_finalize_statements(
+        "incremental", False, "p.d.FA", "p.d.tmp", "ID", ["ID", "RefCin", "Kc"], casts,
+    )[1]
+    assert "T.`RefCin` = CAST(S.`RefCin` AS STRING)" in merge
+    assert "T.`Kc` = S.`Kc`" in merge
+    assert "VALUES (S.`ID`, CAST(S.`RefCin` AS STRING), S.`Kc`)" in merge
+
+    insert = s.build_finalize_statements(
+        "full", True, "p.d.FA", "p.d.tmp", "ID", ["ID", "RefCin"], casts
+    )[1]
+    assert insert == (
+        "INSERT INTO `p.d.FA` (`ID`, `RefCin`) "
+        "SELECT S.`ID`, CAST(S.`RefCin` AS STRING) FROM `p.d.tmp` S"
+    )
+
+
+def _bq_format(expr: str, value):
+    """Vyhodnotí výraz z cast_sql pro jednu hodnotu (FORMAT* = printf/strftime)."""
+    if expr.startswith("CASE WHEN"):
+        return None if value is None else ("True" if value else "False")
+    fmt = re.search(r"'([^']*)'", expr).group(1)
+    if expr.startswith("FORMAT("):
+        return fmt % value
+    return value.strftime(fmt)
+
+
+@pytest.mark.parametrize("value, source_type, scale", [
+    (True, "BOOL", None),
+    (False, "BOOL", None),
+    (decimal.Decimal("12.50"), "NUMERIC", 2),
+    (decimal.Decimal("-0.125"), "NUMERIC", 3),
+    (datetime(2025, 3, 1, 10, 5, 7, 123456), "DATETIME", None),
+    (date(2025, 3, 1), "DATE", None),
+])
+def test_cast_to_legacy_string_matches_rows_to_arrow(value, source_type, scale):
+    legacy = s.rows_to_arrow([(value,)], [s.bigquery.SchemaField("X", "STRING")])
+    expr = s.cast_sql("S.`X`", source_type, "STRING", scale)
+    assert _bq_format(expr, value) == legacy.column("X")[0].as_py()
+
+
+def test_cast_to_legacy_string_refuses_inexact_text():
+    with pytest.raises(ValueError, match="full refresh"):
+        s.cast_sql("S.`Kc`", "FLOAT64", "STRING")
+    with pytest.raises(ValueError, match="full refresh"):
+        s.cast_sql("S.`Kc`", "NUMERIC", "STRING")
+    assert s.cast_sql("S.`Kc`", "NUMERIC", "FLOAT64") == "CAST(S.`Kc` AS FLOAT64)"
+
+
+def test_int_column_refuses_to_truncate():
+    schema = [s.bigquery.SchemaField("RefCin", "INT64")]
+    assert s.rows_to_arrow([(decimal.Decimal("3"),), (2.0,)], schema).column(0).to_pylist() == [3, 2]
+    with pytest.raises(ValueError, match="celé číslo"):
+        s._arrow_int_array([decimal.Decimal("3.5")], "RefCin")
+    # rows_to_arrow sloupec nezkrátí, převede ho na text (jako u ostatních chyb převodu)
+    fallback = s.rows_to_arrow([(decimal.Decimal("3.5"),), (2.0,)], schema).column(0)
+    assert fallback.to_pylist() == ["3.5", "2.0"]
+
+
+def test_table_options_sql():
+    schema = [s.bigquery.SchemaField("Datum", "TIMESTAMP"), s.bigquery.SchemaField("Den", "DATE"),
+              s.bigquery.SchemaField("Kod", "STRING")]
+    assert s.table_options_sql(schema, "Datum", ["Kod", "ID"]) == (
+        "PARTITION BY TIMESTAMP_TRUNC(`Datum`, MONTH) CLUSTER BY `Kod`, `ID`"
+    )
+    assert s.table_options_sql(schema, {"column": "Den", "granularity": "day"}) == (
+        "PARTITION BY `Den`"
+    )
+    assert s.table_options_sql(schema, None, "Kod") == "CLUSTER BY `Kod`"
+    assert s.table_options_sql(schema) == ""
+    with pytest.raises(ValueError, match="Kod"):
+        s.table_options_sql(schema, "Kod")
+
+
+def test_finalize_partitioned_target_and_pruned_merge():
+    opts = "PARTITION BY TIMESTAMP_TRUNC(`Datum`, MONTH) CLUSTER BY `ID`"
+    full = s.build_finalize_statements("full", False, "p.d.FA", "p.d.tmp", "ID", ["ID"],
+                                       options=opts)
+    assert full == [f"CREATE OR REPLACE TABLE `p.d.FA` {opts} AS SELECT * FROM `p.d.tmp`"]
+
+    ensure, merge = s.build_finalize_statements(
+        "incremental", False, "p.d.FA", "p.d.tmp", "ID", ["ID", "Datum"],
+        options=opts, prune_column="Datum",
+    )
+    assert ensure == f"CREATE TABLE IF NOT EXISTS `p.d.FA` LIKE `p.d.tmp` {opts}"
+    assert merge.startswith(
+        "BEGIN\n"
+        "DECLARE prune_lo DEFAULT (SELECT MIN(`Datum`) FROM `p.d.tmp`);\n"
+        "DECLARE prune_hi DEFAULT (SELECT MAX(`Datum`) FROM `p.d.tmp`);\n"
+    )
+    assert merge.endswith(";\nEND")
+    assert (
+        "ON T.`ID` = S.`ID` AND (T.`Datum` BETWEEN prune_lo AND prune_hi OR T.`Datum` IS NULL)"
+        in merge
+    )
+
+
+def test_finalize_merge_hash_skips_unchanged_rows():
+    ensure, add, merge = s.build_finalize_statements(
+        "incremental", False, "p.d.FA", "p.d.tmp", "ID", ["ID", "Kc", "_row_hash"],
+        hash_column="_row_hash",
+    )
+    assert add == "ALTER TABLE `p.d.FA` ADD COLUMN IF NOT EXISTS `_row_hash` INT64"
+    assert "WHEN MATCHED AND T.`_row_hash` IS DISTINCT FROM S.`_row_hash` THEN UPDATE SET" in merge
+    assert "T.`_row_hash` = S.`_row_hash`" in merge
+
+
+def test_merge_hash_column_stable_across_batches_with_and_without_nulls():
+    # hash-guarded MERGE porovnává uložený _row_hash - nesmí záviset na ostatních řádcích
+    schema = [s.bigquery.SchemaField(c, t) for c, t in [
+        ("ID", "STRING"), ("RefAD", "INT64"), ("Storno", "BOOL"), (s.ROW_HASH_COLUMN, "INT64"),
+    ]]
+    previous = s.rows_to_arrow([("FA-1", 1, False), ("FA-3", 3, True)], schema)
+    current = s.rows_to_arrow(
+        [("FA-1", 1, False), ("FA-2", None, None), ("FA-3", 3, True)], schema
+    )
+    hashes = current.column(s.ROW_HASH_COLUMN).to_pylist()
+    assert [hashes[0], hashes[2]] == previous.column(s.ROW_HASH_COLUMN).to_pylist()
+    converted = s.arrow_to_schema(
+        pa.table({"ID": ["FA-1", "FA-2"], "RefAD": [1, None], "Storno": [False, None]}), schema
+    )
+    assert converted.column(s.ROW_HASH_COLUMN)[0] == previous.column(s.ROW_HASH_COLUMN)[0]
+
+
+@pytest.mark.parametrize("field_type", ["STRING", "INT64"])
+def test_rows_to_arrow_falls_back_to_string_per_value(field_type, caplog):
+    schema = [s.bigquery.SchemaField("Cislo", field_type)]
+    table = s.rows_to_arrow([(1,), (2 ** 70,), (None,)], schema)
+    assert table.column("Cislo").to_pylist() == ["1", str(2 ** 70), None]
+    assert any("převádím na string" in r.getMessage() for r in caplog.records)
+
+
+def test_rows_to_arrow_appends_row_hash_column():
+    schema = SCHEMA + [s.bigquery.SchemaField(s.ROW_HASH_COLUMN, "INT64")]
+    table = s.rows_to_arrow(ROWS[:3], schema)
+    assert table.column_names == ["ID", "Kc", "_row_hash"]
+    plain = s.rows_to_arrow(ROWS[:3], SCHEMA)
+    assert table.column("_row_hash").to_pylist() == s.row_hashes(plain).tolist()
+    assert s.table_row_hashes(table).tolist() == s.row_hashes(plain).tolist()
+
+
+def test_finalize_script_joins_statements():
+    assert s.finalize_script(["CREATE OR REPLACE TABLE x AS SELECT 1"]) == (
+        "CREATE OR REPLACE TABLE x AS SELECT 1"
+    )
+    assert s.finalize_script(["CREATE TABLE a", "MERGE a"]) == "CREATE TABLE a;\nMERGE a;"
+
+
+def test_dimension_query_and_per_database_finalize():
+    q = s.dimension_query({"table": "AD", "columns": ["ID", "Firma", "RefZeme"]})
+    assert q == {
+        "sql": "SELECT '<DATABASE>' AS _database, ID, Firma, RefZeme FROM AD",
+        "table": "dim_AD",
+        "mode": "per_database",
+    }
+    assert s.prepare_sql(q["sql"], "SRV", "db", 7) == (
+        "SELECT 'db' AS _database, ID, Firma, RefZeme FROM [SRV].[db].dbo.AD"
+    )
+    with pytest.raises(ValueError, match="PREFIX_TABLES"):
+        s.dimension_query("Neexistuje")
+    with pytest.raises(ValueError, match=r"neplatné názvy sloupců \['ID; DROP TABLE AD'\]"):
+        s.dimension_query({"table": "AD", "columns": ["Firma", "ID; DROP TABLE AD"]})
+
+    ensure, replace = s.build_finalize_statements(
+        "per_database", True, "p.d.dim_AD", "p.d.tmp", "ID", ["_database", "ID"], database="db"
+    )
+    assert ensure == "CREATE TABLE IF NOT EXISTS `p.d.dim_AD` LIKE `p.d.tmp`"
+    assert replace == (
+        "BEGIN TRANSACTION;\n"
+        "DELETE FROM `p.d.dim_AD` WHERE `_database` = 'db';\n"
+        "INSERT INTO `p.d.dim_AD` (`_database`, `ID`) SELECT S.`_database`, S.`ID` "
+        "FROM `p.d.tmp` S;\n"
+        "COMMIT TRANSACTION"
+    )
+
+
+def test_per_database_finalize_escapes_database_and_casts():
+    _, replace = s.build_finalize_statements(
+        "per_database", True, "p.d.dim_AD", "p.d.tmp", "ID", ["_database", "ID"],
+        casts={"ID": "CAST(S.`ID` AS STRING)"}, database="o'hara\\db",
+    )
+    assert "WHERE `_database` = 'o\\'hara\\\\db';" in replace
+    assert "SELECT S.`_database`, CAST(S.`ID` AS STRING) FROM `p.d.tmp` S;" in replace
+    assert s.prepare_sql(
+        s.dimension_query("AD")["sql"], "SRV", "o'hara", 7
+    ).startswith("SELECT 'o''hara' AS _database")
+
+
+def test_build_view_sql_joins_dimensions():
+    view = {
+        "name": "FA_view", "fact": "FA_fact",
+        "joins": [{"dimension": "AD", "on": "RefAD"}, {"dimension": "sZeme", "on": "AD.RefZeme"}],
+        "columns": ["AD.Firma AS Firma", "COALESCE(sZeme.IDS, 'CZ') AS KodZeme"],
+    }
+    sql = s.build_view_sql(view, lambda t: f"p.d.{t}")
+    assert sql == (
+        "CREATE OR REPLACE VIEW `p.d.FA_view` AS\n"
+        "SELECT\n  f.*,\n  AD.Firma AS Firma,\n  COALESCE(sZeme.IDS, 'CZ') AS KodZeme\n"
+        "FROM `p.d.FA_fact` f\n"
+        "LEFT JOIN `p.d.dim_AD` `AD` ON `AD`.`_database` = f.`_database` AND `AD`.`ID` = f.`RefAD`\n"
+        "LEFT JOIN `p.d.dim_sZeme` `sZeme` ON `sZeme`.`_database` = f.`_database` "
+        "AND `sZeme`.`ID` = `AD`.`RefZeme`"
+    )
+
+
 def test_finalize_backfill_incremental_still_merge():
     stmts = s.build_finalize_statements("incremental", True, "p.d.FA", "p.d.FA_temp", "ID", ["ID", "Kc"])
     assert any("MERGE `p.d.FA` T" in st for st in stmts)
     assert not any("CREATE OR REPLACE" in st for st in stmts)
+
+
+# --- _stream_to_temp ------------------------------------------------------
+
+class FakeCursor:
+    def __init__(self, rows, fail_after=None, columns=None):
+        self.rows = list(rows)
+        self.pos = 0
+        self.fail_after = fail_after
+        self.description = [(c, str) for c in (columns or [])]
+        self.executed = []
+        self.params = []
+        self.fingerprint = (len(self.rows), 12345, None)
+
+    def execute(self, sql, *params):
+        self.executed.append(sql)
+        self.params.append(list(params))
+
+    def fetchone(self):
+        return self.fingerprint
+
+    def close(self):
+        pass
+
+    def fetchmany(self, size):
+        if self.fail_after is not None and self.pos >= self.fail_after:
+            raise RuntimeError("spojení přerušeno")
+        chunk = self.rows[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+class FakeJob:
+    def __init__(self, error=None):
+        self.error = error
+
+    def result(self):
+        if self.error:
+            raise self.error
+
+
+class FakeBQ:
+    def __init__(self, fail_on_load=None):
+        self.loads = []
+        self.queries = []
+        self.deleted = []
+        self.fail_on_load = fail_on_load
+        self.tables = {}
+        self.created = []
+        self.copies = []
+        self.updated = []
+        self.lock = threading.Lock()
+
+    def get_table(self, table_id):
+        if table_id not in self.tables:
+            raise s.NotFound(table_id)
+        return s.bigquery.Table(table_id, self.tables[table_id])
+
+    def create_table(self, table):
+        self.created.append(table)
+        self.tables[table.table_id] = table.schema
+
+    def update_table(self, table, fields):
+        self.updated.append((table.table_id, {f: getattr(table, f) for f in fields}))
+
+    def copy_table(self, source, destination, job_config=None):
+        self.copies.append((source, destination, job_config.write_disposition))
+        return FakeJob()
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.deleted.append(table_id)
+        self.tables.pop(table_id, None)
+
+    def query(self, sql):
+        self.queries.append(sql)
+        return FakeJob()
+
+    def load_table_from_file(self, buf, table_id, job_config=None):
+        import pyarrow.parquet as pq
+        table = pq.read_table(buf)
+        with self.lock:
+            self.loads.append((table_id, table.num_rows))
+            n = len(self.loads)
+        if self.fail_on_load and n == self.fail_on_load:
+            return FakeJob(RuntimeError("load job selhal"))
+        return FakeJob()
+
+
+def make_syncer(bq, **sync_cfg):
+    syncer = s.PohodaBigQuerySync({"name": "t", "sync": sync_cfg})
+    syncer.bq_client = bq
+    return syncer
+
+
+ROWS = [(f"FA-{i}", decimal.Decimal(i)) for i in range(1003)]
+SCHEMA = s.build_bq_schema(["ID", "Kc"])
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_stream_to_temp_counts_all_rows(workers):
+    bq = FakeBQ()
+    syncer = make_syncer(bq, upload_workers=workers)
+    total = syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+    assert total == 1003
+    assert sum(n for _, n in bq.loads) == 1003
+    assert len(bq.loads) == 11
+
+
+def test_stream_to_temp_pipelined_propagates_upload_error():
+    syncer = make_syncer(FakeBQ(fail_on_load=4), upload_workers=3)
+    with pytest.raises(RuntimeError, match="load job selhal"):
+        syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 10)
+
+
+def test_stream_to_temp_pipelined_propagates_fetch_error():
+    syncer = make_syncer(FakeBQ(), upload_workers=2)
+    with pytest.raises(RuntimeError, match="spojení přerušeno"):
+        syncer._stream_to_temp(FakeCursor(ROWS, fail_after=300), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+
+
+def test_stream_to_temp_spool_one_load_per_file(tmp_path):
+    bq = FakeBQ()
+    syncer = make_syncer(bq, spool=True, spool_dir=str(tmp_path))
+    total = syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+    assert total == 1003
+    assert bq.loads == [("p.d.t", 1003)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stream_to_temp_spool_rolls_files_by_size(tmp_path):
+    bq = FakeBQ()
+    syncer = make_syncer(bq, spool=True, spool_dir=str(tmp_path), spool_file_max_mb=0.000001)
+    stats = s.LoadStats()
+    syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 400, stats)
+    assert [n for _, n in bq.loads] == [400, 400, 203]
+    assert stats.bytes > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stream_to_temp_spool_cleans_up_on_error(tmp_path):
+    syncer = make_syncer(FakeBQ(), spool=True, spool_dir=str(tmp_path))
+    with pytest.raises(RuntimeError, match="spojení přerušeno"):
+        syncer._stream_to_temp(FakeCursor(ROWS, fail_after=300), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_batch_sizer_follows_byte_budget_latency_and_rss(monkeypatch):
+    rss = [100]
+    monkeypatch.setattr(s, "current_rss", lambda: rss[0])
+    table = s.rows_to_arrow(ROWS[:1000], SCHEMA)
+    row_bytes = table.nbytes / table.num_rows
+
+    fixed = s.BatchSizer(1000)
+    fixed.observe(table)
+    assert fixed.size == 1000
+
+    sizer = s.BatchSizer(1000, batch_bytes=int(row_bytes * 10_000), max_load_seconds=10,
+                         max_rss=1000)
+    sizer.observe(table)
+    assert sizer.size == 2000  # roste nejvýš 2× za dávku
+    for _ in range(5):
+        sizer.observe(table)
+    assert sizer.size == 10_000
+    sizer.observe_load(40.0)
+    assert sizer.size == 2500
+    rss[0] = 5000
+    sizer.observe(table)
+    assert sizer.size == 1250
+    assert sizer.peak_rss == 5000
+
+    sizer = s.BatchSizer(1000, batch_bytes=int(row_bytes * 100))
+    sizer.observe(table)
+    assert sizer.size == 100
+
+    # max_rss platí i bez batch_bytes; pod limitem zpět k batch_size
+    rss[0] = 5000
+    capped = s.BatchSizer(1000, max_rss=1000)
+    capped.observe(table)
+    capped.observe(table)
+    assert capped.size == 250
+    rss[0] = 100
+    for _ in range(5):
+        capped.observe(table)
+    assert capped.size == 1000
+
+
+class SizeRecordingCursor(FakeCursor):
+    def __init__(self, rows, **kwargs):
+        super().__init__(rows, **kwargs)
+        self.sizes = []
+
+    def fetchmany(self, size):
+        self.sizes.append(size)
+        return super().fetchmany(size)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_stream_to_temp_adaptive_batch_size(workers):
+    bq = FakeBQ()
+    syncer = make_syncer(bq, batch_bytes_mb=0.005, min_batch_size=10, upload_workers=workers)
+    cursor = SizeRecordingCursor(ROWS)
+    stats = s.LoadStats()
+    total = syncer._stream_to_temp(cursor, ["ID", "Kc"], SCHEMA, "p.d.t", 50, stats)
+
+    assert total == len(ROWS)
+    assert cursor.sizes[0] == 50 and max(cursor.sizes) > 50
+    row_bytes = s.rows_to_arrow(ROWS, SCHEMA).nbytes / len(ROWS)
+    assert max(cursor.sizes) <= 0.005 * 1024 * 1024 / row_bytes * 1.2
+    assert stats.peak_rss > 0
+
+
+def test_finalize_queue_chains_same_target():
+    queue = s.FinalizeQueue(3)
+    order = []
+
+    def job(name, delay):
+        def run():
+            time.sleep(delay)
+            order.append(name)
+        return run
+
+    queue.submit("FA", job("FA-2024", 0.05))
+    queue.submit("PH", job("PH-2025", 0))
+    queue.submit("FA", job("FA-2025", 0))
+    assert queue.join() is None
+    assert order.index("FA-2024") < order.index("FA-2025")
+    assert order[0] == "PH-2025"
+
+
+def test_finalize_queue_join_returns_first_error():
+    queue = s.FinalizeQueue(2)
+
+    def fail():
+        raise RuntimeError("MERGE selhal")
+
+    queue.submit("FA", fail)
+    queue.submit("FA", lambda: None)
+    error = queue.join()
+    assert isinstance(error, RuntimeError)
+    with pytest.raises(RuntimeError, match="MERGE selhal"):
+        queue.raise_failed()
+
+
+@pytest.fixture
+def fork_converter(monkeypatch):
+    # spawn by v dětském procesu neměl fake moduly z conftest
+    monkeypatch.setattr(s, "CONVERT_START_METHOD", "fork")
+
+
+def test_batch_converter_pool_keeps_order(fork_converter):
+    batches = [ROWS[i:i + 100] for i in range(0, len(ROWS), 100)]
+    converter = s.BatchConverter(SCHEMA, processes=2, min_rows=1)
+    converter.state = "pool"
+    try:
+        tables = list(converter.imap(iter(batches)))
+    finally:
+        converter.close()
+    assert [t.num_rows for t in tables] == [len(b) for b in batches]
+    assert tables[3].equals(s.rows_to_arrow(batches[3], SCHEMA))
+
+
+@pytest.mark.parametrize("local_cost, expected", [(1.0, "pool"), (0.0, "local")])
+def test_batch_converter_measures_overhead(fork_converter, local_cost, expected):
+    converter = s.BatchConverter(SCHEMA, processes=2, min_rows=50)
+    try:
+        assert converter.convert(ROWS[:10]).num_rows == 10  # pod min_rows, lokálně
+        assert converter.state == "measure_local"
+        converter.convert(ROWS[:100])
+        assert converter.state == "measure_pool"
+        converter._local_cost = local_cost
+        table = converter.convert(ROWS[100:200])
+        assert table.equals(s.rows_to_arrow(ROWS[100:200], SCHEMA))
+        assert converter.state == expected
+    finally:
+        converter.close()
+
+
+def _crash_in_worker(rows, fields):
+    if rows:
+        os._exit(1)  # pád procesu poolu (např. OOM killer)
+    return b"", 0.0
+
+
+@pytest.mark.parametrize("state", ["pool", "measure_pool"])
+def test_batch_converter_falls_back_to_local_when_pool_breaks(
+        fork_converter, monkeypatch, caplog, state):
+    monkeypatch.setattr(s, "_convert_in_worker", _crash_in_worker)
+    batches = [ROWS[i:i + 100] for i in range(0, 400, 100)]
+    converter = s.BatchConverter(SCHEMA, processes=2, min_rows=1, name="t")
+    converter.state, converter._local_cost = state, 1.0
+    try:
+        tables = list(converter.imap(iter(batches)))
+    finally:
+        converter.close()
+    assert [t.equals(s.rows_to_arrow(b, SCHEMA)) for t, b in zip(tables, batches)] == [True] * 4
+    assert converter.state == "local"
+    assert sum("pool převodu spadl" in r.getMessage() for r in caplog.records) == 1
+
+
+def test_batch_converter_pool_counts_convert_once_per_batch(fork_converter):
+    timer = s.StageTimer()
+    batches = [ROWS[i:i + 100] for i in range(0, 300, 100)]
+    converter = s.BatchConverter(SCHEMA, processes=2, min_rows=1, timer=timer)
+    converter.state = "pool"
+    try:
+        list(converter.imap(iter(batches)))
+        converter.convert(ROWS[:10])
+    finally:
+        converter.close()
+    convert = timer.report()["convert"]
+    assert (convert["count"], convert["rows"]) == (4, 310)
+
+
+def test_stream_to_temp_with_convert_processes(fork_converter):
+    bq = FakeBQ()
+    syncer = make_syncer(bq, convert_processes=2, convert_min_rows=1)
+    try:
+        total = syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+        pool = syncer._convert_pool
+        # druhý dotaz běhu použije tentýž (už běžící) pool
+        syncer._stream_to_temp(FakeCursor(ROWS[:200]), ["ID", "Kc"], SCHEMA, "p.d.t2", 100)
+        assert syncer._convert_pool is pool and pool.started
+    finally:
+        syncer.close()
+    assert total == 1003
+    assert [n for _, n in bq.loads[:11]] == [100] * 10 + [3]
+    assert not pool.started and syncer._convert_pool is None
+
+
+def test_stream_to_temp_small_query_never_starts_convert_pool():
+    bq = FakeBQ()
+    syncer = make_syncer(bq, convert_processes=8, convert_min_rows=2000)
+    syncer._stream_to_temp(FakeCursor(ROWS[:10]), ["ID", "Kc"], SCHEMA, "p.d.t", 100)
+    assert not syncer._convert_pool.started
+    syncer.close()
+
+
+# --- sync_query ---------------------------------------------------------------
+
+class FakeConn:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def make_block_syncer(tmp_path, cursor, bq, **sync_cfg):
+    (tmp_path / "FA.sql").write_text(
+        "SELECT * FROM FA h WHERE COALESCE(h.DatSave, h.DatCreate) >= <WATERMARK>",
+        encoding="utf-8",
+    )
+    syncer = s.PohodaBigQuerySync({
+        "name": "t",
+        "bigquery": {"project_id": "p", "dataset": "d"},
+        "sync": {"state_file": str(tmp_path / "state.db"), **sync_cfg},
+    })
+    syncer.bq_client = bq
+    syncer.mssql_pool = s.ConnectionPool(lambda: FakeConn(cursor), 1)
+    return syncer
+
+
+def test_sync_query_watermark_roundtrip(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "watermark_column": "DatSave"}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    rows = [("FA-1", datetime(2025, 3, 1, 10, 0)), ("FA-2", datetime(2025, 3, 2, 12, 0))]
+
+    cursor = FakeCursor(rows, columns=["ID", "DatSave"])
+    syncer = make_block_syncer(tmp_path, cursor, FakeBQ(), watermark_overlap_minutes=30)
+    syncer.sync_query(db, query, backfill=False)
+    assert cursor.executed[0].endswith("(GETDATE() - ?)")
+    assert cursor.params[0] == [7]
+    assert syncer.state.get_watermark("t", "pohoda_2025", "FA") == datetime(2025, 3, 2, 12, 0)
+
+    cursor = FakeCursor([], columns=["ID", "DatSave"])
+    syncer.mssql_pool = s.ConnectionPool(lambda: FakeConn(cursor), 1)
+    syncer.sync_query(db, query, backfill=False)
+    assert cursor.executed[0].endswith("CAST(? AS DATETIME2)")
+    assert cursor.params[0] == [datetime(2025, 3, 2, 11, 30)]
+
+
+def test_sync_query_rejects_unknown_watermark_column(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "watermark_column": "DatSav"}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    bq = FakeBQ()
+    cursor = FakeCursor([("FA-1", datetime(2025, 3, 1))], columns=["ID", "DatSave"])
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    with pytest.raises(ValueError, match=r"FA\.sql: watermark_column 'DatSav' není ve výsledku"):
+        syncer.sync_query(db, query, backfill=False)
+    assert bq.loads == [] and bq.created == []
+    assert syncer.state.get_watermark("t", "pohoda_2025", "FA") is None
+
+
+def test_sync_query_records_run_tables(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql")}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    cursor = FakeCursor([("FA-1", datetime(2025, 3, 1))], columns=["ID", "DatSave"])
+    syncer = make_block_syncer(tmp_path, cursor, FakeBQ())
+    syncer._run_id = syncer.state.start_run("t")
+    syncer.sync_query(db, query, backfill=False)
+
+    (row,) = syncer.state.run_tables(syncer._run_id)
+    assert row["outcome"] == "success" and row["rows_extracted"] == 1
+    assert row["bytes_uploaded"] > 0 and row["peak_rss_bytes"] > 0
+    assert set(row["stages"]) == {
+        "execute", "create_temp", "fetch", "convert", "serialize", "upload", "stream",
+        "finalize", "cleanup",
+    }
+
+    [report] = syncer.report["tables"]
+    assert report["outcome"] == "success" and report["rows_extracted"] == 1
+    assert report["process_peak_rss_bytes"] == row["peak_rss_bytes"]
+    stages = report["stages"]
+    assert stages["fetch"]["rows"] == 1 and stages["fetch"]["count"] == 2  # poslední fetch prázdný
+    assert stages["convert"]["rows"] == 1
+    assert stages["upload"]["rows"] == 1 and stages["upload"]["bytes"] == row["bytes_uploaded"]
+
+
+# --- row_hash ------------------------------------------------------------------
+
+def test_row_hashes_match_bigquery_readback_types():
+    import pyarrow as pa
+
+    schema = s.build_bq_schema(["ID", "Datum", "Kc"])
+    local = s.rows_to_arrow([("FA-1", date(2025, 1, 2), decimal.Decimal("1.5"))], schema)
+    from_bq = pa.table({
+        "ID": ["FA-1"],
+        "Datum": pa.array([datetime(2025, 1, 2)], type=pa.timestamp("us", tz="UTC")),
+        "Kc": [1.5],
+    })
+    assert s.row_hashes(local).tolist() == s.row_hashes(from_bq).tolist()
+
+
+def test_row_hash_filter_passes_only_changed_rows(tmp_path):
+    from sync_state import StateStore
+
+    schema = s.build_bq_schema(["ID", "Kc"])
+    store = StateStore(tmp_path / "state.db")
+    first = s.RowHashFilter(store, "t", "FA", "ID")
+    batch = s.rows_to_arrow([("FA-1", 1), ("FA-2", 2)], schema)
+    assert first.filter(batch).num_rows == 2
+    first.commit()
+
+    second = s.RowHashFilter(store, "t", "FA", "ID")
+    batch = s.rows_to_arrow([("FA-1", 1), ("FA-2", 5), ("FA-3", 3)], schema)
+    assert second.filter(batch).column("ID").to_pylist() == ["FA-2", "FA-3"]
+
+
+@pytest.mark.parametrize("field_type, value", [("INT64", 7), ("BOOL", True)])
+def test_row_hashes_do_not_depend_on_nulls_in_other_rows(field_type, value):
+    schema = [s.bigquery.SchemaField("ID", "STRING"), s.bigquery.SchemaField("V", field_type)]
+    without_null = s.rows_to_arrow([("FA-1", value), ("FA-3", value)], schema)
+    with_null = s.rows_to_arrow([("FA-1", value), ("FA-2", None), ("FA-3", value)], schema)
+    hashes = s.row_hashes(with_null).tolist()
+    assert [hashes[0], hashes[2]] == s.row_hashes(without_null).tolist()
+
+
+def test_row_hash_filter_ignores_nulls_in_other_rows(tmp_path):
+    from sync_state import StateStore
+
+    schema = [s.bigquery.SchemaField("ID", "STRING"), s.bigquery.SchemaField("RefAD", "INT64"),
+              s.bigquery.SchemaField("Storno", "BOOL")]
+    store = StateStore(tmp_path / "state.db")
+    first = s.RowHashFilter(store, "t", "FA", "ID")
+    first.filter(s.rows_to_arrow([("FA-1", 1, False), ("FA-3", 3, True)], schema))
+    first.commit()
+
+    second = s.RowHashFilter(store, "t", "FA", "ID")
+    batch = s.rows_to_arrow([("FA-1", 1, False), ("FA-2", None, None), ("FA-3", 3, True)], schema)
+    assert second.filter(batch).column("ID").to_pylist() == ["FA-2"]
+
+
+# Arrow typy, jak je vrací BigQuery list_rows(...).to_arrow_iterable().
+BQ_READBACK_TYPES = {
+    "STRING": pa.string(), "INT64": pa.int64(), "FLOAT64": pa.float64(), "BOOL": pa.bool_(),
+    "NUMERIC": pa.decimal128(38, 9), "BIGNUMERIC": pa.decimal256(76, 38), "DATE": pa.date32(),
+    "DATETIME": pa.timestamp("us"), "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+}
+
+
+class ReadbackBQ(FakeBQ):
+    """Cílová tabulka jako Arrow dávky po dvou řádcích, s typy z BigQuery."""
+
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+
+    def list_rows(self, table_id):
+        class Rows:
+            def to_arrow_iterable(rows):
+                return iter(self.table.to_batches(max_chunksize=2))
+        return Rows()
+
+
+@pytest.mark.parametrize("merge_hash", [False, True])
+def test_rebuild_row_hash_index_roundtrip_reports_no_changes(tmp_path, merge_hash):
+    columns = ["ID", "RefAD", "Kc", "Mnozstvi", "Velky", "Storno", "Datum", "DatSave",
+               "Vytvoreno", "Firma"]
+    schema = [s.bigquery.SchemaField(c, t) for c, t in zip(columns, [
+        "STRING", "INT64", "FLOAT64", "NUMERIC", "BIGNUMERIC", "BOOL", "DATE", "DATETIME",
+        "TIMESTAMP", "STRING",
+    ])]
+    if merge_hash:
+        schema.append(s.bigquery.SchemaField(s.ROW_HASH_COLUMN, "INT64"))
+    rows = [
+        (f"FA-{i}", i if i % 2 else None, decimal.Decimal(i) / 4, decimal.Decimal("1.125") * i,
+         decimal.Decimal(10) ** 30 + i, i % 3 == 0, date(2025, 1, 1 + i),
+         datetime(2025, 1, 1, 8, i, 5, 250000), datetime(2025, 2, 1, i, 0), None if i == 2 else "Lékárna")
+        for i in range(5)
+    ]
+    batch = s.rows_to_arrow(rows, schema)
+    target = pa.table([
+        batch.column(f.name).cast(BQ_READBACK_TYPES[f.field_type]) for f in schema
+    ], names=[f.name for f in schema])
+
+    syncer = make_block_syncer(tmp_path, FakeCursor([]), ReadbackBQ(target))
+    # index pod stejným názvem tabulky jako sync_query ("table" má přednost před souborem)
+    query = {"file": str(tmp_path / "FA.sql"), "table": "FA_radky", "row_hash": True}
+    assert syncer.rebuild_row_hash_index(query) == 5
+
+    row_filter = s.RowHashFilter(syncer.state, "t", "FA_radky", "ID")
+    assert row_filter.filter(batch).num_rows == 0
+    changed = s.rows_to_arrow([rows[0][:-1] + ("Nemocnice",)] + rows[1:], schema)
+    assert row_filter.filter(changed).column("ID").to_pylist() == ["FA-0"]
+
+
+def test_sync_query_row_hash_skips_unchanged(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "row_hash": True}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    rows = [("FA-1", decimal.Decimal("1")), ("FA-2", decimal.Decimal("2"))]
+
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, FakeCursor(rows, columns=["ID", "Kc"]), bq)
+    syncer.sync_query(db, query, backfill=False)
+    assert sum(n for _, n in bq.loads) == 2
+    assert any("MERGE" in q for q in bq.queries)
+
+    bq = FakeBQ()
+    syncer.bq_client = bq
+    syncer.mssql_pool = s.ConnectionPool(
+        lambda: FakeConn(FakeCursor(rows, columns=["ID", "Kc"])), 1
+    )
+    syncer.sync_query(db, query, backfill=False)
+    assert bq.loads == [] and bq.queries == []
+
+
+# --- backfill fingerprint ----------------------------------------------------------
+
+def test_sync_query_backfill_skips_unchanged_history(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql")}
+    history = {"linked_server": "SRV", "database": "pohoda_2023"}
+    rows = [("FA-1", decimal.Decimal("1"))]
+
+    def run(force=False):
+        bq = FakeBQ()
+        cursor = FakeCursor(rows, columns=["ID", "Kc"])
+        syncer = make_block_syncer(tmp_path, cursor, bq)
+        syncer.config["databases"] = {"current": {"database": "pohoda_2025"}, "history": [history]}
+        syncer.sync_query(history, query, backfill=True, force=force)
+        return bq, cursor
+
+    bq, cursor = run()
+    assert "CHECKSUM_AGG" in cursor.executed[0]
+    assert sum(n for _, n in bq.loads) == 1
+
+    bq, cursor = run()
+    assert len(cursor.executed) == 1 and bq.loads == []
+
+    bq, _ = run(force=True)
+    assert sum(n for _, n in bq.loads) == 1
+
+
+def test_sync_query_backfill_without_fingerprint_for_unwrappable_query(tmp_path):
+    history = {"linked_server": "SRV", "database": "pohoda_2023"}
+    query = {"sql": "SELECT ID, Kc FROM FA ORDER BY ID", "table": "FA"}
+    bq = FakeBQ()
+    cursor = FakeCursor([("FA-1", decimal.Decimal("1"))], columns=["ID", "Kc"])
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.config["databases"] = {"current": {"database": "pohoda_2025"}, "history": [history]}
+    syncer.sync_query(history, query, backfill=True)
+    assert len(cursor.executed) == 1 and "CHECKSUM_AGG" not in cursor.executed[0]
+    assert sum(n for _, n in bq.loads) == 1
+
+
+def test_sync_query_inferred_schema_keeps_existing_target_types(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "schema": "inferred"}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    cursor = FakeCursor([("FA-1", 5)])
+    cursor.description = [("ID", str, None, 40, 40, 0, True), ("RefCin", int, None, 10, 10, 0, True)]
+    bq = FakeBQ()
+    bq.tables["p.d.FA"] = [s.bigquery.SchemaField("ID", "STRING"),
+                          s.bigquery.SchemaField("RefCin", "STRING")]
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.sync_query(db, query, backfill=False)
+
+    merge = bq.queries[-1]
+    assert "T.`RefCin` = CAST(S.`RefCin` AS STRING)" in merge
+    assert "CAST(S.`ID`" not in merge
+
+
+def test_sync_query_names_schema_casts_into_inferred_target(tmp_path):
+    # dotaz vrácený ze "inferred" na "names" - cíl už má typy z inferovaného schématu
+    query = {"file": str(tmp_path / "FA.sql")}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    cursor = FakeCursor([("FA-1", 5, True)], columns=["ID", "RefCin", "Storno"])
+    bq = FakeBQ()
+    bq.tables["p.d.FA"] = [s.bigquery.SchemaField("ID", "STRING"),
+                          s.bigquery.SchemaField("RefCin", "INT64"),
+                          s.bigquery.SchemaField("Storno", "BOOL")]
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.sync_query(db, query, backfill=False)
+
+    merge = bq.queries[-1]
+    assert f"T.`RefCin` = {s.cast_sql('S.`RefCin`', 'STRING', 'INT64')}" in merge
+    assert f"T.`Storno` = {s.cast_sql('S.`Storno`', 'STRING', 'BOOL')}" in merge
+    assert "CAST(S.`ID`" not in merge
+
+
+class DmlStats:
+    inserted_row_count = 1
+    updated_row_count = 2
+    deleted_row_count = 0
+
+
+def test_sync_query_merge_hash_records_dml_stats(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "merge_hash": True}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    bq = FakeBQ()
+    merge_job = FakeJob()
+    merge_job.dml_stats = DmlStats()
+    bq.query = lambda sql: bq.queries.append(sql) or (merge_job if "MERGE" in sql else FakeJob())
+    cursor = FakeCursor([("FA-1", "x"), ("FA-2", "y"), ("FA-3", "z")], columns=["ID", "Kod"])
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer._run_id = syncer.state.start_run("t")
+    syncer.sync_query(db, query, backfill=False)
+
+    assert any("ADD COLUMN IF NOT EXISTS `_row_hash`" in q for q in bq.queries)
+    [t] = syncer.state.run_tables(syncer._run_id)
+    assert (t["rows_inserted"], t["rows_updated"]) == (1, 2)
+
+
+def test_dml_stats_sums_script_child_jobs():
+    class Child:
+        def __init__(self, dml):
+            self.dml_stats = dml
+
+    script = FakeJob()
+    script.statement_type = "SCRIPT"
+    bq = FakeBQ()
+    bq.list_jobs = lambda parent_job: [Child(None), Child(DmlStats()), Child(DmlStats())]
+    syncer = make_syncer(bq)
+    assert syncer._dml_stats(script) == {"inserted": 2, "updated": 4, "deleted": 0}
+
+
+def test_sync_query_finalize_stages_per_statement(tmp_path):
+    class Child(FakeJob):
+        def __init__(self, statement_type, seconds, rows):
+            super().__init__()
+            self.statement_type = statement_type
+            self.started = datetime(2025, 3, 1, 2, 0, 0)
+            self.ended = datetime(2025, 3, 1, 2, 0, seconds)
+            self.num_dml_affected_rows = rows
+            self.total_bytes_processed = 1000
+            self.dml_stats = None
+
+    script = FakeJob()
+    script.statement_type = "SCRIPT"
+    bq = FakeBQ()
+    bq.query = lambda sql: bq.queries.append(sql) or script
+    bq.list_jobs = lambda parent_job: [Child("MERGE", 7, 3), Child("CREATE_TABLE", 1, None)]
+    cursor = FakeCursor([("FA-1", "x")], columns=["ID", "Kod"])
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.sync_query({"linked_server": "SRV", "database": "pohoda_2025"},
+                      {"file": str(tmp_path / "FA.sql")}, backfill=False)
+
+    stages = syncer.report["tables"][0]["stages"]
+    assert stages["finalize:merge"] == {"seconds": 7.0, "count": 1, "rows": 3, "bytes": 1000}
+    assert stages["finalize:create_table"]["seconds"] == 1.0
+
+
+def test_finish_run_writes_metrics_file(tmp_path):
+    cursor = FakeCursor([("FA-1", "x")], columns=["ID", "Kod"])
+    syncer = make_block_syncer(
+        tmp_path, cursor, FakeBQ(), metrics_file=str(tmp_path / "prom" / "pohoda_{block}.prom")
+    )
+    syncer.report["started_at"] = datetime.now().isoformat()
+    syncer._run_id = syncer.state.start_run("t")
+    syncer.sync_query({"linked_server": "SRV", "database": "pohoda_2025"},
+                      {"file": str(tmp_path / "FA.sql")}, backfill=False)
+    syncer._finish_run(True)
+
+    text = (tmp_path / "prom" / "pohoda_t.prom").read_text(encoding="utf-8")
+    assert 'pohoda_sync_rows_total{block="t",database="pohoda_2025",table="FA"} 1' in text
+    assert 'pohoda_sync_last_run_success{block="t"} 1' in text
+
+
+def test_finish_run_prunes_old_history(tmp_path):
+    import sqlite3
+
+    syncer = make_block_syncer(tmp_path, FakeCursor([]), FakeBQ(), history_keep_days=30)
+    old = syncer.state.start_run("t")
+    syncer.state.finish_run(old, True)
+    conn = sqlite3.connect(tmp_path / "state.db")
+    with conn:
+        conn.execute("UPDATE runs SET started_at = '2020-01-01 00:00:00.000000' WHERE id = ?",
+                     (old,))
+    conn.close()
+    syncer._run_id = syncer.state.start_run("t")
+    syncer._finish_run(True)
+    assert [r["id"] for r in syncer.state.last_runs("t", 5)] == [syncer._run_id]
+    assert syncer.state.run_totals("t")["runs"] == 2
+
+
+def test_sync_query_sentry_spans(tmp_path, monkeypatch):
+    monkeypatch.setattr(s, "MAX_STAGE_SPANS", 2)
+    cursor = FakeCursor([(f"FA-{i}", "x") for i in range(5)], columns=["ID", "Kod"])
+    syncer = make_block_syncer(tmp_path, cursor, FakeBQ(), batch_size=1)
+    syncer._transaction = tx = s.sentry_sdk.start_transaction(op="sync.block", name="t")
+    syncer.sync_query({"linked_server": "SRV", "database": "pohoda_2025"},
+                      {"file": str(tmp_path / "FA.sql"), "mode": "incremental"}, backfill=False)
+
+    [query] = tx.children
+    assert query.op == "sync.query" and query.description == "pohoda_2025 / FA"
+    assert query.tags["mode"] == "incremental" and query.tags["outcome"] == "success"
+    assert query.data["rows"] == 5 and query.finished and query.status == "ok"
+    ops = [c.op for c in query.children]
+    for op in ("sync.execute", "sync.create_temp", "sync.stream", "sync.finalize", "sync.cleanup"):
+        assert ops.count(op) == 1
+    assert ops.count("sync.fetch") == 2 and ops.count("sync.upload") == 2  # MAX_STAGE_SPANS
+    upload = next(c for c in query.children if c.op == "sync.upload")
+    assert upload.data["rows"] == 1 and upload.data["bytes"] > 0
+    assert all(c.finished and c.end_timestamp >= c.start_timestamp for c in query.children)
+    assert syncer.report["tables"][0]["stages"]["fetch"]["count"] == 6
+
+
+def test_write_run_report_sums_stages(tmp_path):
+    started = datetime(2025, 3, 1, 2, 0, 0)
+    assert s.run_report_path([{"sync": {}}], started) is None
+    assert s.run_report_path([{"sync": {"report_dir": ""}}], started) is None
+    assert s.run_report_path([{"sync": {"report_dir": "reports"}}], started) == str(
+        Path("reports") / "run_20250301_020000.json"
+    )
+    assert s.run_report_path([{"sync": {}}], started, "x.json") == "x.json"
+
+    stage = {"seconds": 1.5, "count": 2, "rows": 10, "bytes": 100}
+    blocks = [
+        {"block": "a", "tables": [{"table": "FA", "stages": {"fetch": stage}}]},
+        {"block": "b", "tables": [{"table": "FA", "stages": {"fetch": stage, "upload": stage}}]},
+    ]
+    path = tmp_path / "reports" / "run.json"
+    s.write_run_report(str(path), blocks, started, ok=True, argv=["--backfill"])
+
+    report = json.loads(path.read_text(encoding="utf-8"))
+    assert report["outcome"] == "success" and report["argv"] == ["--backfill"]
+    assert report["stages"]["fetch"] == {"seconds": 3.0, "count": 4, "rows": 20, "bytes": 200}
+    assert [b["block"] for b in report["blocks"]] == ["a", "b"]
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_run_databases_background_finalize(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "mode": "incremental"}
+    cursor = FakeCursor([("FA-1", "x")], columns=["ID", "Kod"])
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, cursor, bq, finalize_workers=2)
+    current = {"linked_server": "SRV", "database": "pohoda_2025"}
+    syncer.config["databases"] = {"current": current}
+    syncer._run_databases([current], [query], backfill=False)
+
+    assert len(bq.queries) == 1
+    assert bq.queries[0].startswith("CREATE TABLE IF NOT EXISTS `p.d.FA`")
+    assert "MERGE `p.d.FA`" in bq.queries[0]
+    assert len(bq.deleted) == 2  # před vytvořením temp tabulky a po finalizaci
+    assert syncer._finalizer is None
+
+
+def test_run_databases_background_finalize_error_fails_run(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "mode": "incremental"}
+    cursor = FakeCursor([("FA-1", "x")], columns=["ID", "Kod"])
+    bq = FakeBQ()
+    bq.query = lambda sql: FakeJob(RuntimeError("MERGE selhal"))
+    syncer = make_block_syncer(tmp_path, cursor, bq, finalize_workers=1)
+    current = {"linked_server": "SRV", "database": "pohoda_2025"}
+    syncer.config["databases"] = {"current": current}
+    with pytest.raises(RuntimeError, match="MERGE selhal"):
+        syncer._run_databases([current], [query], backfill=False)
+    assert len(bq.deleted) == 2
+
+
+def test_sync_query_full_refresh_copies_temp_into_target(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "mode": "full",
+             "partition_by": "DatSave", "cluster_by": ["ID"],
+             "column_types": {"DatSave": "DATETIME"}}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    cursor = FakeCursor([("FA-1", datetime(2025, 3, 1))], columns=["ID", "DatSave"])
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.sync_query(db, query, backfill=False)
+
+    [temp] = bq.created
+    assert temp.time_partitioning.field == "DatSave"
+    assert temp.time_partitioning.type_ == "MONTH"
+    assert temp.clustering_fields == ["ID"]
+    assert bq.copies == [(temp.table_id, "p.d.FA", "WRITE_TRUNCATE")]
+    assert bq.queries == []
+    assert bq.deleted[-1] == temp.table_id
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_sync_query_full_refresh_existing_target_layout(tmp_path, partitioned):
+    query = {"file": str(tmp_path / "FA.sql"), "mode": "full",
+             "partition_by": "DatSave", "cluster_by": ["ID"],
+             "column_types": {"DatSave": "DATETIME"}}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    cursor = FakeCursor([("FA-1", datetime(2025, 3, 1))], columns=["ID", "DatSave"])
+    bq = FakeBQ()
+    # cíl z dřívějška - jiné typy sloupců (copy job je převezme z temp tabulky)
+    target = s.bigquery.Table("p.d.FA", [s.bigquery.SchemaField("ID", "INT64"),
+                                        s.bigquery.SchemaField("DatSave", "STRING")])
+    if partitioned:
+        target.time_partitioning = s.bigquery.TimePartitioning(type_="MONTH", field="DatSave")
+        target.clustering_fields = ["ID"]
+    get_table = bq.get_table
+    bq.get_table = lambda table_id: target if table_id == "p.d.FA" else get_table(table_id)
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer.sync_query(db, query, backfill=False)
+
+    [temp] = bq.created
+    assert temp.time_partitioning.field == "DatSave" and temp.clustering_fields == ["ID"]
+    assert bq.copies == [(temp.table_id, "p.d.FA", "WRITE_TRUNCATE")]
+    assert bq.queries == []
+    # copy job do cíle s jiným partitioningem by selhal - cíl se nejdřív smaže
+    assert ("p.d.FA" in bq.deleted) == (not partitioned)
+
+
+@pytest.mark.parametrize("no_linked_server", ["auto", "openquery", "linked"])
+def test_strategy_auto_and_direct_pool(tmp_path, monkeypatch, no_linked_server):
+    syncer = make_block_syncer(tmp_path, FakeCursor([]), FakeBQ(), strategy="auto")
+    syncer.config["mssql"] = {"server": "hlavni", "database": "x", "username": "u",
+                              "password": "p", "driver": "D", "timeout": 30}
+    linked = {"linked_server": "SRV", "database": "pohoda_2024"}
+    direct = {"server": "archiv", "database": "pohoda_2023", "strategy": "auto"}
+    assert syncer._strategy(linked) == "openquery"
+    assert syncer._strategy(direct) == "direct"
+    assert syncer._strategy({**linked, "strategy": "linked"}) == "linked"
+    with pytest.raises(ValueError, match="strategy"):
+        syncer._strategy({**linked, "strategy": "rpc"})
+    # bez linked_server by vzniklo OPENQUERY([None], ...) / [None].[db].dbo.
+    with pytest.raises(ValueError, match="pohoda_2024: strategy .* potřebuje linked_server"):
+        syncer._strategy({"database": "pohoda_2024", "strategy": no_linked_server})
+
+    opened = []
+    monkeypatch.setattr(s.pyodbc, "connect", lambda conn_str: opened.append(conn_str) or object())
+    assert syncer._pool_for(linked, "openquery") is syncer.mssql_pool
+    pool = syncer._pool_for(direct, "direct")
+    assert syncer._pool_for(direct, "direct") is pool
+    with pool.connection():
+        pass
+    assert "SERVER=archiv;DATABASE=pohoda_2023;" in opened[0]
+
+
+def test_sync_query_dimension_replaces_database_rows(tmp_path):
+    cursor = FakeCursor([("pohoda_2025", "1", "Lékárna")], columns=["_database", "ID", "Firma"])
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+    syncer.sync_query(db, s.dimension_query("AD"), backfill=False)
+
+    assert cursor.executed[0] == "SELECT 'pohoda_2025' AS _database, * FROM [SRV].[pohoda_2025].dbo.AD"
+    assert bq.loads[0][0].startswith("p.d.dim_AD_temp_")
+    assert "DELETE FROM `p.d.dim_AD` WHERE `_database` = 'pohoda_2025'" in bq.queries[0]
+
+
+# --- extract_backend ---------------------------------------------------------
+
+# Stejný výsledek dotazu jako řádky z pyodbc a jako Arrow dávka z driveru.
+BACKEND_COLUMNS = ["ID", "Datum", "Kc", "RefCin", "Storno", "GUID", "DatSave", "Vytvoreno"]
+BACKEND_ROWS = [
+    ("FA-1", datetime(2025, 3, 1, 10, 0, 5), decimal.Decimal("12.50"), 7, True,
+     uuid.UUID(int=1).bytes_le, datetime(2025, 3, 2, 8, 30), date(2025, 3, 1)),
+    ("FA-2", None, None, None, False, None, None, None),
+    ("FA-3", datetime(2025, 3, 3), decimal.Decimal("-0.01"), 9, None,
+     uuid.UUID(int=2**127).bytes_le, datetime(2025, 3, 4), date(2025, 3, 3)),
+]
+BACKEND_TYPES = [pa.string(), pa.timestamp("ns"), pa.decimal128(10, 2), pa.int32(), pa.bool_(),
+                 pa.binary(16), pa.timestamp("ns"), pa.date32()]
+
+
+def backend_batch() -> pa.Table:
+    columns = list(zip(*BACKEND_ROWS))
+    return pa.table(
+        [pa.array(list(c), type=t) for c, t in zip(columns, BACKEND_TYPES)], names=BACKEND_COLUMNS
+    )
+
+
+@pytest.mark.parametrize("source", ["names", "inferred"])
+def test_arrow_to_schema_matches_rows_to_arrow(source):
+    batch = backend_batch()
+    if source == "inferred":
+        schema = s.infer_bq_schema(s.arrow_description(batch.schema), BACKEND_COLUMNS)
+        assert [f.field_type for f in schema] == [
+            "STRING", "DATETIME", "NUMERIC", "INT64", "BOOL", "STRING", "DATETIME", "DATE"
+        ]
+    else:
+        schema = s.build_bq_schema(BACKEND_COLUMNS)
+    expected = s.rows_to_arrow(BACKEND_ROWS, schema)
+    assert s.arrow_to_schema(batch, schema).equals(expected)
+
+    schema = schema + [s.bigquery.SchemaField(s.ROW_HASH_COLUMN, "INT64")]
+    assert s.arrow_to_schema(batch, schema).equals(s.rows_to_arrow(BACKEND_ROWS, schema))
+
+
+class KeepingBQ(FakeBQ):
+    """FakeBQ, který si nechá i obsah nahraných dávek."""
+
+    def __init__(self):
+        super().__init__()
+        self.data = []
+
+    def load_table_from_file(self, buf, table_id, job_config=None):
+        import pyarrow.parquet as pq
+        self.data.append(pq.read_table(buf))
+        buf.seek(0)
+        return super().load_table_from_file(buf, table_id, job_config)
+
+
+def test_sync_query_arrow_odbc_backend_loads_same_data(tmp_path, monkeypatch):
+    query = {"file": str(tmp_path / "FA.sql"), "watermark_column": "DatSave"}
+    db = {"linked_server": "SRV", "database": "pohoda_2025"}
+
+    pyodbc_bq = KeepingBQ()
+    cursor = FakeCursor(BACKEND_ROWS, columns=BACKEND_COLUMNS)
+    make_block_syncer(tmp_path, cursor, pyodbc_bq).sync_query(db, query, backfill=False)
+
+    reads = []
+
+    def read_batches(sql, connection_string, batch_size):
+        reads.append((sql, connection_string, batch_size))
+        batch = backend_batch()
+        return pa.RecordBatchReader.from_batches(batch.schema, batch.to_batches(max_chunksize=2))
+
+    monkeypatch.setattr(s, "_read_arrow_batches", read_batches)
+    arrow_bq = KeepingBQ()
+    syncer = make_block_syncer(
+        tmp_path, FakeCursor([]), arrow_bq, extract_backend="arrow-odbc", batch_size=2,
+        state_file=str(tmp_path / "state_arrow.db"),
+    )
+    syncer.config["mssql"] = {"server": "hlavni", "database": "x", "username": "u",
+                              "password": "p", "driver": "D", "timeout": 30}
+    syncer.sync_query(db, query, backfill=False)
+
+    [(sql, conn_str, batch_size)] = reads
+    assert sql == cursor.executed[0].replace("?", "7")
+    assert "SERVER=hlavni;" in conn_str and batch_size == 2
+    assert [t.num_rows for t in arrow_bq.data] == [2, 1]
+    assert pa.concat_tables(arrow_bq.data).equals(pa.concat_tables(pyodbc_bq.data))
+    assert syncer.state.get_watermark("t", "pohoda_2025", "FA") == datetime(2025, 3, 4)
+
+
+def test_extract_backend_validation_and_missing_package(monkeypatch):
+    monkeypatch.setitem(sys.modules, "arrow_odbc", None)
+    with pytest.raises(ValueError, match="extract_backend"):
+        make_syncer(FakeBQ(), extract_backend="turbodbc")
+    cursor = s.ArrowOdbcCursor("DSN=x", 100)
+    with pytest.raises(RuntimeError, match="arrow-odbc"):
+        cursor.execute("SELECT 1")
+
+
+# --- benchmarks ----------------------------------------------------------------
+
+def test_benchmark_cases_run_offline():
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+    import bench_sync
+
+    for case in ("rows_to_arrow:names", "rows_to_arrow:typed", "arrow_to_schema:names",
+                 "arrow_to_schema:typed", "stream:workers3", "sync_query"):
+        result = bench_sync._run_case(case, "PH", 120, 1, 50, 0.0)
+        assert result["count"] == 120 and result["seconds"] > 0
+    assert result["loads"] == 3 and result["uploaded"] > 0
+
+
+# --- checkpointy (--resume) ----------------------------------------------------
+
+def test_resume_sql_orders_and_filters_by_key():
+    assert s.resume_sql("SELECT ID FROM FA;\n", "ID") == (
+        "SELECT *\nFROM (\nSELECT ID FROM FA\n) q\nORDER BY q.[ID]"
+    )
+    assert s.resume_sql("SELECT ID FROM FA", "ID", "?").endswith(
+        ") q\nWHERE q.[ID] > ?\nORDER BY q.[ID]"
+    )
+
+
+def test_table_checkpoint_saves_only_contiguous_prefix(tmp_path):
+    from sync_state import StateStore
+
+    store = StateStore(tmp_path / "state.db")
+    checkpoint = s.TableCheckpoint(store, "t", True, "pohoda_2023", "FA", "p.d.tmp", "ID")
+    checkpoint.batch_done(1, 10, 20)
+    assert store.get_checkpoint("t", True, "pohoda_2023", "FA") is None
+    checkpoint.batch_done(0, 10, 10)
+    saved = store.get_checkpoint("t", True, "pohoda_2023", "FA")
+    assert (saved["last_key"], saved["rows"], saved["temp_id"]) == (20, 20, "p.d.tmp")
+
+
+@pytest.mark.parametrize("sync_cfg", [{}, {"upload_workers": 3}, {"spool": True}])
+def test_stream_to_temp_checkpoints_every_path(tmp_path, sync_cfg):
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, FakeCursor(ROWS), bq, spool_dir=str(tmp_path), **sync_cfg)
+    checkpoint = s.TableCheckpoint(syncer.state, "t", True, "pohoda_2023", "FA", "p.d.t", "ID")
+    syncer._stream_to_temp(FakeCursor(ROWS), ["ID", "Kc"], SCHEMA, "p.d.t", 100,
+                           checkpoint=checkpoint)
+    saved = syncer.state.get_checkpoint("t", True, "pohoda_2023", "FA")
+    assert (saved["last_key"], saved["rows"]) == ("FA-1002", 1003)
+
+
+def test_sync_query_resume_continues_from_last_uploaded_key(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "resume_key": "ID"}
+    db = {"linked_server": "SRV", "database": "pohoda_2023"}
+    rows = [(i, decimal.Decimal(i)) for i in range(1, 251)]
+    bq = FakeBQ()
+
+    cursor = FakeCursor(rows, fail_after=200, columns=["ID", "Kc"])
+    syncer = make_block_syncer(tmp_path, cursor, bq, batch_size=100)
+    with pytest.raises(RuntimeError, match="spojení přerušeno"):
+        syncer.sync_query(db, query, backfill=False)
+    assert cursor.executed[0].endswith(") q\nORDER BY q.[ID]")
+    temp_id = bq.loads[0][0]
+    assert bq.deleted.count(temp_id) == 1  # jen delete před založením, po chybě zůstává
+    saved = syncer.state.get_checkpoint("t", False, "pohoda_2023", "FA")
+    assert (saved["status"], saved["last_key"], saved["rows"]) == ("partial", "200", 200)
+    # ponechaná temp tabulka sama vyprší (výchozí resume_keep_days = 7)
+    [(updated_id, fields)] = bq.updated
+    assert updated_id == temp_id
+    assert timedelta(days=6) < fields["expires"] - datetime.now(timezone.utc) <= timedelta(days=7)
+
+    cursor = FakeCursor(rows[200:], columns=["ID", "Kc"])
+    syncer = make_block_syncer(tmp_path, cursor, bq, batch_size=100)
+    syncer._resume = True
+    syncer.sync_query(db, query, backfill=False)
+    assert "WHERE q.[ID] > ?" in cursor.executed[0]
+    assert cursor.params[0] == [7, "200"]
+    assert len(bq.created) == 1  # temp tabulka se nezakládá znovu
+    assert bq.updated[-1] == (temp_id, {"expires": None})  # při navázání se expirace zruší
+    assert {t for t, _ in bq.loads} == {temp_id}
+    assert sum(n for _, n in bq.loads) == 250
+    assert bq.deleted.count(temp_id) == 2
+    assert syncer.state.get_checkpoint("t", False, "pohoda_2023", "FA")["status"] == "done"
+
+    # hotová dvojice se při --resume přeskočí
+    cursor = FakeCursor(rows, columns=["ID", "Kc"])
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    syncer._resume = True
+    syncer.sync_query(db, query, backfill=False)
+    assert cursor.executed == []
+    assert syncer.report["tables"][-1]["outcome"] == "skipped"
+
+
+def test_sync_query_resume_without_temp_table_starts_over(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "resume_key": "ID"}
+    db = {"linked_server": "SRV", "database": "pohoda_2023"}
+    cursor = FakeCursor([(1, decimal.Decimal(1))], columns=["ID", "Kc"])
+    syncer = make_block_syncer(tmp_path, cursor, FakeBQ())
+    syncer.state.set_checkpoint("t", False, "pohoda_2023", "FA", "partial", "p.d.gone", "5", 5)
+    syncer._resume = True
+    syncer.sync_query(db, query, backfill=False)
+    assert "WHERE" not in cursor.executed[0].split(") q")[-1]
+    assert cursor.params[0] == [7]
+
+
+def test_sync_query_rejects_resume_key_without_exact_roundtrip(tmp_path):
+    query = {"file": str(tmp_path / "FA.sql"), "resume_key": "DatSave"}
+    db = {"linked_server": "SRV", "database": "pohoda_2023"}
+    cursor = FakeCursor([("FA-1", datetime(2023, 1, 1, 8, 0, 0, 123000))])
+    cursor.description = [("ID", str), ("DatSave", datetime)]
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, cursor, bq)
+    with pytest.raises(ValueError, match="resume_key 'DatSave' má typ datetime"):
+        syncer.sync_query(db, query, backfill=False)
+    assert bq.created == [] and bq.loads == []
+
+
+def test_run_resume_only_keeps_checkpoints_of_other_queries(tmp_path, monkeypatch):
+    (tmp_path / "PH.sql").write_text("SELECT * FROM PH", encoding="utf-8")
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, FakeCursor([], columns=["ID", "Kc"]), bq)
+    fa, ph = str(tmp_path / "FA.sql"), str(tmp_path / "PH.sql")
+    syncer.config["sync"]["queries"] = [{"file": fa}, {"file": ph, "resume_key": "ID"}]
+    syncer.config["databases"] = {
+        "current": {"linked_server": "SRV", "database": "pohoda_2025"},
+        "history": [{"linked_server": "SRV", "database": "pohoda_2023"}],
+    }
+    for name in ("connect_mssql", "connect_bigquery", "close"):
+        monkeypatch.setattr(syncer, name, lambda: None)
+    syncer.state.set_checkpoint("t", True, "pohoda_2023", "FA", "partial", "p.d.FA_tmp", 9, 9)
+    syncer.state.set_checkpoint("t", True, "pohoda_2023", "PH", "partial", "p.d.PH_tmp", 9, 9)
+
+    assert syncer.run(backfill=True, only=[fa], resume=True)
+    # FA zpracováno (i s temp tabulkou z přerušení), rozpracované PH čeká na další --resume
+    assert bq.deleted.count("p.d.FA_tmp") == 1
+    assert "p.d.PH_tmp" not in bq.deleted
+    assert [(c["database"], c["table_name"]) for c in syncer.state.checkpoints("t")] == [
+        ("pohoda_2023", "PH")
+    ]
+
+
+def test_sync_query_resume_key_refuses_unwrappable_query(tmp_path):
+    cursor = FakeCursor([])
+    syncer = make_block_syncer(tmp_path, cursor, FakeBQ())
+    query = {"sql": "SELECT ID FROM FA ORDER BY ID", "table": "FA", "resume_key": "ID"}
+    with pytest.raises(ValueError, match="FA: resume_key nejde použít - dotaz končí ORDER BY"):
+        syncer.sync_query({"linked_server": "SRV", "database": "pohoda_2023"}, query, False)
+    assert cursor.executed == []
+
+
+def test_run_without_resume_discards_checkpoints_and_kept_temp(tmp_path):
+    bq = FakeBQ()
+    syncer = make_block_syncer(tmp_path, FakeCursor([]), bq)
+    syncer.state.set_checkpoint("t", True, "pohoda_2023", "FA", "partial", "p.d.FA_tmp", "9", 9)
+    syncer.state.set_checkpoint("t", True, "pohoda_2023", "PH", "done")
+    syncer.state.set_checkpoint("t", False, "pohoda_2025", "FA", "done")
+    syncer._discard_checkpoints(True)
+    assert bq.deleted == ["p.d.FA_tmp"]
+    assert [c["backfill"] for c in syncer.state.checkpoints("t")] == [0]
+
+
+def test_parse_args_resume():
+    assert s.parse_args(["--backfill", "--resume"]).resume
+    assert not s.parse_args([]).resume